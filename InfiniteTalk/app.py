@@ -16,12 +16,12 @@ import random
 import torch
 import torch.distributed as dist
 from PIL import Image
-import subprocess
 
 import wan
 from wan.configs import SIZE_CONFIGS, SUPPORTED_SIZES, WAN_CONFIGS
 from wan.utils.utils import cache_image, cache_video, str2bool
 from wan.utils.multitalk_utils import save_video_ffmpeg
+from wan.utils.media_ingest import extract_audio
 from kokoro import KPipeline
 from transformers import Wav2Vec2FeatureExtractor
 from src.audio_analysis.wav2vec2 import Wav2Vec2Model
@@ -324,25 +324,10 @@ def get_embedding(speech_array, wav2vec_feature_extractor, audio_encoder, sr=160
     return audio_emb
 
 def extract_audio_from_video(filename, sample_rate):
-    raw_audio_path = filename.split('/')[-1].split('.')[0]+'.wav'
-    ffmpeg_command = [
-        "ffmpeg",
-        "-y",
-        "-i",
-        str(filename),
-        "-vn",
-        "-acodec",
-        "pcm_s16le",
-        "-ar",
-        "16000",
-        "-ac",
-        "2",
-        str(raw_audio_path),
-    ]
-    subprocess.run(ffmpeg_command, check=True)
+    # the 16 kHz wav is kept in the content-addressed media cache, not in the working directory
+    raw_audio_path = extract_audio(str(filename), 16000)
     human_speech_array, sr = librosa.load(raw_audio_path, sr=sample_rate)
     human_speech_array = loudness_norm(human_speech_array, sr)
-    os.remove(raw_audio_path)
 
     return human_speech_array
 
@@ -14,22 +14,23 @@ import random
 import torch
 import torch.distributed as dist
 from PIL import Image
-import subprocess
 
 import wan
 from wan.configs import SIZE_CONFIGS, SUPPORTED_SIZES, WAN_CONFIGS
-from wan.utils.utils import str2bool, is_video, split_wav_librosa
+from wan.utils.utils import str2bool, is_video
 from wan.utils.multitalk_utils import save_video_ffmpeg
+from wan.utils.frame_sink import EncoderSink, HLSSink, HoldPadSink, MemmapSink
+from wan.utils.media_ingest import configure_media_cache
+from wan.utils.audio_ingest import AudioIngest
+from wan.utils.embedding_cache import EmbeddingCache
 from kokoro import KPipeline
 from transformers import Wav2Vec2FeatureExtractor
-from src.audio_analysis.wav2vec2 import Wav2Vec2Model
+from src.audio_analysis.wav2vec2 import Wav2Vec2Model, hidden_state_drift, quantize_encoder_int8
 from wan.utils.segvideo import shot_detect
 
 
 import librosa
-import pyloudnorm as pyln
 import numpy as np
-from einops import rearrange
 import soundfile as sf
 import re
 
@@ -85,8 +86,8 @@ def _parse_args():
     parser.add_argument(
         "--max_frame_num",
         type=int,
-        default=1000,
-        help="The max frame lenght of the generated video."
+        default=None,
+        help="The max frame lenght of the generated video. Defaults to the length of the audio."
     )
     parser.add_argument(
         "--ckpt_dir",
@@ -231,6 +232,214 @@ def _parse_args():
         default=0.2,
         help="Threshold for teacache."
     )
+    parser.add_argument(
+        "--token_merge_ratios",
+        type=float,
+        nargs='+',
+        default=None,
+        help="Merge this fraction of background tokens (outside the human masks / bbox) before self-attention and FFN. One value per sampling step, the last value is repeated."
+    )
+    parser.add_argument(
+        "--audio_attn_mask_dilation",
+        type=int,
+        default=None,
+        help="Run audio cross-attention only on tokens inside the human masks / bbox, dilated by this many latent tokens. Disabled by default."
+    )
+    parser.add_argument(
+        "--roi_mode",
+        action="store_true",
+        default=False,
+        help="For image inputs, generate only the face region (bbox or detected face) and composite it onto the static reference image."
+    )
+    parser.add_argument(
+        "--roi_margin",
+        type=float,
+        default=0.6,
+        help="Padding around the face box in roi_mode, as a fraction of its larger side."
+    )
+    parser.add_argument(
+        "--roi_bucket_scale",
+        type=float,
+        default=1.0,
+        help="Scale of the crop bucket in roi_mode, smaller values render fewer tokens."
+    )
+    parser.add_argument(
+        "--roi_feather",
+        type=int,
+        default=16,
+        help="Width in pixels of the blend ramp at the crop border in roi_mode."
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        default=False,
+        help="Compile the DiT blocks and VAE decoder with torch.compile for static bucket shapes."
+    )
+    parser.add_argument(
+        "--compile_cache_dir",
+        type=str,
+        default='compile_cache',
+        help="Directory where compiled artifacts are persisted across processes."
+    )
+    parser.add_argument(
+        "--compile_warmup",
+        action="store_true",
+        default=False,
+        help="With --compile, compile every size bucket of --size at startup (one DiT forward and VAE decode each) and save the compile cache, so no job pays the compile."
+    )
+    parser.add_argument(
+        "--compile_suppress_errors",
+        action="store_true",
+        default=False,
+        help="Fall back to eager mode when a graph fails to compile instead of raising (process-wide dynamo setting)."
+    )
+    parser.add_argument(
+        "--gc_threshold",
+        type=float,
+        default=0.9,
+        help="Release the CUDA cache only when reserved memory exceeds this fraction of device memory (component swaps always release)."
+    )
+    parser.add_argument(
+        "--pad_encode_tol",
+        type=float,
+        default=None,
+        help="Encode the zero-padded conditioning clip only until the causal VAE cache converges, filling the rest from the steady-state latent; the value is the per-slice convergence tolerance."
+    )
+    parser.add_argument(
+        "--pad_encode_check",
+        action="store_true",
+        default=False,
+        help="Also run the full padded VAE encode, log the deviation and fall back to it when it exceeds --pad_encode_check_tol."
+    )
+    parser.add_argument(
+        "--pad_encode_check_tol",
+        type=float,
+        default=1e-3,
+        help="Largest relative error of the padded encode latents against the full encode, |mu - full| / |full|, accepted by --pad_encode_check."
+    )
+    parser.add_argument(
+        "--cond_batch_size",
+        type=int,
+        default=1,
+        help="Condition frames per CLIP / VAE batch when precomputing the conditioning of video inputs. The VAE encode activation peak grows with it."
+    )
+    parser.add_argument(
+        "--serial_chunk_finish",
+        action="store_true",
+        default=False,
+        help="Copy and color-correct every decoded chunk on the main thread instead of overlapping it with the next chunk."
+    )
+    parser.add_argument(
+        "--latent_motion",
+        action="store_true",
+        default=False,
+        help="Take the motion-frame latents from the previous chunk's final latent instead of re-encoding the decoded motion frames (experimental)."
+    )
+    parser.add_argument(
+        "--latent_motion_check",
+        action="store_true",
+        default=False,
+        help="With --latent_motion, also re-encode the decoded motion frames and log the latent drift per chunk."
+    )
+    parser.add_argument(
+        "--fixed_chunk_length",
+        action="store_true",
+        default=False,
+        help="Generate the last chunk at the full frame_num length instead of the shortest 4n+1 length that covers the audio."
+    )
+    parser.add_argument(
+        "--frame_sink",
+        type=str,
+        default="none",
+        choices=["none", "encoder", "memmap", "hls"],
+        help="Hand every finished chunk to a video encoder, an mmap'd uint8 spill file or HLS segments instead of keeping the whole decoded video in host memory. Together with the per-chunk conditioning and audio windows, memory no longer grows with the video length."
+    )
+    parser.add_argument(
+        "--hls_dir",
+        type=str,
+        default=None,
+        help="Directory of the HLS playlist and segments with --frame_sink hls, defaults to <save_file>_hls."
+    )
+    parser.add_argument(
+        "--renditions",
+        type=str,
+        nargs='+',
+        default=None,
+        help="Extra renditions encoded from the same frames, as HEIGHT:BITRATE (e.g. 720:4M 480:1500k); written next to the main output as <save_file>_<HEIGHT>p.mp4."
+    )
+    parser.add_argument(
+        "--media_cache_dir",
+        type=str,
+        default=None,
+        help="Content-addressed cache of probed, transcoded and extracted input media, defaults to ~/.cache/infinitetalk/media."
+    )
+    parser.add_argument(
+        "--media_cache_gb",
+        type=float,
+        default=20,
+        help="Size of the media cache in GB, least recently used sources are evicted beyond it."
+    )
+    parser.add_argument(
+        "--audio_emb_cache_dir",
+        type=str,
+        default=os.path.join(os.path.expanduser('~'), '.cache', 'infinitetalk', 'audio_emb'),
+        help="Cache of wav2vec embeddings keyed by the normalized waveform and the encoder, stored as fp16 safetensors."
+    )
+    parser.add_argument(
+        "--audio_emb_cache_gb",
+        type=float,
+        default=10,
+        help="Size of the audio embedding cache in GB, least recently used embeddings are evicted beyond it."
+    )
+    parser.add_argument(
+        "--wav2vec_window",
+        type=int,
+        default=None,
+        help="Encode long audio in wav2vec windows of this many frames (at 25 fps), each run with 5 s of context on either side. Approximates full attention; by default every track is encoded whole."
+    )
+    parser.add_argument(
+        "--wav2vec_device",
+        type=str,
+        default='auto',
+        choices=['auto', 'cpu'],
+        help="Where the wav2vec encoder runs: this rank's GPU when one is available (auto) or the CPU."
+    )
+    parser.add_argument(
+        "--wav2vec_int8",
+        action="store_true",
+        default=False,
+        help="Run the wav2vec encoder on the CPU with int8 dynamic quantization of its transformer linear layers."
+    )
+    parser.add_argument(
+        "--wav2vec_int8_check",
+        action="store_true",
+        default=False,
+        help="With --wav2vec_int8, also encode the first tracks with the fp32 encoder and log the drift of the hidden states."
+    )
+    parser.add_argument(
+        "--wav2vec_threads",
+        type=int,
+        default=None,
+        help="CPU threads for torch (and so the CPU wav2vec encoder), leaving the rest for pipelined jobs."
+    )
+    parser.add_argument(
+        "--eager_audio_windows",
+        action="store_true",
+        default=False,
+        help="Move the audio windows of the whole job to the GPU up front instead of gathering every chunk's windows from the (memory-mapped) host embeddings."
+    )
+    parser.add_argument(
+        "--trim_silence",
+        type=float,
+        default=None,
+        help="Cap the silence before the first and after the last voiced frame of the audio at this many seconds before generation (off by default)."
+    )
+    parser.add_argument(
+        "--restore_duration",
+        action="store_true",
+        default=False,
+        help="With --trim_silence, hold the first / last generated frame over the trimmed silence so the output keeps the full audio and duration."
+    )
     parser.add_argument(
         "--use_apg",
         action="store_true",
@@ -274,41 +483,14 @@ def _parse_args():
 
     return args
 
-def custom_init(device, wav2vec):    
+def custom_init(device, wav2vec, int8=False):    
     audio_encoder = Wav2Vec2Model.from_pretrained(wav2vec, local_files_only=True).to(device)
     audio_encoder.feature_extractor._freeze_parameters()
+    if int8:
+        audio_encoder = quantize_encoder_int8(audio_encoder.eval())
     wav2vec_feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(wav2vec, local_files_only=True)
     return wav2vec_feature_extractor, audio_encoder
 
-def loudness_norm(audio_array, sr=16000, lufs=-23):
-    meter = pyln.Meter(sr)
-    loudness = meter.integrated_loudness(audio_array)
-    if abs(loudness) > 100:
-        return audio_array
-    normalized_audio = pyln.normalize.loudness(audio_array, loudness, lufs)
-    return normalized_audio
-
-def audio_prepare_multi(left_path, right_path, audio_type, sample_rate=16000):
-
-    if not (left_path=='None' or right_path=='None'):
-        human_speech_array1 = audio_prepare_single(left_path)
-        human_speech_array2 = audio_prepare_single(right_path)
-    elif left_path=='None':
-        human_speech_array2 = audio_prepare_single(right_path)
-        human_speech_array1 = np.zeros(human_speech_array2.shape[0])
-    elif right_path=='None':
-        human_speech_array1 = audio_prepare_single(left_path)
-        human_speech_array2 = np.zeros(human_speech_array1.shape[0])
-
-    if audio_type=='para':
-        new_human_speech1 = human_speech_array1
-        new_human_speech2 = human_speech_array2
-    elif audio_type=='add':
-        new_human_speech1 = np.concatenate([human_speech_array1[: human_speech_array1.shape[0]], np.zeros(human_speech_array2.shape[0])]) 
-        new_human_speech2 = np.concatenate([np.zeros(human_speech_array1.shape[0]), human_speech_array2[:human_speech_array2.shape[0]]])
-    sum_human_speechs = new_human_speech1 + new_human_speech2
-    return new_human_speech1, new_human_speech2, sum_human_speechs
-
 def _init_logging(rank):
     # logging
     if rank == 0:
@@ -320,63 +502,22 @@ def _init_logging(rank):
     else:
         logging.basicConfig(level=logging.ERROR)
 
-def get_embedding(speech_array, wav2vec_feature_extractor, audio_encoder, sr=16000, device='cpu'):
-    audio_duration = len(speech_array) / sr
-    video_length = audio_duration * 25 # Assume the video fps is 25
-
-    # wav2vec_feature_extractor
-    audio_feature = np.squeeze(
-        wav2vec_feature_extractor(speech_array, sampling_rate=sr).input_values
-    )
-    audio_feature = torch.from_numpy(audio_feature).float().to(device=device)
-    audio_feature = audio_feature.unsqueeze(0)
-
-    # audio encoder
-    with torch.no_grad():
-        embeddings = audio_encoder(audio_feature, seq_len=int(video_length), output_hidden_states=True)
-
-    if len(embeddings) == 0:
-        print("Fail to extract audio embedding")
-        return None
-
-    audio_emb = torch.stack(embeddings.hidden_states[1:], dim=1).squeeze(0)
-    audio_emb = rearrange(audio_emb, "b s d -> s b d")
-
-    audio_emb = audio_emb.cpu().detach()
-    return audio_emb
-
-def extract_audio_from_video(filename, sample_rate):
-    raw_audio_path = filename.split('/')[-1].split('.')[0]+'.wav'
-    ffmpeg_command = [
-        "ffmpeg",
-        "-y",
-        "-i",
-        str(filename),
-        "-vn",
-        "-acodec",
-        "pcm_s16le",
-        "-ar",
-        "16000",
-        "-ac",
-        "2",
-        str(raw_audio_path),
+def get_embeddings(speech_arrays, wav2vec_feature_extractor, audio_encoder, sr=16000, device='cpu', window=None, batch_size=8):
+    """
+    wav2vec hidden states [T, num_layers, C] at 25 fps of several tracks in one pass on `device`,
+    without attention maps. Every track is encoded whole unless `window` is given; then long tracks
+    are encoded in overlapping windows of `window` frames, the windows of all tracks batched together.
+    """
+    input_values = [
+        torch.from_numpy(np.squeeze(wav2vec_feature_extractor(speech_array, sampling_rate=sr).input_values)).float().to(device)
+        for speech_array in speech_arrays
     ]
-    subprocess.run(ffmpeg_command, check=True)
-    human_speech_array, sr = librosa.load(raw_audio_path, sr=sample_rate)
-    human_speech_array = loudness_norm(human_speech_array, sr)
-    os.remove(raw_audio_path)
-
-    return human_speech_array
-
-def audio_prepare_single(audio_path, sample_rate=16000):
-    ext = os.path.splitext(audio_path)[1].lower()
-    if ext in ['.mp4', '.mov', '.avi', '.mkv']:
-        human_speech_array = extract_audio_from_video(audio_path, sample_rate)
-        return human_speech_array
-    else:
-        human_speech_array, sr = librosa.load(audio_path, sr=sample_rate)
-        human_speech_array = loudness_norm(human_speech_array, sr)
-        return human_speech_array
+    seq_lens = [int(len(speech_array) / sr * 25) for speech_array in speech_arrays] # Assume the video fps is 25
+    audio_encoder.to(device)
+    with torch.no_grad():
+        audio_embs = audio_encoder.encode_long(input_values, seq_lens, window=window, batch_size=batch_size)
+    audio_encoder.cpu()
+    return [audio_emb.cpu() for audio_emb in audio_embs]
 
 def process_tts_single(text, save_dir, voice1):    
     s1_sentences = []
@@ -506,6 +647,9 @@ def generate(args):
     #         raise NotImplementedError(
     #             f"Unsupport prompt_extend_method: {args.prompt_extend_method}")
 
+    # probes, transcodes and extracted audio of the inputs, shared with the pipeline
+    configure_media_cache(args.media_cache_dir, int(args.media_cache_gb * 1024 ** 3))
+
     cfg = WAN_CONFIGS[args.task]
     if args.ulysses_size > 1:
         assert cfg.num_heads % args.ulysses_size == 0, f"`{cfg.num_heads=}` cannot be divided evenly by `{args.ulysses_size=}`."
@@ -543,15 +687,59 @@ def generate(args):
         wan_i2v.enable_vram_management(
             num_persistent_param_in_dit=args.num_persistent_param_in_dit
         )
+    if args.compile:
+        wan_i2v.enable_compile(args.compile_cache_dir, frame_num=args.frame_num,
+                               token_merge=args.token_merge_ratios is not None,
+                               suppress_errors=args.compile_suppress_errors)
+        if args.compile_warmup:
+            wan_i2v.precompile(args.size, frame_num=args.frame_num)
     
     generated_list = []
     with open(args.input_json, 'r', encoding='utf-8') as f:
         input_data = json.load(f)
         
-    wav2vec_feature_extractor, audio_encoder= custom_init('cpu', args.wav2vec_dir)
+    # wav2vec runs on this rank's GPU when there is one, and only for the duration of the encode; the
+    # int8 path keeps it on the CPU, next to the GPU-bound DiT
+    if args.wav2vec_threads is not None:
+        torch.set_num_threads(args.wav2vec_threads)
+    if args.wav2vec_int8 or args.wav2vec_device == 'cpu' or not torch.cuda.is_available():
+        wav2vec_device = torch.device('cpu')
+    else:
+        wav2vec_device = torch.device(f"cuda:{local_rank}")
+    wav2vec_feature_extractor, audio_encoder= custom_init('cpu', args.wav2vec_dir, int8=args.wav2vec_int8)
+    reference_encoder = None
+    if args.wav2vec_int8 and args.wav2vec_int8_check:
+        _, reference_encoder = custom_init('cpu', args.wav2vec_dir)
+    # voice tracks reused across jobs are encoded once, the embeddings are memory-mapped from the cache
+    embedding_cache = EmbeddingCache(args.audio_emb_cache_dir, int(args.audio_emb_cache_gb * 1024 ** 3))
+    wav2vec_id = os.path.realpath(args.wav2vec_dir) + (':int8' if args.wav2vec_int8 else '')
+    if args.wav2vec_window is not None:
+        # windowed embeddings differ from full-attention ones, cache them apart
+        wav2vec_id += f':window{args.wav2vec_window}'
+
+    def encode(missing):
+        nonlocal reference_encoder
+        audio_embs = get_embeddings(missing, wav2vec_feature_extractor, audio_encoder,
+                                    device=wav2vec_device, window=args.wav2vec_window)
+        if reference_encoder is not None:
+            # once per run: drift of the int8 hidden states against the fp32 encoder
+            reference = get_embeddings(missing, wav2vec_feature_extractor, reference_encoder,
+                                       device=wav2vec_device, window=args.wav2vec_window)
+            drift = hidden_state_drift(reference, audio_embs)
+            logging.info(f"wav2vec int8 drift: max abs {drift['max_abs']:.4f}, "
+                         f"relative L2 {drift['rel_l2']:.4f}, min layer cosine {drift['cosine']:.5f}")
+            if drift['rel_l2'] > 0.05:
+                logging.warning("wav2vec int8 drift is above 5%, consider the fp32 encoder.")
+            reference_encoder = None
+        return audio_embs
+
+    def embed(*speeches):
+        return embedding_cache.get_many(speeches, wav2vec_id, encode)
     args.audio_save_dir = os.path.join(args.audio_save_dir, input_data['cond_video'].split('/')[-1].split('.')[0])
     os.makedirs(args.audio_save_dir,exist_ok=True)
     
+    # every speech input is decoded and loudness-normalized once, in memory
+    audio_ingest = AudioIngest(sample_rate=16000)
     conds_list = []
 
     if args.scene_seg and is_video(input_data['cond_video']):
@@ -562,11 +750,11 @@ def generate(args):
             if len(input_data['cond_audio'])==2:
                 conds_list.append([input_data['cond_audio']['person2']])
         else:
-            audio1_list = split_wav_librosa(input_data['cond_audio']['person1'], time_list, args.audio_save_dir)
+            audio1_list = audio_ingest.split(input_data['cond_audio']['person1'], time_list)
             conds_list.append(cond_list)
             conds_list.append(audio1_list)
             if len(input_data['cond_audio'])==2:
-                audio2_list = split_wav_librosa(input_data['cond_audio']['person2'], time_list, args.audio_save_dir)
+                audio2_list = audio_ingest.split(input_data['cond_audio']['person2'], time_list)
                 conds_list.append(audio2_list)
     else:
         conds_list.append([input_data['cond_video']])
@@ -574,17 +762,58 @@ def generate(args):
         if len(input_data['cond_audio'])==2:
             conds_list.append([input_data['cond_audio']['person2']])
 
+    # the muxers take the mix as an array
     if len(input_data['cond_audio'])==2:
-        new_human_speech1, new_human_speech2, sum_human_speechs = audio_prepare_multi(input_data['cond_audio']['person1'], input_data['cond_audio']['person2'], input_data['audio_type'])
-        sum_audio = os.path.join(args.audio_save_dir, 'sum_all.wav')
-        sf.write(sum_audio, sum_human_speechs, 16000)
-        input_data['video_audio'] = sum_audio
+        new_human_speech1, new_human_speech2, sum_human_speechs = audio_ingest.multi(input_data['cond_audio']['person1'], input_data['cond_audio']['person2'], input_data['audio_type'])
+        input_data['video_audio'] = sum_human_speechs
     else:
-        human_speech = audio_prepare_single(input_data['cond_audio']['person1'])
-        sum_audio = os.path.join(args.audio_save_dir, 'sum_all.wav')
-        sf.write(sum_audio, human_speech, 16000)
-        input_data['video_audio'] = sum_audio
+        human_speech = audio_ingest.single(input_data['cond_audio']['person1'])
+        input_data['video_audio'] = human_speech
+
+    # silence at both ends is capped before generation, every trimmed second is 25 DiT frames less;
+    # with --restore_duration the output holds the first / last frame over it and keeps the full audio
+    audio_bounds = None
+    hold_pad = None
+    if args.trim_silence is not None:
+        samples_per_frame = 16000 // 25
+        num_samples = len(input_data['video_audio'])
+        start, end = audio_ingest.voice_bounds(input_data['video_audio'], max_silence=args.trim_silence)
+        if len(conds_list[0]) > 1:
+            logging.info("Silence trimming is skipped for scene-split inputs.")
+        elif (end - start) // samples_per_frame <= args.frame_num:
+            logging.info("Silence trimming is skipped, the trimmed audio would be shorter than one clip.")
+        elif (start, end) != (0, num_samples):
+            audio_bounds = (start, end)
+            logging.info(f"Trimmed {start / 16000:.2f}s of leading and {(num_samples - end) / 16000:.2f}s of trailing silence.")
+            if args.restore_duration:
+                hold_pad = (start // samples_per_frame, (num_samples - end) // samples_per_frame)
+            else:
+                input_data['video_audio'] = input_data['video_audio'][start:end]
     logging.info("Generating video ...")
+
+    if args.save_file is None:
+        formatted_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        formatted_prompt = input_data['prompt'].replace(" ", "_").replace("/",
+                                                                    "_")[:50]
+        args.save_file = f"{args.task}_{args.size.replace('*','x') if sys.platform=='win32' else args.size}_{args.ulysses_size}_{args.ring_size}_{formatted_prompt}_{formatted_time}"
+
+    renditions = None
+    if args.renditions is not None:
+        renditions = [(int(height), bitrate) for height, bitrate in (r.split(':') for r in args.renditions)]
+
+    # stream finished chunks out instead of concatenating the whole video in memory
+    frame_sink = None
+    if rank == 0 and args.frame_sink == 'encoder':
+        frame_sink = EncoderSink(args.save_file + ".mp4", fps=25, audio=input_data['video_audio'], renditions=renditions)
+    elif rank == 0 and args.frame_sink == 'memmap':
+        frame_sink = MemmapSink(args.save_file + "-frames.u8")
+    elif rank == 0 and args.frame_sink == 'hls':
+        # one ffmpeg process writes the segments with a continuous audio track, the final mp4 is a stream-copy remux
+        hls_dir = args.hls_dir if args.hls_dir is not None else args.save_file + "_hls"
+        frame_sink = HLSSink(hls_dir, fps=25, final_path=args.save_file + ".mp4", audio=input_data['video_audio'])
+        logging.info(f"Streaming HLS playlist to {frame_sink.playlist}")
+    if hold_pad is not None and frame_sink is not None and not isinstance(frame_sink, MemmapSink):
+        frame_sink = HoldPadSink(frame_sink, *hold_pad)
         
     for idx, items in enumerate(zip(*conds_list)):
         print(items)
@@ -599,34 +828,27 @@ def generate(args):
         cond_audio = {}
         if args.audio_mode=='localfile':
             if len(input_data['cond_audio'])==2:
-                new_human_speech1, new_human_speech2, sum_human_speechs = audio_prepare_multi(items[1], items[2], input_data['audio_type'])
-                audio_embedding_1 = get_embedding(new_human_speech1, wav2vec_feature_extractor, audio_encoder)
-                audio_embedding_2 = get_embedding(new_human_speech2, wav2vec_feature_extractor, audio_encoder)
-                emb1_path = os.path.join(args.audio_save_dir, '1.pt')
-                emb2_path = os.path.join(args.audio_save_dir, '2.pt')
-                sum_audio = os.path.join(args.audio_save_dir, 'sum.wav')
-                sf.write(sum_audio, sum_human_speechs, 16000)
-                torch.save(audio_embedding_1, emb1_path)
-                torch.save(audio_embedding_2, emb2_path)
-                cond_audio['person1'] = emb1_path
-                cond_audio['person2'] = emb2_path
-                input_clip['video_audio'] = sum_audio
+                new_human_speech1, new_human_speech2, sum_human_speechs = audio_ingest.multi(items[1], items[2], input_data['audio_type'])
+                if audio_bounds is not None:
+                    new_human_speech1, new_human_speech2, sum_human_speechs = (
+                        speech[audio_bounds[0]:audio_bounds[1]] for speech in (new_human_speech1, new_human_speech2, sum_human_speechs))
+                audio_embedding_1, audio_embedding_2 = embed(new_human_speech1, new_human_speech2)
+                cond_audio['person1'] = audio_embedding_1
+                cond_audio['person2'] = audio_embedding_2
+                input_clip['video_audio'] = sum_human_speechs
                 v_length = audio_embedding_1.shape[0]
             elif len(input_data['cond_audio'])==1:
-                human_speech = audio_prepare_single(items[1])
-                audio_embedding = get_embedding(human_speech, wav2vec_feature_extractor, audio_encoder)
-                emb_path = os.path.join(args.audio_save_dir, '1.pt')
-                sum_audio = os.path.join(args.audio_save_dir, 'sum.wav')
-                sf.write(sum_audio, human_speech, 16000)
-                torch.save(audio_embedding, emb_path)
-                cond_audio['person1'] = emb_path
-                input_clip['video_audio'] = sum_audio
+                human_speech = audio_ingest.single(items[1])
+                if audio_bounds is not None:
+                    human_speech = human_speech[audio_bounds[0]:audio_bounds[1]]
+                audio_embedding, = embed(human_speech)
+                cond_audio['person1'] = audio_embedding
+                input_clip['video_audio'] = human_speech
                 v_length = audio_embedding.shape[0]
         
         input_clip['cond_audio'] = cond_audio
                     
-        video = wan_i2v.generate_infinitetalk(
-            input_clip,
+        generate_kwargs = dict(
             size_buckget=args.size,
             motion_frame=args.motion_frame,
             frame_num=args.frame_num,
@@ -639,20 +861,40 @@ def generate(args):
             max_frames_num=args.frame_num if args.mode == 'clip' else args.max_frame_num,
             color_correction_strength = args.color_correction_strength,
             extra_args=args,
+            frame_sink=frame_sink,
             )
+        if args.roi_mode:
+            video = wan_i2v.generate_infinitetalk_roi(
+                input_clip,
+                roi_margin=args.roi_margin,
+                roi_bucket_scale=args.roi_bucket_scale,
+                roi_feather=args.roi_feather,
+                **generate_kwargs)
+        else:
+            video = wan_i2v.generate_infinitetalk(input_clip, **generate_kwargs)
         
-        generated_list.append(video)
+        if frame_sink is None:
+            generated_list.append(video)
 
     if rank == 0:
         
-        if args.save_file is None:
-            formatted_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-            formatted_prompt = input_clip['prompt'].replace(" ", "_").replace("/",
-                                                                        "_")[:50]
-            args.save_file = f"{args.task}_{args.size.replace('*','x') if sys.platform=='win32' else args.size}_{args.ulysses_size}_{args.ring_size}_{formatted_prompt}_{formatted_time}"
-        
-        sum_video = torch.cat(generated_list, dim=1)
-        save_video_ffmpeg(sum_video, args.save_file, [input_data['video_audio']], high_quality_save=False)
+        if frame_sink is None:
+            sum_video = torch.cat(generated_list, dim=1)
+            save_video_ffmpeg(sum_video, args.save_file, [input_data['video_audio']], high_quality_save=False, renditions=renditions,
+                              hold_pad=hold_pad)
+        elif isinstance(frame_sink, MemmapSink):
+            frame_sink.close()
+            frames = frame_sink.frames()
+            encoder = EncoderSink(args.save_file + ".mp4", fps=25, audio=input_data['video_audio'], renditions=renditions)
+            if hold_pad is not None:
+                encoder = HoldPadSink(encoder, *hold_pad)
+            with encoder:
+                for start in range(0, len(frames), args.frame_num):
+                    encoder.write_uint8(frames[start:start + args.frame_num])
+            del frames
+            frame_sink.remove()
+        else:
+            frame_sink.close()
    
     logging.info(f"Saving generated video to {args.save_file}.mp4")  
     logging.info("Finished.")
@@ -1,3 +1,5 @@
+import torch
+import torch.nn as nn
 from transformers import Wav2Vec2Config, Wav2Vec2Model
 from transformers.modeling_outputs import BaseModelOutput
 
@@ -123,3 +125,142 @@ class Wav2Vec2Model(Wav2Vec2Model):
             hidden_states=encoder_outputs.hidden_states,
             attentions=encoder_outputs.attentions,
         )
+
+    def extract_features_chunked(self, input_values, chunk_frames=1500):
+        """
+        `feature_extractor` over a long waveform, `chunk_frames` output frames at a time.
+
+        Chunks are cut on the frame grid of the conv stack, so every frame sees exactly the samples
+        it would in one call. The GroupNorm of the first conv layer (`feat_extract_norm == "group"`)
+        normalizes over the whole utterance; its statistics are accumulated in a first pass over the
+        first conv layer's output and applied in the second, so the result matches the unchunked
+        features up to float rounding while only one chunk of activations is alive at a time.
+
+        Args:
+            input_values (Tensor): Shape [B, S].
+
+        Returns:
+            Tensor: Shape [B, C, N].
+        """
+        conv_layers = self.feature_extractor.conv_layers
+        kernels, strides = self.config.conv_kernel, self.config.conv_stride
+        # stride and receptive field of the layers above the first one, in first-layer frames
+        upper_stride, upper_field = 1, 1
+        for kernel, stride in zip(reversed(kernels[1:]), reversed(strides[1:])):
+            upper_field = (upper_field - 1) * stride + kernel
+            upper_stride *= stride
+        first = conv_layers[0]
+        num_first = (input_values.shape[1] - kernels[0]) // strides[0] + 1
+        num_frames = (num_first - upper_field) // upper_stride + 1
+
+        def first_conv(start, end):
+            # first-layer frames [start, end)
+            samples = input_values[:, None, start * strides[0]:(end - 1) * strides[0] + kernels[0]]
+            return first.conv(samples)
+
+        group_norm = self.config.feat_extract_norm == "group"
+        if group_norm:
+            total = total_sq = 0
+            step = chunk_frames * upper_stride
+            for start in range(0, num_first, step):
+                hidden = first_conv(start, min(start + step, num_first)).double()
+                total = total + hidden.sum(dim=2)
+                total_sq = total_sq + (hidden ** 2).sum(dim=2)
+            mean = (total / num_first)[:, :, None]
+            std = (total_sq / num_first - mean[:, :, 0] ** 2).add(first.layer_norm.eps).sqrt()[:, :, None]
+
+        features = []
+        for start in range(0, num_frames, chunk_frames):
+            end = min(start + chunk_frames, num_frames)
+            hidden = first_conv(start * upper_stride, (end - 1) * upper_stride + upper_field)
+            if group_norm:
+                hidden = ((hidden.double() - mean) / std).to(hidden.dtype)
+                hidden = hidden * first.layer_norm.weight[:, None] + first.layer_norm.bias[:, None]
+            elif hasattr(first, 'layer_norm'):
+                hidden = first.layer_norm(hidden.transpose(-2, -1)).transpose(-2, -1)
+            hidden = first.activation(hidden)
+            for conv_layer in conv_layers[1:]:
+                hidden = conv_layer(hidden)
+            features.append(hidden)
+        return torch.cat(features, dim=2)
+
+    def encode_long(self, input_values, seq_lens, window=None, context=125, batch_size=8):
+        """
+        Hidden states of every transformer layer for long utterances, without attention maps.
+
+        By default every utterance is encoded whole (full attention) from the stock conv features,
+        utterances of equal length batched together. With `window` the conv features are extracted
+        chunk by chunk (`extract_features_chunked`) and the interpolated features of every utterance
+        are cut into windows of `window` frames, each run with `context` frames of left and right
+        context that are dropped afterwards; all windows of all utterances have the same length and go
+        through the encoder together, `batch_size` at a time. Windowed attention approximates the full
+        encode; utterances no longer than one padded window are encoded whole.
+
+        Args:
+            input_values (list[Tensor]): Normalized waveforms, shape [S_i] each.
+            seq_lens (list[int]): Output frames of every utterance.
+
+        Returns:
+            list[Tensor]: Shape [seq_len_i, num_layers, C] each.
+        """
+        span = None if window is None else window + 2 * context
+        extract_features = self.feature_extractor if window is None else self.extract_features_chunked
+        hidden_states, jobs = [], []
+        for idx, (values, seq_len) in enumerate(zip(input_values, seq_lens)):
+            features = extract_features(values[None]).transpose(1, 2)
+            features = linear_interpolation(features, seq_len=seq_len)
+            hidden, _ = self.feature_projection(features)
+            hidden_states.append(hidden[0])
+            if span is None or seq_len <= span:
+                jobs.append((idx, 0, seq_len, 0, seq_len))
+                continue
+            for start in range(0, seq_len, window):
+                end = min(start + window, seq_len)
+                # same length for every window, shifted inward at the ends
+                lo = min(max(start - context, 0), seq_len - span)
+                jobs.append((idx, lo, lo + span, start, end))
+
+        pieces = [[] for _ in input_values]
+        by_length = {}
+        for job in jobs:
+            by_length.setdefault(job[2] - job[1], []).append(job)
+        for group in by_length.values():
+            for i in range(0, len(group), batch_size):
+                batch = group[i:i + batch_size]
+                inputs = torch.stack([hidden_states[idx][lo:hi] for idx, lo, hi, _, _ in batch])
+                encoded = self.encoder(inputs, output_attentions=False, output_hidden_states=True, return_dict=True)
+                layers = torch.stack(encoded.hidden_states[1:], dim=2) # B T L C
+                for (idx, lo, _, start, end), layer in zip(batch, layers):
+                    pieces[idx].append((start, layer[start - lo:end - lo]))
+        return [torch.cat([piece for _, piece in sorted(speaker, key=lambda x: x[0])]) for speaker in pieces]
+
+
+def quantize_encoder_int8(model):
+    """
+    Dynamic int8 quantization of the transformer's linear layers (attention projections and feed
+    forward) for CPU inference; the conv feature encoder and the feature projection stay fp32.
+    The model must be on the CPU and stays there.
+    """
+    model.encoder.layers = torch.ao.quantization.quantize_dynamic(
+        model.encoder.layers, {nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def hidden_state_drift(reference, candidate):
+    """
+    Drift of stacked hidden states ([T, num_layers, C], as the DiT consumes them) against a
+    reference encoding of the same audio.
+
+    Returns:
+        dict: `max_abs` difference, `rel_l2` error and the lowest per-layer `cosine` similarity.
+    """
+    reference = torch.cat([r.float() for r in reference])
+    candidate = torch.cat([c.float() for c in candidate])
+    diff = candidate - reference
+    cosine = nn.functional.cosine_similarity(candidate.transpose(0, 1).flatten(1),
+                                             reference.transpose(0, 1).flatten(1), dim=1)
+    return dict(
+        max_abs=diff.abs().max().item(),
+        rel_l2=(diff.norm() / reference.norm()).item(),
+        cosine=cosine.min().item(),
+    )
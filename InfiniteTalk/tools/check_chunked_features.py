@@ -0,0 +1,55 @@
+"""
+Check the chunked wav2vec conv features against the stock feature extractor on a long clip.
+
+    python tools/check_chunked_features.py --wav2vec_dir weights/chinese-wav2vec2-base --audio speech.wav
+
+`extract_features_chunked` (used by windowed `encode_long`) is run over the clip with a small
+`--chunk_frames`, so it crosses many chunk boundaries, and compared with one `feature_extractor`
+call on the same waveform. Without `--audio` a seeded noise clip of `--seconds` is used. The
+relative L2 error of the features must stay under `--tol`.
+"""
+import argparse
+import os
+import sys
+
+import librosa
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.audio_analysis.wav2vec2 import Wav2Vec2Model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tolerance check of the chunked wav2vec feature extractor")
+    parser.add_argument("--wav2vec_dir", type=str, required=True)
+    parser.add_argument("--audio", type=str, default=None)
+    parser.add_argument("--seconds", type=float, default=120.0)
+    parser.add_argument("--chunk_frames", type=int, default=200)
+    parser.add_argument("--tol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    model = Wav2Vec2Model.from_pretrained(args.wav2vec_dir, local_files_only=True).eval()
+    if args.audio is not None:
+        samples, _ = librosa.load(args.audio, sr=16000)
+        waveform = torch.from_numpy(samples)
+    else:
+        waveform = torch.randn(int(args.seconds * 16000), generator=torch.Generator().manual_seed(0)) * 0.1
+    waveform = ((waveform - waveform.mean()) / (waveform.std() + 1e-7))[None]
+
+    with torch.no_grad():
+        reference = model.feature_extractor(waveform).float()
+        chunked = model.extract_features_chunked(waveform, chunk_frames=args.chunk_frames).float()
+    if chunked.shape != reference.shape:
+        print(f"shape {tuple(chunked.shape)}, expected {tuple(reference.shape)}")
+        sys.exit(1)
+    diff = chunked - reference
+    rel_l2 = (diff.norm() / reference.norm()).item()
+    print(f"{reference.shape[2]} frames in chunks of {args.chunk_frames}: "
+          f"max abs diff {diff.abs().max().item():.2e}, rel l2 {rel_l2:.2e}, tolerance {args.tol:.1e}")
+    if rel_l2 > args.tol:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Check the vectorized torch color correction against the per-frame skimage reference.
+
+    python tools/check_color_correction.py --device cuda
+
+Random chunks are shifted in color and corrected with both implementations; the largest absolute
+difference in [-1, 1] must stay under `--tol` (one uint8 step, 2/255, by default).
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.utils.multitalk_utils import (
+    color_reference_stats,
+    match_and_blend_colors,
+    match_and_blend_colors_skimage,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tolerance check of the torch color correction")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--frames", type=int, default=33)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--tol", type=float, default=2 / 255)
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(0)
+    worst = 0.0
+    for trial in range(args.trials):
+        reference = torch.rand(1, 3, 1, args.size, args.size, generator=generator) * 2 - 1
+        shift = torch.rand(1, 3, 1, 1, 1, generator=generator) - 0.5
+        chunk = (torch.rand(1, 3, args.frames, args.size, args.size, generator=generator) + shift).clamp(0, 1) * 2 - 1
+        # a flat frame exercises the zero-std branch
+        chunk[:, :, 0] = 0.25
+        for strength in (0.5, 1.0):
+            expected = match_and_blend_colors_skimage(chunk, reference, strength)
+            stats = color_reference_stats(reference.to(args.device))
+            actual = match_and_blend_colors(chunk.to(args.device), reference.to(args.device), strength,
+                                            reference_stats=stats).cpu()
+            diff = (actual - expected).abs().max().item()
+            worst = max(worst, diff)
+            print(f"trial {trial} strength {strength}: max abs diff {diff:.2e}")
+    print(f"worst {worst:.2e}, tolerance {args.tol:.2e}")
+    if worst > args.tol:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Check that `FrameReader` returns the same frames as random access through decord's `VideoReader`.
+
+    python tools/check_frame_reader.py input.mp4 --max_skip 16
+
+Frames are read sequentially, with backward seeks and with forward jumps past `--max_skip` (both
+of which restart the prefetch thread), and every one must equal `VideoReader[i]` bit for bit.
+Use a clip with B-frames and a GOP longer than `--max_skip` to exercise seeks between keyframes.
+"""
+import argparse
+import os
+import random
+import sys
+
+import torch
+from decord import VideoReader, cpu
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.utils.frame_reader import FrameReader
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame identity check of FrameReader against VideoReader")
+    parser.add_argument("video", type=str)
+    parser.add_argument("--max_skip", type=int, default=16)
+    parser.add_argument("--frames", type=int, default=200, help="Frames read in the sequential pass.")
+    parser.add_argument("--jumps", type=int, default=20, help="Random backward seeks and long forward jumps.")
+    args = parser.parse_args()
+
+    reference = VideoReader(args.video, ctx=cpu(0))
+    num_frames = len(reference)
+    rng = random.Random(0)
+    sequential = list(range(min(args.frames, num_frames)))
+    backward = [rng.randrange(num_frames) for _ in range(args.jumps)]
+    backward.sort(reverse=True)
+    forward = list(range(0, num_frames, args.max_skip + 1 + rng.randrange(args.max_skip)))[:args.jumps]
+    patterns = {'sequential': sequential, 'backward': backward, 'past max_skip': forward}
+
+    mismatches = 0
+    with FrameReader(args.video, max_skip=args.max_skip) as reader:
+        for name, frame_ids in patterns.items():
+            bad = []
+            for frame_id in frame_ids:
+                expected = torch.from_numpy(reference[frame_id].asnumpy())
+                if not torch.equal(reader[frame_id], expected):
+                    bad.append(frame_id)
+            mismatches += len(bad)
+            print(f"{name}: {len(frame_ids)} frames, {len(bad)} differ{' ' + str(bad[:10]) if bad else ''}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Check the hoisted chunk conditioning of the streaming loop against the per-chunk code it replaced.
+
+    python tools/check_hoisted_conditioning.py --cond_batch_size 3
+
+A pipeline with a stub CLIP and a small randomly initialized VAE builds every chunk's conditioning
+the way `generate_infinitetalk_iter` does: `first_frame_mask` and `reference_target_masks` once per
+job, `encode_condition` through `ChunkConditions` and the per-chunk `y` sliced to the chunk length.
+The reference is the loop body of the baseline, which rebuilt the mask, the CLIP context, the padded
+VAE encode and the human masks on every chunk. Both an image input (one condition frame for every
+chunk) and a video input (a new condition frame per chunk, encoded `--cond_batch_size` at a time)
+are run over a chunk plan whose last chunk is shorter. `y`, `clip_context`, `msk` and the reference
+masks of every chunk must agree within `--tol`.
+"""
+import argparse
+import os
+import sys
+import threading
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.modules.vae import WanVAE, WanVAE_
+from wan.multitalk import InfiniteTalkPipeline, resize_and_centercrop
+from wan.utils.chunk_conditions import ChunkConditions
+from wan.utils.multitalk_utils import plan_chunks
+
+
+def toy_vae(z_dim=4, dim=8):
+    """`WanVAE` around a small random `WanVAE_` on the CPU, no checkpoint."""
+    vae = WanVAE.__new__(WanVAE)
+    vae.dtype = torch.float
+    vae.device = 'cpu'
+    vae.mean = torch.randn(z_dim)
+    vae.std = torch.rand(z_dim) + 0.5
+    vae.scale = [vae.mean, 1.0 / vae.std]
+    vae.lock = threading.Lock()
+    vae.model = WanVAE_(dim=dim, z_dim=z_dim, num_res_blocks=1,
+                        temperal_downsample=[False, True, True]).eval().requires_grad_(False)
+    return vae
+
+
+class StubCLIP:
+    """Stands in for `CLIPModel`: `visual` maps [B, C, 1, H, W] frames to [B, 257, dim] tokens."""
+
+    def __init__(self, dim=16):
+        self.model = nn.Sequential(nn.AdaptiveAvgPool2d(4), nn.Flatten(), nn.Linear(3 * 16, 257 * dim))
+        self.model.eval().requires_grad_(False)
+        self.dim = dim
+
+    def visual(self, videos):
+        return self.model(videos[:, :, 0]).view(len(videos), 257, self.dim)
+
+
+def toy_pipeline():
+    pipe = InfiniteTalkPipeline.__new__(InfiniteTalkPipeline)
+    pipe.device = torch.device('cpu')
+    pipe.param_dtype = torch.float32
+    pipe.vae_stride = (4, 8, 8)
+    pipe.clip = StubCLIP()
+    pipe.vae = toy_vae()
+    return pipe
+
+
+def baseline_chunk(pipe, cond_image, frame_num, target_h, target_w):
+    """One chunk's (clip_context, msk, y) as the loop of the baseline built them."""
+    h, w = cond_image.shape[-2], cond_image.shape[-1]
+    lat_h, lat_w = h // pipe.vae_stride[1], w // pipe.vae_stride[2]
+
+    # get mask
+    msk = torch.ones(1, frame_num, lat_h, lat_w, device=pipe.device)
+    msk[:, 1:] = 0
+    msk = torch.concat([
+        torch.repeat_interleave(msk[:, 0:1], repeats=4, dim=1), msk[:, 1:]
+    ],
+                    dim=1)
+    msk = msk.view(1, msk.shape[1] // 4, 4, lat_h, lat_w)
+    msk = msk.transpose(1, 2).to(pipe.param_dtype) # B 4 T H W
+
+    with torch.no_grad():
+        # get clip embedding
+        pipe.clip.model.to(pipe.device)
+        clip_context = pipe.clip.visual(cond_image[:, :, -1:, :, :]).to(pipe.param_dtype)
+        pipe.clip.model.cpu()
+
+        # zero padding and vae encode
+        video_frames = torch.zeros(1, cond_image.shape[1], frame_num-cond_image.shape[2], target_h, target_w).to(pipe.device)
+        padding_frames_pixels_values = torch.concat([cond_image, video_frames], dim=2)
+        y = pipe.vae.encode(padding_frames_pixels_values)
+        y = torch.stack(y).to(pipe.param_dtype) # B C T H W
+        y = torch.concat([msk, y], dim=1) # B 4+C T H W
+    return clip_context, msk, y
+
+
+def baseline_human_masks(pipe, input_data, human_number, src_h, src_w, target_h, target_w, lat_h, lat_w, face_scale):
+    """The reference masks as the loop of the baseline built them on every chunk."""
+    human_masks = []
+    if human_number==1:
+        background_mask = torch.ones([src_h, src_w])
+        human_mask1 = torch.ones([src_h, src_w])
+        human_mask2 = torch.ones([src_h, src_w])
+        human_masks = [human_mask1, human_mask2, background_mask]
+    elif human_number==2:
+        if 'bbox' in input_data:
+            background_mask = torch.zeros([src_h, src_w])
+            for _, person_bbox in input_data['bbox'].items():
+                x_min, y_min, x_max, y_max = person_bbox
+                human_mask = torch.zeros([src_h, src_w])
+                human_mask[int(x_min):int(x_max), int(y_min):int(y_max)] = 1
+                background_mask += human_mask
+                human_masks.append(human_mask)
+        else:
+            x_min, x_max = int(src_h * face_scale), int(src_h * (1 - face_scale))
+            background_mask = torch.zeros([src_h, src_w])
+            human_mask1 = torch.zeros([src_h, src_w])
+            human_mask2 = torch.zeros([src_h, src_w])
+            lefty_min, lefty_max = int((src_w//2) * face_scale), int((src_w//2) * (1 - face_scale))
+            righty_min, righty_max = int((src_w//2) * face_scale + (src_w//2)), int((src_w//2) * (1 - face_scale) + (src_w//2))
+            human_mask1[x_min:x_max, lefty_min:lefty_max] = 1
+            human_mask2[x_min:x_max, righty_min:righty_max] = 1
+            background_mask += human_mask1
+            background_mask += human_mask2
+            human_masks = [human_mask1, human_mask2]
+        background_mask = torch.where(background_mask > 0, torch.tensor(0), torch.tensor(1))
+        human_masks.append(background_mask)
+
+    ref_target_masks = torch.stack(human_masks, dim=0).to(pipe.device)
+    ref_target_masks = resize_and_centercrop(ref_target_masks, (target_h, target_w))
+    ref_target_masks = F.interpolate(ref_target_masks.unsqueeze(0), size=(lat_h, lat_w), mode='nearest').squeeze()
+    ref_target_masks = (ref_target_masks > 0)
+    return ref_target_masks.float().to(pipe.device)
+
+
+def compare(name, expected, actual, tol):
+    if expected.shape != actual.shape:
+        print(f"{name}: shape {tuple(actual.shape)}, expected {tuple(expected.shape)}")
+        return False
+    diff = (actual.float() - expected.float()).abs().max().item() if expected.numel() else 0.0
+    print(f"{name}: {'identical' if diff == 0 else 'max abs diff %.2e' % diff}")
+    return diff <= tol
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the hoisted chunk conditioning against the per-chunk baseline")
+    parser.add_argument("--frame_num", type=int, default=17)
+    parser.add_argument("--motion_frame", type=int, default=5)
+    parser.add_argument("--audio_frames", type=int, default=45)
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--cond_batch_size", type=int, default=3)
+    parser.add_argument("--tol", type=float, default=1e-5,
+                        help="Largest absolute difference accepted, batched CPU kernels need not be bit-identical.")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    pipe = toy_pipeline()
+    target_h = target_w = args.size
+    lat_h, lat_w = target_h // pipe.vae_stride[1], target_w // pipe.vae_stride[2]
+    chunk_plan, _ = plan_chunks(args.audio_frames, args.frame_num, args.motion_frame, args.audio_frames)
+    print(f"chunk plan: {chunk_plan}")
+    if len(chunk_plan) < 3 or chunk_plan[-1][1] == args.frame_num:
+        print("the chunk plan needs several chunks and a shorter last one, change --audio_frames")
+        sys.exit(1)
+
+    ok = True
+    msk = pipe.first_frame_mask(args.frame_num, lat_h, lat_w)
+    video = torch.rand(args.audio_frames, 3, target_h, target_w) * 2 - 1
+    inputs = {
+        'image': dict(cond_image=video[:1, :, None], load_frames=None, batch_size=1),
+        'video': dict(cond_image=None,
+                      load_frames=lambda chunk_ids: video[[chunk_plan[i][0] for i in chunk_ids]][:, :, None],
+                      batch_size=args.cond_batch_size),
+    }
+    for kind, spec in inputs.items():
+        def encode(cond_images):
+            return pipe.encode_condition(cond_images, args.frame_num, msk, batch_size=spec['batch_size'])
+
+        with torch.no_grad():
+            conditions = ChunkConditions(encode, len(chunk_plan), cond_image=spec['cond_image'],
+                                         load_frames=spec['load_frames'], batch_size=spec['batch_size'])
+        for chunk_idx, (start, chunk_frames) in enumerate(chunk_plan):
+            chunk_latent_frames = (chunk_frames - 1) // pipe.vae_stride[0] + 1
+            with torch.no_grad():
+                clip_context, y = conditions.get(chunk_idx, chunk_latent_frames)
+            cond_image = video[:1, :, None] if kind == 'image' else video[start:start + 1, :, None]
+            expected_clip, expected_msk, expected_y = baseline_chunk(pipe, cond_image, chunk_frames, target_h, target_w)
+            prefix = f"{kind} chunk {chunk_idx} ({chunk_frames} frames)"
+            ok &= compare(f"{prefix} clip_context", expected_clip, clip_context, args.tol)
+            ok &= compare(f"{prefix} msk", expected_msk, y[:, :msk.shape[1]], 0.0)
+            ok &= compare(f"{prefix} y", expected_y, y, args.tol)
+
+    src_h, src_w = 2 * target_h, 3 * target_w // 2
+    mask_inputs = [
+        (1, {}),
+        (2, {}),
+        (2, {'bbox': {'person1': [0, 0, src_h // 2, src_w // 2], 'person2': [src_h // 4, src_w // 2, src_h, src_w]}}),
+    ]
+    for human_number, input_data in mask_inputs:
+        expected = baseline_human_masks(pipe, input_data, human_number, src_h, src_w, target_h, target_w, lat_h, lat_w, 0.05)
+        input_data = dict(input_data, cond_audio={f'person{i + 1}': None for i in range(human_number)})
+        actual = pipe.reference_target_masks(input_data, human_number, (src_h, src_w), (target_h, target_w), (lat_h, lat_w))
+        ok &= compare(f"{human_number} person(s){' bbox' if 'bbox' in input_data else ''} reference masks",
+                      expected, actual, 0.0)
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare two long generations of the same job, e.g. pixel-space motion conditioning (default)
+against `--latent_motion`, to decide whether the latent path drifts.
+
+    python tools/compare_motion_conditioning.py baseline.mp4 latent.mp4 --reference ref.png
+
+Per window of `--window` frames it reports the PSNR between the two videos and, for each video,
+the drift of the mean Lab color from the reference image (or from the first frame of the baseline).
+"""
+import argparse
+
+import cv2
+import numpy as np
+
+
+def read_frames(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    if not frames:
+        raise ValueError(f"Cannot read frames from: {path}")
+    return frames
+
+
+def mean_lab(frame):
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2LAB).reshape(-1, 3).astype(np.float64).mean(0)
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drift and quality comparison of two generations")
+    parser.add_argument("baseline", type=str, help="Video generated with pixel-space motion conditioning.")
+    parser.add_argument("candidate", type=str, help="Video generated with --latent_motion.")
+    parser.add_argument("--reference", type=str, default=None, help="Conditioning image used for color drift.")
+    parser.add_argument("--window", type=int, default=100, help="Frames per reported window.")
+    args = parser.parse_args()
+
+    baseline = read_frames(args.baseline)
+    candidate = read_frames(args.candidate)
+    num_frames = min(len(baseline), len(candidate))
+    if len(baseline) != len(candidate):
+        print(f"Frame count differs ({len(baseline)} vs {len(candidate)}), comparing the first {num_frames}.")
+
+    if args.reference is not None:
+        reference = cv2.imread(args.reference)
+        if reference is None:
+            raise ValueError(f"Cannot load image: {args.reference}")
+        reference = cv2.resize(reference, (baseline[0].shape[1], baseline[0].shape[0]))
+    else:
+        reference = baseline[0]
+    ref_lab = mean_lab(reference)
+
+    print(f"{'frames':>12} {'psnr':>8} {'drift base':>11} {'drift cand':>11}")
+    for start in range(0, num_frames, args.window):
+        end = min(start + args.window, num_frames)
+        scores = [psnr(baseline[i], candidate[i]) for i in range(start, end)]
+        drift_base = np.mean([np.linalg.norm(mean_lab(baseline[i]) - ref_lab) for i in range(start, end)])
+        drift_cand = np.mean([np.linalg.norm(mean_lab(candidate[i]) - ref_lab) for i in range(start, end)])
+        print(f"{start:>5}-{end - 1:<6} {np.mean(scores):8.2f} {drift_base:11.3f} {drift_cand:11.3f}")
+
+
+if __name__ == '__main__':
+    main()
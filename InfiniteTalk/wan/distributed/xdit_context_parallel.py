@@ -476,7 +476,9 @@ def usp_crossattn_multi_forward_multitalk(self,
                                         encoder_hidden_states: torch.Tensor,  # 1, 21, 64, C
                                         shape=None, 
                                         x_ref_attn_map=None,
-                                        human_num=None) -> torch.Tensor:
+                                        human_num=None,
+                                        token_index=None) -> torch.Tensor:
+        assert token_index is None, f"Masked audio cross-attention is not supported with context parallel."
         
         N_t, N_h, N_w = shape 
         sp_size = get_sequence_parallel_world_size()
@@ -1,7 +1,7 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import torch
 import torch.nn as nn
-from einops import rearrange, repeat
+from einops import repeat
 from ..utils.multitalk_utils import RotaryPositionalEmbedding1D, normalize_and_scale, split_token_counts_and_frame_ids
 from xfuser.core.distributed import (
     get_sequence_parallel_rank,
@@ -224,58 +224,57 @@ class SingleStreamAttention(nn.Module):
         self.add_q_norm = norm_layer(self.head_dim) if qk_norm else nn.Identity()
         self.add_k_norm = norm_layer(self.head_dim) if qk_norm else nn.Identity()
 
-    def forward(self, x: torch.Tensor, encoder_hidden_states: torch.Tensor, shape=None, enable_sp=False, kv_seq=None) -> torch.Tensor:
-       
+    def forward(self, x: torch.Tensor, encoder_hidden_states: torch.Tensor, shape=None, enable_sp=False, kv_seq=None, token_index=None) -> torch.Tensor:
+        """
+        x:                      [1, N_t * N_h * N_w, C] (the local shard when enable_sp).
+        encoder_hidden_states:  [N_t, N_a, C] audio tokens per latent frame ([1, sum(kv_seq), C] when enable_sp).
+        token_index:            [N_t * S] sorted token ids; when given only these tokens attend to audio,
+                                the others get no audio update. Every frame must select the same S tokens.
+        """
         N_t, N_h, N_w = shape
-        if not enable_sp:
-            x = rearrange(x, "B (N_t S) C -> (B N_t) S C", N_t=N_t)
+        if enable_sp:
+            # context parallel
+            sp_size = get_sequence_parallel_world_size()
+            sp_rank = get_sequence_parallel_rank()
+            visual_seqlen, _ = split_token_counts_and_frame_ids(N_t, N_h * N_w, sp_size, sp_rank)
+            assert kv_seq is not None, f"kv_seq should not be None."
+        else:
+            # frame t only attends to the audio tokens of frame t, kept flat with a block-diagonal bias
+            kv_seq = [encoder_hidden_states.size(1)] * N_t
+            encoder_hidden_states = encoder_hidden_states.reshape(1, -1, encoder_hidden_states.size(-1))
+            visual_seqlen = [N_h * N_w] * N_t
+
+        x_full = x
+        if token_index is not None:
+            assert not enable_sp, f"token_index is not supported with context parallel."
+            x = x.index_select(1, token_index)
+            visual_seqlen = [token_index.numel() // N_t] * N_t
 
         # get q for hidden_state
         B, N, C = x.shape
-        q = self.q_linear(x)
-        q_shape = (B, N, self.num_heads, self.head_dim)
-        q = q.view(q_shape).permute((0, 2, 1, 3))
+        q = self.q_linear(x).view(B, N, self.num_heads, self.head_dim)
 
         if self.qk_norm:
             q = self.q_norm(q)
-        
+
         # get kv from encoder_hidden_states
-        _, N_a, _ = encoder_hidden_states.shape
         encoder_kv = self.kv_linear(encoder_hidden_states)
-        encoder_kv_shape = (B, N_a, 2, self.num_heads, self.head_dim)
-        encoder_kv = encoder_kv.view(encoder_kv_shape).permute((2, 0, 3, 1, 4)) 
-        encoder_k, encoder_v = encoder_kv.unbind(0)
+        encoder_kv = encoder_kv.view(B, -1, 2, self.num_heads, self.head_dim)
+        encoder_k, encoder_v = encoder_kv.unbind(2)
 
         if self.qk_norm:
             encoder_k = self.add_k_norm(encoder_k)
 
-
-        q = rearrange(q, "B H M K -> B M H K")
-        encoder_k = rearrange(encoder_k, "B H M K -> B M H K")
-        encoder_v = rearrange(encoder_v, "B H M K -> B M H K")
-
-        if enable_sp:
-            # context parallel
-            sp_size = get_sequence_parallel_world_size()
-            sp_rank = get_sequence_parallel_rank()
-            visual_seqlen, _ = split_token_counts_and_frame_ids(N_t, N_h * N_w, sp_size, sp_rank)
-            assert kv_seq is not None, f"kv_seq should not be None."
-            attn_bias = xformers.ops.fmha.attn_bias.BlockDiagonalMask.from_seqlens(visual_seqlen, kv_seq)
-        else:
-            attn_bias = None
+        attn_bias = xformers.ops.fmha.attn_bias.BlockDiagonalMask.from_seqlens(visual_seqlen, kv_seq)
         x = xformers.ops.memory_efficient_attention(q, encoder_k, encoder_v, attn_bias=attn_bias, op=None,)
-        x = rearrange(x, "B M H K -> B H M K") 
 
         # linear transform
-        x_output_shape = (B, N, C)
-        x = x.transpose(1, 2) 
-        x = x.reshape(x_output_shape) 
-        x = self.proj(x)
+        x = self.proj(x.reshape(B, N, C))
         x = self.proj_drop(x)
 
-        if not enable_sp:
-            # reshape x to origin shape
-            x = rearrange(x, "(B N_t) S C -> B (N_t S) C", N_t=N_t)
+        if token_index is not None:
+            # scatter back, unselected tokens receive no audio update
+            x = torch.zeros_like(x_full).index_copy_(1, token_index, x)
 
         return x
 
@@ -318,20 +317,21 @@ class SingleStreamMutiAttention(SingleStreamAttention):
                 encoder_hidden_states: torch.Tensor, 
                 shape=None, 
                 x_ref_attn_map=None,
-                human_num=None) -> torch.Tensor:
+                human_num=None,
+                token_index=None) -> torch.Tensor:
         
         encoder_hidden_states = encoder_hidden_states.squeeze(0)
         if human_num == 1:
-            return super().forward(x, encoder_hidden_states, shape)
+            return super().forward(x, encoder_hidden_states, shape, token_index=token_index)
 
         N_t, _, _ = shape 
-        x = rearrange(x, "B (N_t S) C -> (B N_t) S C", N_t=N_t) 
+        x_full = x
+        if token_index is not None:
+            x = x.index_select(1, token_index)
 
         # get q for hidden_state
         B, N, C = x.shape
-        q = self.q_linear(x) 
-        q_shape = (B, N, self.num_heads, self.head_dim) 
-        q = q.view(q_shape).permute((0, 2, 1, 3))
+        q = self.q_linear(x).view(B, N, self.num_heads, self.head_dim)
 
         if self.qk_norm:
             q = self.q_norm(q)
@@ -350,16 +350,16 @@ class SingleStreamMutiAttention(SingleStreamAttention):
         max_indices = x_ref_attn_map.argmax(dim=0)
         normalized_map = torch.stack([human1, human2, back], dim=1)
         normalized_pos = normalized_map[range(x_ref_attn_map.size(1)), max_indices] # N 
+        if token_index is not None:
+            normalized_pos = normalized_pos[token_index]
 
-        q = rearrange(q, "(B N_t) H S C -> B H (N_t S) C", N_t=N_t)
-        q = self.rope_1d(q, normalized_pos)
-        q = rearrange(q, "B H (N_t S) C -> (B N_t) H S C", N_t=N_t)
+        q = self.rope_1d(q.transpose(1, 2), normalized_pos).transpose(1, 2)
 
+        # audio tokens of all frames kept flat: [N_t, N_a, C] -> [1, N_t * N_a, C]
         _, N_a, _ = encoder_hidden_states.shape 
-        encoder_kv = self.kv_linear(encoder_hidden_states) 
-        encoder_kv_shape = (B, N_a, 2, self.num_heads, self.head_dim)
-        encoder_kv = encoder_kv.view(encoder_kv_shape).permute((2, 0, 3, 1, 4)) 
-        encoder_k, encoder_v = encoder_kv.unbind(0) 
+        encoder_kv = self.kv_linear(encoder_hidden_states.reshape(1, N_t * N_a, -1)) 
+        encoder_kv = encoder_kv.view(B, N_t * N_a, 2, self.num_heads, self.head_dim)
+        encoder_k, encoder_v = encoder_kv.unbind(2) 
 
         if self.qk_norm:
             encoder_k = self.add_k_norm(encoder_k)
@@ -369,25 +369,18 @@ class SingleStreamMutiAttention(SingleStreamAttention):
         per_frame[:per_frame.size(0)//2] = (self.rope_h1[0] + self.rope_h1[1]) / 2
         per_frame[per_frame.size(0)//2:] = (self.rope_h2[0] + self.rope_h2[1]) / 2
         encoder_pos = torch.concat([per_frame]*N_t, dim=0)
-        encoder_k = rearrange(encoder_k, "(B N_t) H S C -> B H (N_t S) C", N_t=N_t)
-        encoder_k = self.rope_1d(encoder_k, encoder_pos)
-        encoder_k = rearrange(encoder_k, "B H (N_t S) C -> (B N_t) H S C", N_t=N_t)
+        encoder_k = self.rope_1d(encoder_k.transpose(1, 2), encoder_pos).transpose(1, 2)
 
- 
-        q = rearrange(q, "B H M K -> B M H K")
-        encoder_k = rearrange(encoder_k, "B H M K -> B M H K")
-        encoder_v = rearrange(encoder_v, "B H M K -> B M H K")
-        x = xformers.ops.memory_efficient_attention(q, encoder_k, encoder_v, attn_bias=None, op=None,)
-        x = rearrange(x, "B M H K -> B H M K")
+        # frame t only attends to the audio tokens of frame t
+        attn_bias = xformers.ops.fmha.attn_bias.BlockDiagonalMask.from_seqlens([N // N_t] * N_t, [N_a] * N_t)
+        x = xformers.ops.memory_efficient_attention(q, encoder_k, encoder_v, attn_bias=attn_bias, op=None,)
 
         # linear transform
-        x_output_shape = (B, N, C)
-        x = x.transpose(1, 2) 
-        x = x.reshape(x_output_shape) 
-        x = self.proj(x) 
+        x = self.proj(x.reshape(B, N, C)) 
         x = self.proj_drop(x)
 
-        # reshape x to origin shape
-        x = rearrange(x, "(B N_t) S C -> B (N_t S) C", N_t=N_t) 
+        if token_index is not None:
+            # scatter back, unselected tokens receive no audio update
+            x = torch.zeros_like(x_full).index_copy_(1, token_index, x)
 
-        return x
\ No newline at end of file
+        return x
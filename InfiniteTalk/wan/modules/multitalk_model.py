@@ -12,6 +12,7 @@ from diffusers import ModelMixin
 from diffusers.configuration_utils import ConfigMixin, register_to_config
 
 from .attention import flash_attention, SingleStreamMutiAttention
+from .token_merge import TokenMergeContext
 from ..utils.multitalk_utils import get_attn_map_with_target
 import logging
 try:
@@ -51,7 +52,7 @@ def rope_params(max_seq_len, dim, theta=10000):
 
 
 @amp.autocast(enabled=False)
-def rope_apply(x, grid_sizes, freqs):
+def rope_apply(x, grid_sizes, freqs, token_index=None):
     s, n, c = x.size(1), x.size(2), x.size(3) // 2
 
     freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
@@ -68,6 +69,10 @@ def rope_apply(x, grid_sizes, freqs):
             freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
         ],
                             dim=-1).reshape(seq_len, 1, -1)
+        if token_index is not None:
+            # merged sequence: each token keeps the position of its destination
+            freqs_i = freqs_i[token_index.to(freqs_i.device)]
+            seq_len = token_index.numel()
         freqs_i = freqs_i.to(device=x_i.device)
         x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
         x_i = torch.cat([x_i, x[i, seq_len:]])
@@ -137,7 +142,7 @@ class WanSelfAttention(nn.Module):
         self.norm_q = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
         self.norm_k = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
 
-    def forward(self, x, seq_lens, grid_sizes, freqs, ref_target_masks=None):
+    def forward(self, x, seq_lens, grid_sizes, freqs, ref_target_masks=None, token_index=None):
         b, s, n, d = *x.shape[:2], self.num_heads, self.head_dim
 
         # query, key, value function
@@ -148,8 +153,8 @@ class WanSelfAttention(nn.Module):
             return q, k, v
         q, k, v = qkv_fn(x)
 
-        q = rope_apply(q, grid_sizes, freqs)
-        k = rope_apply(k, grid_sizes, freqs)
+        q = rope_apply(q, grid_sizes, freqs, token_index=token_index)
+        k = rope_apply(k, grid_sizes, freqs, token_index=token_index)
 
         if USE_SAGEATTN:
             x = sageattn(q.to(torch.bfloat16), k.to(torch.bfloat16), v, tensor_layout='NHD')
@@ -283,6 +288,8 @@ class WanAttentionBlock(nn.Module):
         audio_embedding=None,
         ref_target_masks=None,
         human_num=None,
+        token_merge=None,
+        audio_token_index=None,
     ):
 
         dtype = x.dtype
@@ -291,10 +298,21 @@ class WanAttentionBlock(nn.Module):
             e = (self.modulation.to(e.device) + e).chunk(6, dim=1)
         assert e[0].dtype == torch.float32
 
+        # background token merging
+        merge = token_merge.build(x) if token_merge is not None else None
+
         # self-attention
-        y, x_ref_attn_map = self.self_attn(
-            (self.norm1(x).float() * (1 + e[1]) + e[0]).type_as(x), seq_lens, grid_sizes,
-            freqs, ref_target_masks=ref_target_masks)
+        y = (self.norm1(x).float() * (1 + e[1]) + e[0]).type_as(x)
+        if merge is not None:
+            y, x_ref_attn_map = self.self_attn(
+                merge.merge(y), merge.seq_lens, grid_sizes,
+                freqs, ref_target_masks=ref_target_masks, token_index=merge.keep)
+            y = merge.unmerge(y)
+            x_ref_attn_map = x_ref_attn_map[:, merge.slot]
+        else:
+            y, x_ref_attn_map = self.self_attn(
+                y, seq_lens, grid_sizes,
+                freqs, ref_target_masks=ref_target_masks)
         with amp.autocast(dtype=torch.float32):
             x = x + y * e[2]
         
@@ -305,10 +323,15 @@ class WanAttentionBlock(nn.Module):
 
         # cross attn of audio
         x_a = self.audio_cross_attn(self.norm_x(x), encoder_hidden_states=audio_embedding,
-                                        shape=grid_sizes[0], x_ref_attn_map=x_ref_attn_map, human_num=human_num)
+                                        shape=grid_sizes[0], x_ref_attn_map=x_ref_attn_map, human_num=human_num,
+                                        token_index=audio_token_index)
         x = x + x_a
 
-        y = self.ffn((self.norm2(x).float() * (1 + e[4]) + e[3]).to(dtype))
+        y = (self.norm2(x).float() * (1 + e[4]) + e[3]).to(dtype)
+        if merge is not None:
+            y = merge.unmerge(self.ffn(merge.merge(y)))
+        else:
+            y = self.ffn(y)
         with amp.autocast(dtype=torch.float32):
             x = x + y * e[5]
 
@@ -541,6 +564,13 @@ class WanModel(ModelMixin, ConfigMixin):
                 )
 
 
+        # background token merging, see `set_token_merge_ratio`
+        self.token_merge_ratio = 0.0
+        self.token_merge_stats = []
+
+        # audio cross-attention restricted to the human masks, see `set_audio_attn_mask_dilation`
+        self.audio_attn_mask_dilation = None
+
         # initialize weights
         if weight_init:
             self.init_weights()
@@ -595,6 +625,28 @@ class WanModel(ModelMixin, ConfigMixin):
     def disable_teacache(self):
         self.enable_teacache = False
 
+    def set_token_merge_ratio(self, ratio):
+        r"""
+        Set the fraction of background tokens merged in every block for the following forwards.
+        Background is everything outside the human rows of `ref_target_masks`; 0 disables merging.
+        """
+        self.token_merge_ratio = ratio
+
+    def set_audio_attn_mask_dilation(self, dilation):
+        r"""
+        Run audio cross-attention only on tokens inside the human rows of `ref_target_masks`,
+        dilated by `dilation` latent tokens. None runs it on every token.
+        """
+        self.audio_attn_mask_dilation = dilation
+
+    def pop_token_merge_stats(self):
+        r"""
+        Returns:
+            Tuple[int, int]: Summed (original, merged) self-attention sequence lengths since last call.
+        """
+        stats, self.token_merge_stats = self.token_merge_stats, []
+        return sum(s[0] for s in stats), sum(s[1] for s in stats)
+
     def forward(
             self,
             x,
@@ -677,6 +729,27 @@ class WanModel(ModelMixin, ConfigMixin):
             token_ref_target_masks = token_ref_target_masks.view(token_ref_target_masks.shape[0], -1) 
             token_ref_target_masks = token_ref_target_masks.to(x.dtype)
 
+        # background token merging, human rows of the masks are kept at full resolution
+        token_merge = None
+        if self.token_merge_ratio > 0 and ref_target_masks is not None and x.size(1) == N_t * N_h * N_w:
+            protect = token_ref_target_masks[:-1].amax(0) > 0
+            token_merge = TokenMergeContext(protect, (N_t, N_h, N_w), self.token_merge_ratio)
+            self.token_merge_stats.append((token_merge.seq_len, token_merge.merged_seq_len))
+            if not token_merge.active:
+                token_merge = None
+
+        # audio cross-attention only on (dilated) human tokens, same spatial selection for every frame
+        audio_token_index = None
+        if self.audio_attn_mask_dilation is not None and ref_target_masks is not None and x.size(1) == N_t * N_h * N_w:
+            select = token_ref_target_masks[:-1].amax(0).view(1, 1, N_h, N_w).float()
+            if self.audio_attn_mask_dilation > 0:
+                kernel_size = 2 * self.audio_attn_mask_dilation + 1
+                select = F.max_pool2d(select, kernel_size, stride=1, padding=self.audio_attn_mask_dilation)
+            select = select.flatten() > 0
+            if not bool(select.all()):
+                frame_offsets = torch.arange(N_t, device=x.device) * (N_h * N_w)
+                audio_token_index = (frame_offsets[:, None] + select.nonzero().squeeze(1)[None]).flatten()
+
         # teacache
         if self.enable_teacache:
             modulated_inp = e0 if self.use_ret_steps else e
@@ -731,6 +804,8 @@ class WanModel(ModelMixin, ConfigMixin):
             audio_embedding=audio_embedding,
             ref_target_masks=token_ref_target_masks,
             human_num=human_num,
+            token_merge=token_merge,
+            audio_token_index=audio_token_index,
             )
         if self.enable_teacache:
             if self.cnt%3==0:
@@ -0,0 +1,95 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import torch
+import torch.nn.functional as F
+
+__all__ = ['TokenMergeContext', 'TokenMerge']
+
+
+class TokenMerge:
+    r"""
+    One merge/unmerge mapping for a single block.
+
+    Args:
+        slot (Tensor): Shape [L], index of the merged token every original token is folded into.
+        keep (Tensor): Shape [L_m], original position of every merged token (kept in original order).
+        counts (Tensor): Shape [L_m], how many original tokens were averaged into every merged token.
+    """
+
+    def __init__(self, slot, keep, counts):
+        self.slot = slot
+        self.keep = keep
+        self.counts = counts
+        self.seq_lens = torch.tensor([keep.numel()], dtype=torch.long)
+
+    def merge(self, x):
+        b, _, c = x.shape
+        out = torch.zeros(b, self.keep.numel(), c, device=x.device, dtype=torch.float32)
+        out.index_add_(1, self.slot, x.float())
+        out = out / self.counts.view(1, -1, 1)
+        return out.type_as(x)
+
+    def unmerge(self, x):
+        return x.index_select(1, self.slot)
+
+
+class TokenMergeContext:
+    r"""
+    Background token merging for `WanAttentionBlock`, built once per DiT forward.
+
+    Tokens are grouped in 2x2 spatial cells. Inside each cell the top-left token is the
+    destination and the other three are merge candidates; a candidate is only merged when
+    both it and its destination lie outside the human masks and outside the first latent
+    frame. Per block the `num_merge` most similar candidates are folded into their
+    destination before self-attention and the FFN, and copied back afterwards.
+
+    Args:
+        protect (Tensor): Shape [N_h * N_w], bool, tokens inside the human masks.
+        grid_size (tuple): (N_t, N_h, N_w) of the patchified latent.
+        ratio (float): Fraction of background tokens removed from the sequence.
+    """
+
+    def __init__(self, protect, grid_size, ratio):
+        f, h, w = grid_size
+        device = protect.device
+        self.seq_len = f * h * w
+
+        protect = protect.view(1, h, w).expand(f, h, w).clone()
+        protect[0] = True  # reference / motion frame stays untouched
+        protect = protect.flatten()
+
+        idx = torch.arange(self.seq_len, device=device).view(f, h, w)
+        h2, w2 = h // 2 * 2, w // 2 * 2
+        cells = idx[:, :h2, :w2].reshape(f, h2 // 2, 2, w2 // 2, 2)
+        cells = cells.permute(0, 1, 3, 2, 4).reshape(-1, 4)
+        self.dst = cells[:, :1].expand(-1, 3).flatten()
+        self.src = cells[:, 1:].flatten()
+        self.eligible = ~(protect[self.src] | protect[self.dst])
+
+        num_background = int((~protect).sum().item())
+        num_eligible = int(self.eligible.sum().item())
+        self.num_merge = min(int(ratio * num_background), num_eligible)
+        self.merged_seq_len = self.seq_len - self.num_merge
+
+    @property
+    def active(self):
+        return self.num_merge > 0
+
+    def build(self, x):
+        r"""
+        Args:
+            x (Tensor): Shape [1, L, C], block input used as the similarity metric.
+        """
+        metric = F.normalize(x[0, :self.seq_len].float(), dim=-1)
+        scores = (metric[self.src] * metric[self.dst]).sum(-1)
+        scores = scores.masked_fill(~self.eligible, -float('inf'))
+        chosen = scores.topk(self.num_merge).indices
+        src, dst = self.src[chosen], self.dst[chosen]
+
+        removed = torch.zeros(self.seq_len, dtype=torch.bool, device=x.device)
+        removed[src] = True
+        keep = (~removed).nonzero().squeeze(1)
+        slot = torch.empty(self.seq_len, dtype=torch.long, device=x.device)
+        slot[keep] = torch.arange(keep.numel(), device=x.device)
+        slot[src] = slot[dst]
+        counts = torch.bincount(slot, minlength=keep.numel()).float()
+        return TokenMerge(slot, keep, counts)
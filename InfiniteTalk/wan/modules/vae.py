@@ -1,5 +1,6 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import logging
+import threading
 
 import torch
 import torch.cuda.amp as amp
@@ -541,6 +542,58 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         return mu
 
+    def encode_padded(self, x, num_frames, scale, tol=1e-3, min_steady=2):
+        r"""
+        Encode `x` followed by zero frames up to `num_frames`, stopping once the causal
+        cache has converged on the zero tail.
+
+        The encoder is causal with a bounded temporal receptive field, so once `x` has left
+        it every further all-zero slice yields the same latent frame. Encoding stops after
+        `min_steady` consecutive zero slices stay within `tol` of the previous one and the
+        remaining latent frames are filled with the steady-state output.
+
+        Returns:
+            (mu, encoded): the latents and the number of slices actually encoded.
+        """
+        assert (num_frames - 1) % 4 == 0, f"num_frames should be 4n+1, got {num_frames}"
+        self.clear_cache()
+        t = x.shape[2]
+        iter_ = 1 + (num_frames - 1) // 4
+        zeros = x.new_zeros(x.shape[0], x.shape[1], 4, x.shape[3], x.shape[4])
+        outs = []
+        steady = 0
+        for i in range(iter_):
+            self._enc_conv_idx = [0]
+            if i == 0:
+                chunk = x[:, :, :1, :, :]
+            else:
+                start = 1 + 4 * (i - 1)
+                chunk = x[:, :, start:start + 4, :, :]
+                if chunk.shape[2] < 4:
+                    chunk = torch.cat([chunk, zeros[:, :, chunk.shape[2]:]], 2)
+            out_ = self.encoder(
+                chunk,
+                feat_cache=self._enc_feat_map,
+                feat_idx=self._enc_conv_idx)
+            if i > 1 and 1 + 4 * (i - 2) >= t:
+                # this slice and the previous one were both all zeros
+                diff = (out_ - outs[-1]).abs().max().item()
+                steady = steady + 1 if diff <= tol else 0
+            outs.append(out_)
+            if steady >= min_steady:
+                break
+        encoded = len(outs)
+        outs.extend([outs[-1]] * (iter_ - encoded))
+        out = torch.cat(outs, 2)
+        mu, log_var = self.conv1(out).chunk(2, dim=1)
+        if isinstance(scale[0], torch.Tensor):
+            mu = (mu - scale[0].view(1, self.z_dim, 1, 1, 1)) * scale[1].view(
+                1, self.z_dim, 1, 1, 1)
+        else:
+            mu = (mu - scale[0]) * scale[1]
+        self.clear_cache()
+        return mu, encoded
+
     def decode(self, z, scale):
         self.clear_cache()
         # z: [b,c,t,h,w]
@@ -643,19 +696,49 @@ class WanVAE:
             pretrained_path=vae_pth,
             z_dim=z_dim,
         ).eval().requires_grad_(False).to(device)
+        # the causal feature caches live on the model, an encode and a decode must not interleave
+        self.lock = threading.Lock()
 
     def encode(self, videos):
         """
         videos: A list of videos each with shape [C, T, H, W].
         """
-        with amp.autocast(dtype=self.dtype):
+        with self.lock, amp.autocast(dtype=self.dtype):
             return [
                 self.model.encode(u.unsqueeze(0), self.scale).float().squeeze(0)
                 for u in videos
             ]
 
+    def encode_padded(self, videos, num_frames, tol=1e-3, check=False, check_tol=1e-3):
+        """
+        videos: A list of conditioning clips with the same shape [C, T, H, W], implicitly
+        zero-padded to `num_frames` frames and encoded as one batch. `tol` is the per-slice convergence
+        tolerance of the encoder output. With `check` the full encode is run as well and used instead
+        whenever the relative error of the scaled latents, |mu - full| / |full|, exceeds `check_tol`.
+        """
+        u = torch.stack(list(videos))
+        with self.lock, amp.autocast(dtype=self.dtype):
+            mu, encoded = self.model.encode_padded(u, num_frames, self.scale, tol=tol)
+            mu = mu.float()
+            if check:
+                padding = u.new_zeros(*u.shape[:2], num_frames - u.shape[2], *u.shape[3:])
+                full = self.model.encode(torch.cat([u, padding], 2), self.scale).float()
+                diff = ((mu - full).norm() / full.norm().clamp_min(1e-12)).item()
+                logging.info(f'padded vae encode: {encoded}/{1 + (num_frames - 1) // 4} slices, relative error {diff:.2e}')
+                if diff > check_tol:
+                    logging.warning(f'padded vae encode exceeds relative tolerance {check_tol:.1e}, using full encode')
+                    mu = full
+        return list(mu.unbind(0))
+
+    def encode_batch(self, videos):
+        """
+        videos: A list of videos with the same shape [C, T, H, W], encoded as one batch.
+        """
+        with self.lock, amp.autocast(dtype=self.dtype):
+            return list(self.model.encode(torch.stack(list(videos)), self.scale).float().unbind(0))
+
     def decode(self, zs):
-        with amp.autocast(dtype=self.dtype):
+        with self.lock, amp.autocast(dtype=self.dtype):
             return [
                 self.model.decode(u.unsqueeze(0),
                                   self.scale).float().clamp_(-1, 1).squeeze(0)
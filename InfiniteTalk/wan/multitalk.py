@@ -8,6 +8,8 @@ import importlib
 import os
 import random
 import sys
+import tempfile
+import time
 import types
 from contextlib import contextmanager
 from functools import partial
@@ -29,19 +31,23 @@ from .modules.clip import CLIPModel
 from .modules.multitalk_model import WanModel, WanLayerNorm, WanRMSNorm
 from .modules.t5 import T5EncoderModel, T5LayerNorm, T5RelativeEmbedding
 from .modules.vae import WanVAE, CausalConv3d, RMS_norm, Upsample
-from .utils.multitalk_utils import MomentumBuffer, adaptive_projected_guidance, match_and_blend_colors
+from .utils.multitalk_utils import MomentumBuffer, adaptive_projected_guidance, match_and_blend_colors, color_reference_stats, plan_chunks, build_audio_windows, LazyAudioWindows
+from .utils.memory_policy import memory_policy, torch_gc
+from .utils.chunk_finisher import ChunkFinisher
+from .utils.chunk_conditions import ChunkConditions
+from .utils.frame_sink import TransformSink
+from .utils.compile_cache import bucket_shapes, compile_module, save_compile_cache, setup_compile_cache
+from .utils.multitalk_utils import ASPECT_RATIO_627, ASPECT_RATIO_960, detect_face_box, expand_box_to_bucket, feather_composite
 from src.vram_management import AutoWrappedQLinear, AutoWrappedLinear, AutoWrappedModule, enable_vram_management
-from wan.utils.utils import convert_video_to_h264, extract_specific_frames, get_video_codec
+from wan.utils.utils import extract_specific_frames, is_video
+from .utils.media_ingest import get_media_cache, ingest_video
+from .utils.frame_reader import FrameReader
 from wan.wan_lora import WanLoraWrapper
 
 from safetensors.torch import load_file
 from optimum.quanto import quantize, freeze, qint8,requantize
 import optimum.quanto.nn.qlinear as qlinear
 
-def torch_gc():
-    torch.cuda.empty_cache()
-    torch.cuda.ipc_collect()
-
 def to_param_dtype_fp32only(model, param_dtype):
     for module in model.modules():
         for name, param in module.named_parameters(recurse=False):
@@ -51,9 +57,10 @@ def to_param_dtype_fp32only(model, param_dtype):
             if buf.dtype == torch.float32 and buf.__class__.__name__ not in ['WeightQBytesTensor']:
                 module._buffers[name] = buf.to(param_dtype)
                 
-def resize_and_centercrop(cond_image, target_size):
+def resize_and_centercrop(cond_image, target_size, mode='nearest'):
         """
-        Resize image or tensor to the target size without padding.
+        Resize image or tensor to the target size without padding. Tensors are resized with `mode`
+        (antialiased for 'bilinear', which then follows the PIL path).
         """
 
         # Get the original size
@@ -77,7 +84,11 @@ def resize_and_centercrop(cond_image, target_size):
         if isinstance(cond_image, torch.Tensor):
             if len(cond_image.shape) == 3:
                 cond_image = cond_image[None]
-            resized_tensor = nn.functional.interpolate(cond_image, size=(final_h, final_w), mode='nearest').contiguous() 
+            if mode == 'nearest':
+                resized_tensor = nn.functional.interpolate(cond_image, size=(final_h, final_w), mode='nearest').contiguous()
+            else:
+                resized_tensor = nn.functional.interpolate(cond_image.float(), size=(final_h, final_w), mode=mode,
+                                                           antialias=True).contiguous()
             # crop
             cropped_tensor = transforms.functional.center_crop(resized_tensor, target_size) 
             cropped_tensor = cropped_tensor.squeeze(0)
@@ -282,6 +293,7 @@ class InfiniteTalkPipeline:
         self.cpu_offload = False
         self.model_names = ["model"]
         self.vram_management = False
+        self.compile_cache_dir = None
 
     def add_noise(
         self,
@@ -329,6 +341,187 @@ class InfiniteTalkPipeline:
         )
         self.enable_cpu_offload()
 
+    def enable_compile(self, cache_dir='compile_cache', frame_num=81, token_merge=False, suppress_errors=False):
+        r"""
+        Compiles the DiT blocks, head, audio projection and VAE decoder with static shapes.
+
+        Every size bucket and `frame_num` gives one static DiT shape, compiled on first use and persisted
+        under `cache_dir` so later processes load it instead of compiling again. Shapes beyond the
+        dynamo cache limit run eagerly, and with `suppress_errors` so do graphs that fail to compile.
+
+        Token merging changes the merged sequence length with every merge count, which static blocks
+        would recompile for; with `token_merge` the blocks are compiled with automatic dynamic shapes,
+        so the length turns symbolic after the first change instead.
+        """
+        shapes = bucket_shapes(frame_num, self.vae_stride, self.patch_size)
+        setup_compile_cache(cache_dir, cache_size_limit=4 * len(shapes), suppress_errors=suppress_errors)
+        for block in self.model.blocks:
+            compile_module(block, dynamic=None if token_merge else False)
+        compile_module(self.model.head)
+        compile_module(self.model.audio_proj)
+        compile_module(self.vae.model.decoder)
+        self.compile_cache_dir = cache_dir
+        logging.info(f"Compile mode enabled for {len(shapes)} bucket shapes, cache at {cache_dir}")
+
+    def precompile(self, size_buckget='infinitetalk-480', frame_num=81, human_number=1):
+        r"""
+        Compiles every bucket shape of `size_buckget` ahead of the first job: one DiT forward on dummy
+        conditioning and one VAE decode per bucket, then saves the compile cache. Needs `enable_compile`.
+        """
+        assert self.compile_cache_dir is not None, "precompile needs enable_compile first"
+        bucket_config = ASPECT_RATIO_960 if size_buckget == 'infinitetalk-720' else ASPECT_RATIO_627
+        shapes = bucket_shapes(frame_num, self.vae_stride, self.patch_size, bucket_configs=(bucket_config,))
+        if not self.vram_management:
+            self.model.to(self.device)
+        else:
+            self.load_models_to_device(["model"])
+        self.model.disable_teacache()
+        audio_proj = self.model.audio_proj
+        for (h, w), (lat_t, lat_h, lat_w, seq_len) in shapes.items():
+            start = time.perf_counter()
+            seq_len = int(math.ceil(seq_len / self.sp_size)) * self.sp_size
+            with torch.no_grad():
+                latent = torch.randn(16, lat_t, lat_h, lat_w, device=self.device)
+                self.model(
+                    [latent],
+                    t=torch.tensor([self.num_timesteps - 1.0], device=self.device),
+                    context=[torch.zeros(self.model.text_len, self.model.text_dim, device=self.device, dtype=self.param_dtype)],
+                    seq_len=seq_len,
+                    clip_fea=torch.zeros(1, 257, 1280, device=self.device, dtype=self.param_dtype),
+                    y=torch.zeros(1, 4 + 16, lat_t, lat_h, lat_w, device=self.device, dtype=self.param_dtype),
+                    audio=torch.zeros(human_number, frame_num, self.model.audio_window, audio_proj.blocks,
+                                      audio_proj.channels, device=self.device, dtype=self.param_dtype),
+                    # two speaker masks and the background, for one speaker as for two
+                    ref_target_masks=torch.ones(3, lat_h, lat_w, device=self.device))
+                self.vae.decode([latent])
+            torch_gc()
+            logging.info(f"Precompiled bucket {h}x{w} in {time.perf_counter() - start:.1f}s")
+        if self.rank == 0:
+            save_compile_cache(self.compile_cache_dir)
+
+    def encode_condition(self, cond_images, frame_num, msk, offload_model=True, pad_encode_tol=None, pad_encode_check=False,
+                         pad_encode_check_tol=1e-3, batch_size=1):
+        r"""
+        CLIP context and zero-padded VAE latents for a batch of condition frames.
+
+        Args:
+            cond_images (Tensor): Shape [N, C, 1, H, W], normalized condition frames on any device; each batch
+                is moved to the pipeline device when it is encoded.
+            msk (Tensor): Shape [1, 4, T, lat_h, lat_w], first-frame mask prepended to the latents.
+            batch_size (int): Frames per CLIP / VAE batch.
+
+        Returns:
+            (clip_context, y): Shapes [N, 257, 1280] and [N, 4 + C, T, lat_h, lat_w].
+        """
+        num = cond_images.shape[0]
+        self.clip.model.to(self.device)
+        clip_context = torch.cat([
+            self.clip.visual(cond_images[i:i + batch_size, :, -1:, :, :].to(self.device)).to(self.param_dtype)
+            for i in range(0, num, batch_size)
+        ])
+        if offload_model:
+            self.clip.model.cpu()
+        torch_gc(force=offload_model)
+
+        y = []
+        for i in range(0, num, batch_size):
+            batch = cond_images[i:i + batch_size].to(self.device)
+            if pad_encode_tol is not None:
+                batch_y = self.vae.encode_padded(batch, frame_num, tol=pad_encode_tol, check=pad_encode_check,
+                                                 check_tol=pad_encode_check_tol)
+            else:
+                video_frames = torch.zeros(*batch.shape[:2], frame_num - batch.shape[2], *batch.shape[3:], device=self.device)
+                batch_y = self.vae.encode_batch(torch.concat([batch, video_frames], dim=2))
+            batch_y = torch.stack(batch_y).to(self.param_dtype) # B C T H W
+            batch_y = torch.concat([msk.expand(len(batch_y), -1, -1, -1, -1), batch_y], dim=1) # B 4+C T H W
+            y.append(batch_y)
+            del batch, batch_y
+        y = torch.cat(y)
+        torch_gc()
+        return clip_context, y
+
+    def first_frame_mask(self, frame_num, lat_h, lat_w):
+        r"""
+        Mask prepended to the condition latents, 1 on the latent of the first frame.
+
+        Returns:
+            Tensor: Shape [1, 4, T, lat_h, lat_w], T = (frame_num - 1) // 4 + 1.
+        """
+        msk = torch.ones(1, frame_num, lat_h, lat_w, device=self.device)
+        msk[:, 1:] = 0
+        msk = torch.concat([
+            torch.repeat_interleave(msk[:, 0:1], repeats=4, dim=1), msk[:, 1:]
+        ],
+                        dim=1)
+        msk = msk.view(1, msk.shape[1] // 4, 4, lat_h, lat_w)
+        msk = msk.transpose(1, 2).to(self.param_dtype) # B 4 T H W
+        return msk
+
+    def reference_target_masks(self, input_data, human_number, src_size, target_size, lat_size, face_scale=0.05,
+                               use_bbox_mask=False):
+        r"""
+        Per-person and background masks of the condition frame at latent resolution.
+
+        Args:
+            src_size, target_size, lat_size (`tuple`): (H, W) of the source frame, the render size and the latents.
+            use_bbox_mask (`bool`): Build the single-person masks from `input_data['bbox']` instead of the whole frame.
+
+        Returns:
+            Tensor: Shape [3, lat_h, lat_w], float 0/1.
+        """
+        src_h, src_w = src_size
+        target_h, target_w = target_size
+        lat_h, lat_w = lat_size
+        # construct human mask
+        human_masks = []
+        if human_number==1 and use_bbox_mask and 'bbox' in input_data:
+            # only token merging and masked audio attention read the single-person mask
+            human_mask1 = torch.zeros([src_h, src_w])
+            for _, person_bbox in input_data['bbox'].items():
+                x_min, y_min, x_max, y_max = person_bbox
+                human_mask1[int(x_min):int(x_max), int(y_min):int(y_max)] = 1
+            background_mask = 1 - human_mask1
+            human_masks = [human_mask1, human_mask1.clone(), background_mask]
+        elif human_number==1:
+            background_mask = torch.ones([src_h, src_w])
+            human_mask1 = torch.ones([src_h, src_w])
+            human_mask2 = torch.ones([src_h, src_w])
+            human_masks = [human_mask1, human_mask2, background_mask]
+        elif human_number==2:
+            if 'bbox' in input_data:
+                assert len(input_data['bbox']) == len(input_data['cond_audio']), f"The number of target bbox should be the same with cond_audio"
+                background_mask = torch.zeros([src_h, src_w])
+                for _, person_bbox in input_data['bbox'].items():
+                    x_min, y_min, x_max, y_max = person_bbox
+                    human_mask = torch.zeros([src_h, src_w])
+                    human_mask[int(x_min):int(x_max), int(y_min):int(y_max)] = 1
+                    background_mask += human_mask
+                    human_masks.append(human_mask)
+            else:
+                x_min, x_max = int(src_h * face_scale), int(src_h * (1 - face_scale))
+                background_mask = torch.zeros([src_h, src_w])
+                background_mask = torch.zeros([src_h, src_w])
+                human_mask1 = torch.zeros([src_h, src_w])
+                human_mask2 = torch.zeros([src_h, src_w])
+                lefty_min, lefty_max = int((src_w//2) * face_scale), int((src_w//2) * (1 - face_scale))
+                righty_min, righty_max = int((src_w//2) * face_scale + (src_w//2)), int((src_w//2) * (1 - face_scale) + (src_w//2))
+                human_mask1[x_min:x_max, lefty_min:lefty_max] = 1
+                human_mask2[x_min:x_max, righty_min:righty_max] = 1
+                background_mask += human_mask1
+                background_mask += human_mask2
+                human_masks = [human_mask1, human_mask2]
+            background_mask = torch.where(background_mask > 0, torch.tensor(0), torch.tensor(1))
+            human_masks.append(background_mask)
+
+        ref_target_masks = torch.stack(human_masks, dim=0).to(self.device)
+        # resize and centercrop for ref_target_masks 
+        ref_target_masks = resize_and_centercrop(ref_target_masks, (target_h, target_w))
+
+        ref_target_masks = F.interpolate(ref_target_masks.unsqueeze(0), size=(lat_h, lat_w), mode='nearest').squeeze() 
+        ref_target_masks = (ref_target_masks > 0) 
+        ref_target_masks = ref_target_masks.float().to(self.device)
+        return ref_target_masks
+
     def enable_cpu_offload(self):
         self.cpu_offload = True
     
@@ -370,10 +563,28 @@ class InfiniteTalkPipeline:
                 else:
                     model.to(self.device)
         # fresh the cuda cache
-        torch.cuda.empty_cache()
+        torch_gc(force=True)
 
    
-    def generate_infinitetalk(self,
+    def generate_infinitetalk(self, *args, **kwargs):
+        r"""
+        Generates the whole video at once, see `generate_infinitetalk_iter` for the arguments.
+
+        Returns:
+            Tensor: Video (C, T, H, W), the `frame_sink` when one is given, None on non-zero ranks.
+        """
+        chunks = []
+        for chunk in self.generate_infinitetalk_iter(*args, **kwargs):
+            if chunk['frames'] is not None:
+                chunks.append(chunk['frames'])
+        if self.rank != 0:
+            return None
+        frame_sink = kwargs.get('frame_sink')
+        if frame_sink is not None:
+            return frame_sink
+        return torch.cat(chunks, dim=1).to(torch.float32)
+
+    def generate_infinitetalk_iter(self,
                  input_data,
                  size_buckget='infinitetalk-480',
                  motion_frame=25,
@@ -389,11 +600,26 @@ class InfiniteTalkPipeline:
                  face_scale=0.05,
                  progress=True,
                  color_correction_strength=0.0,
-                 extra_args=None):
+                 extra_args=None,
+                 target_size=None,
+                 frame_sink=None,
+                 progress_callback=None):
         r"""
-        Generates video frames from input image and text prompt using diffusion process.
+        Generates video frames from input image and text prompt using diffusion process, yielding every
+        chunk as soon as it is finished. Chunks are handed out between chunks only: while the finisher
+        overlaps a chunk with the next one, it arrives after the next chunk's decode, right away with
+        `serial_chunk_finish`. Closing the generator early releases the finisher, the condition video
+        and (with `offload_model`) the DiT.
 
         Args:
+            target_size (`tuple`, *optional*, defaults to None):
+                (H, W) to render at instead of the closest bucket of `size_buckget`. Both must be multiples of 16.
+            frame_sink (`FrameSink`, *optional*, defaults to None):
+                Receives every finished chunk as uint8 frames instead of returning the whole video,
+                host memory then stays flat however long the video is. Returned in place of the video.
+            progress_callback (`callable`, *optional*, defaults to None):
+                Called with a dict after every denoising step: `chunk_idx`, `num_chunks`, `step`,
+                `num_steps` and `elapsed` seconds since the job started.
             frame_num (`int`, *optional*, defaults to 81):
                 How many frames to sample from a video. The number should be 4n+1
             shift (`float`, *optional*, defaults to 5.0):
@@ -407,7 +633,19 @@ class InfiniteTalkPipeline:
                 Random seed for noise generation. If -1, use random seed
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+
+        Yields:
+            dict: Per chunk in order: `chunk_idx`, `num_chunks`, `frames` (C, T, H, W) with the new output
+            frames of the chunk (None when a `frame_sink` took them), `frame_range` (start, end) in the
+            output video and `timings` (`denoise`, `decode` and `finish` seconds).
         """
+        job_start = time.perf_counter()
+
+        # release the CUDA cache only under memory pressure or at component swaps
+        gc_threshold = getattr(extra_args, 'gc_threshold', None)
+        if gc_threshold is not None:
+            memory_policy.threshold = gc_threshold
+        memory_policy.reset_stats()
 
         # init teacache
         if extra_args.use_teacache:
@@ -419,19 +657,34 @@ class InfiniteTalkPipeline:
         else:
             self.model.disable_teacache()
 
+        # background token merging, one ratio per sampling step (the last one is repeated)
+        token_merge_ratios = getattr(extra_args, 'token_merge_ratios', None)
+        if token_merge_ratios is not None:
+            token_merge_ratios = list(token_merge_ratios)
+            token_merge_ratios += token_merge_ratios[-1:] * (sampling_steps - len(token_merge_ratios))
+
+        # audio cross-attention restricted to the dilated human masks
+        audio_attn_mask_dilation = getattr(extra_args, 'audio_attn_mask_dilation', None)
+        self.model.set_audio_attn_mask_dilation(audio_attn_mask_dilation)
+        use_bbox_mask = token_merge_ratios is not None or audio_attn_mask_dilation is not None
+
         input_prompt = input_data['prompt']
         cond_file_path = input_data['cond_video']
-        codec = get_video_codec(cond_file_path)
-        if codec == 'av1':
-            output_video_path = 'tmp/' + '_input_h264.mp4'
-            print(f"Converting {cond_file_path} from AV1 to H.264...")
-            convert_video_to_h264(cond_file_path, output_video_path)
-            print(f"Conversion complete! Saved as {output_video_path}")
-            cond_file_path = output_video_path
+        # a video input is probed (and transcoded when decord needs it) once per source file, and
+        # stays open for the whole job, its frames come straight out as tensors
+        frame_reader = None
+        if is_video(cond_file_path):
+            media_cache_gb = getattr(extra_args, 'media_cache_gb', None)
+            media_cache = get_media_cache(getattr(extra_args, 'media_cache_dir', None),
+                                          int(media_cache_gb * 1024 ** 3) if media_cache_gb is not None else None)
+            cond_file_path, media_info = ingest_video(cond_file_path, cache=media_cache)
+            logging.info(f"Condition video: {media_info}")
+            frame_reader = FrameReader(cond_file_path)
+            cond_image = frame_reader[0].permute(2, 0, 1) # C H W
+            src_h, src_w = cond_image.shape[1:]
         else:
-            print("No conversion needed.")
-        cond_image = extract_specific_frames(cond_file_path, 0)
-        # cond_image = Image.fromarray(cond_image)
+            cond_image = extract_specific_frames(cond_file_path, 0)
+            src_h, src_w = cond_image.height, cond_image.width
         
         
         # decide a proper size
@@ -441,22 +694,28 @@ class InfiniteTalkPipeline:
         elif size_buckget == 'infinitetalk-720':
             bucket_config = getattr(bucket_config_module, 'ASPECT_RATIO_960')
 
-        src_h, src_w = cond_image.height, cond_image.width
-        ratio = src_h / src_w
-        closest_bucket = sorted(list(bucket_config.keys()), key=lambda x: abs(float(x)-ratio))[0]
-        target_h, target_w = bucket_config[closest_bucket][0]
-        cond_image = resize_and_centercrop(cond_image, (target_h, target_w))
+        if target_size is not None:
+            target_h, target_w = target_size
+        else:
+            ratio = src_h / src_w
+            closest_bucket = sorted(list(bucket_config.keys()), key=lambda x: abs(float(x)-ratio))[0]
+            target_h, target_w = bucket_config[closest_bucket][0]
+        cond_image = resize_and_centercrop(cond_image, (target_h, target_w), mode='bilinear')
+        if frame_reader is not None:
+            cond_image = cond_image[None, :, None] # 1 C 1 H W
         cond_image = cond_image / 255
         cond_image = (cond_image - 0.5) * 2 # normalization
         cond_image = cond_image.to(self.device)  # 1 C 1 H W
 
         # Store the original image for color reference if strength > 0
         original_color_reference = None
+        color_stats = None
         if color_correction_strength > 0.0:
             original_color_reference = cond_image.clone()
+            color_stats = color_reference_stats(original_color_reference)
 
 
-        # read audio embeddings
+        # read audio embeddings, given as tensors (e.g. memory-mapped from the embedding cache) or paths
         audio_embedding_path_1 = input_data['cond_audio']['person1']
         if len(input_data['cond_audio']) == 1:
             HUMAN_NUMBER = 1
@@ -470,16 +729,24 @@ class InfiniteTalkPipeline:
         audio_embedding_paths = [audio_embedding_path_1, audio_embedding_path_2]
         for human_idx in range(HUMAN_NUMBER):   
             audio_embedding_path = audio_embedding_paths[human_idx]
-            if not os.path.exists(audio_embedding_path):
-                continue
-            full_audio_emb = torch.load(audio_embedding_path)
-            if torch.isnan(full_audio_emb).any():
+            if isinstance(audio_embedding_path, torch.Tensor):
+                full_audio_emb = audio_embedding_path
+            elif not os.path.exists(audio_embedding_path):
                 continue
+            else:
+                full_audio_emb = torch.load(audio_embedding_path)
+                # tensors come from the embedding cache, which rejects NaN when storing; reading a
+                # memory-mapped one in full here would page in the whole file
+                if torch.isnan(full_audio_emb).any():
+                    continue
             if full_audio_emb.shape[0] <= frame_num:
                 continue
             full_audio_embs.append(full_audio_emb) 
         
         assert len(full_audio_embs) == HUMAN_NUMBER, f"Aduio file not exists or length not satisfies frame nums."
+        if max_frames_num is None:
+            # no cap, the video runs as long as the audio
+            max_frames_num = len(full_audio_embs[0])
 
         # preprocess text embedding
         if n_prompt == "":
@@ -489,6 +756,7 @@ class InfiniteTalkPipeline:
             context, context_null = self.text_encoder([input_prompt, n_prompt], self.device)
             if offload_model:
                 self.text_encoder.model.cpu()
+                torch_gc(force=True)
         else:
             context = self.text_encoder([input_prompt], torch.device('cpu'))
             context_null = self.text_encoder([n_prompt], torch.device('cpu'))
@@ -497,14 +765,8 @@ class InfiniteTalkPipeline:
 
         torch_gc()
         # prepare params for video generation
-        indices = (torch.arange(2 * 2 + 1) - 2) * 1 
-        clip_length = frame_num
         is_first_clip = True
-        arrive_last_frame = False
         cur_motion_frames_num = 1
-        audio_start_idx = 0
-        audio_end_idx = audio_start_idx + clip_length
-        gen_video_list = []
         torch_gc()
 
         # set random seed and init noise
@@ -515,333 +777,365 @@ class InfiniteTalkPipeline:
         random.seed(seed)
         torch.backends.cudnn.deterministic = True
 
-        # start video generation iteratively
-        while True:
-            audio_embs = []
-            # split audio with window size
-            for human_idx in range(HUMAN_NUMBER):   
-                center_indices = torch.arange(
-                    audio_start_idx,
-                    audio_end_idx,
-                    1,
-                ).unsqueeze(
-                    1
-                ) + indices.unsqueeze(0)
-                center_indices = torch.clamp(center_indices, min=0, max=full_audio_embs[human_idx].shape[0]-1)
-                audio_emb = full_audio_embs[human_idx][center_indices][None,...].to(self.device)
-                audio_embs.append(audio_emb)
-            audio_embs = torch.concat(audio_embs, dim=0).to(self.param_dtype)
-            torch_gc()
-
-            h, w = cond_image.shape[-2], cond_image.shape[-1]
-            lat_h, lat_w = h // self.vae_stride[1], w // self.vae_stride[2]
-            max_seq_len = ((frame_num - 1) // self.vae_stride[0] + 1) * lat_h * lat_w // (
-                self.patch_size[1] * self.patch_size[2])
-            max_seq_len = int(math.ceil(max_seq_len / self.sp_size)) * self.sp_size
-
-
-
-            noise = torch.randn(
-                16, (frame_num - 1) // 4 + 1,
-                lat_h,
-                lat_w,
-                dtype=torch.float32,
-                device=self.device) 
-
-            # get mask
-            msk = torch.ones(1, frame_num, lat_h, lat_w, device=self.device)
-            msk[:, 1:] = 0
-            msk = torch.concat([
-                torch.repeat_interleave(msk[:, 0:1], repeats=4, dim=1), msk[:, 1:]
-            ],
-                            dim=1)
-            msk = msk.view(1, msk.shape[1] // 4, 4, lat_h, lat_w)
-            msk = msk.transpose(1, 2).to(self.param_dtype) # B 4 T H W
-
-            with torch.no_grad():
-                # get clip embedding
-                self.clip.model.to(self.device)
-                clip_context = self.clip.visual(cond_image[:, :, -1:, :, :]).to(self.param_dtype) 
-                if offload_model:
-                    self.clip.model.cpu()
-                torch_gc()
+        # chunk-invariant conditioning: latent geometry, first-frame mask and human masks
+        h, w = target_h, target_w
+        lat_h, lat_w = h // self.vae_stride[1], w // self.vae_stride[2]
 
-                # zero padding and vae encode
-                video_frames = torch.zeros(1, cond_image.shape[1], frame_num-cond_image.shape[2], target_h, target_w).to(self.device)
-                padding_frames_pixels_values = torch.concat([cond_image, video_frames], dim=2)
-                y = self.vae.encode(padding_frames_pixels_values) 
-                y = torch.stack(y).to(self.param_dtype) # B C T H W
-                cur_motion_frames_latent_num = int(1 + (cur_motion_frames_num-1) // 4)
+        msk = self.first_frame_mask(frame_num, lat_h, lat_w)
+        ref_target_masks = self.reference_target_masks(input_data, HUMAN_NUMBER, (src_h, src_w), (target_h, target_w),
+                                                       (lat_h, lat_w), face_scale=face_scale, use_bbox_mask=use_bbox_mask)
 
-                if is_first_clip:
-                    latent_motion_frames = self.vae.encode(cond_image)[0]
-                else:
-                    latent_motion_frames = self.vae.encode(cond_frame)[0]
+        torch_gc()
 
-                y = torch.concat([msk, y], dim=1) # B 4+C T H W
-                torch_gc()
+        # the chunk schedule is fixed by the audio length; the last chunk is only as long as needed, except
+        # in compile mode where every distinct length would be another static graph
+        shrink_tail = not getattr(extra_args, 'fixed_chunk_length', False) and self.compile_cache_dir is None
+        chunk_plan, wasted_frames = plan_chunks(len(full_audio_embs[0]), frame_num, motion_frame, max_frames_num, shrink_tail)
+        _, fixed_wasted_frames = plan_chunks(len(full_audio_embs[0]), frame_num, motion_frame, max_frames_num, False)
+        logging.info(f"chunk plan: {len(chunk_plan)} chunks, last chunk {chunk_plan[-1][1]} frames, "
+                     f"{wasted_frames} generated frames trimmed ({fixed_wasted_frames} with full-length chunks)")
+
+        # the last chunk reads past the end of the audio, mirror its tail as far as a full-length chunk reaches
+        lazy_audio_windows = not getattr(extra_args, 'eager_audio_windows', False)
+        miss_lengths = [0] * HUMAN_NUMBER
+        if len(chunk_plan) > 1:
+            audio_end_idx = chunk_plan[-1][0] + frame_num
+            for human_idx in range(HUMAN_NUMBER):
+                if audio_end_idx >= len(full_audio_embs[human_idx]):
+                    miss_length = audio_end_idx - len(full_audio_embs[human_idx]) + 3
+                    if not lazy_audio_windows:
+                        add_audio_emb = torch.flip(full_audio_embs[human_idx][-1*miss_length:], dims=[0])
+                        full_audio_embs[human_idx] = torch.cat([full_audio_embs[human_idx], add_audio_emb], dim=0)
+                    miss_lengths[human_idx] = miss_length
+
+        if lazy_audio_windows:
+            # every chunk gathers its windows from the host embeddings, the mirrored tail by index, so
+            # device memory does not grow with the job length
+            audio_windows = LazyAudioWindows(full_audio_embs, window=5, device=self.device, dtype=self.param_dtype,
+                                             mirror_lengths=miss_lengths)
+        else:
+            # audio windows of the whole job stay on the device, every chunk takes a zero-copy slice
+            audio_windows = build_audio_windows(full_audio_embs, window=5, device=self.device, dtype=self.param_dtype)
+        del full_audio_embs
+
+        # CLIP context and padded VAE latents of the condition frames. An image input has a single
+        # condition frame; for a video input the first frames of the coming chunks are decoded in one
+        # forward pass and encoded in batches of `cond_batch_size`, one window ahead of the DiT loop.
+        encode = partial(
+            self.encode_condition,
+            frame_num=frame_num,
+            msk=msk,
+            offload_model=offload_model,
+            pad_encode_tol=getattr(extra_args, 'pad_encode_tol', None),
+            pad_encode_check=getattr(extra_args, 'pad_encode_check', False),
+            pad_encode_check_tol=getattr(extra_args, 'pad_encode_check_tol', 1e-3),
+            batch_size=getattr(extra_args, 'cond_batch_size', 1))
+        load_frames = None
+        if frame_reader is not None:
+            def load_frames(chunk_ids):
+                return torch.stack([
+                    (resize_and_centercrop(frame.permute(2, 0, 1), (target_h, target_w), mode='bilinear') / 255 - 0.5) * 2
+                    for frame in frame_reader.get_batch([chunk_plan[i][0] for i in chunk_ids])
+                ])[:, :, None] # N C 1 H W
+        with torch.no_grad():
+            chunk_conditions = ChunkConditions(encode, len(chunk_plan), cond_image=cond_image, load_frames=load_frames,
+                                               batch_size=getattr(extra_args, 'cond_batch_size', 1))
+        chunk_idx = 0
+        # take the motion latents of the next chunk from this chunk's x0 instead of re-encoding decoded pixels
+        latent_motion = getattr(extra_args, 'latent_motion', False)
+        latent_motion_check = getattr(extra_args, 'latent_motion_check', False)
+        if latent_motion:
+            assert (motion_frame - 1) % self.vae_stride[0] == 0, \
+                f"latent motion conditioning needs motion_frame = 4n+1, got {motion_frame}"
+        # output length: max_frames_num, cut to the audio when the last chunk ran past its end
+        output_frames = int(max_frames_num)
+        if max_frames_num > frame_num and sum(miss_lengths) > 0:
+            output_frames = min(output_frames, full_audio_emb.shape[0])
+        chunk_finisher = ChunkFinisher(
+            original_color_reference,
+            color_correction_strength,
+            overlap=not getattr(extra_args, 'serial_chunk_finish', False),
+            sink=frame_sink if self.rank == 0 else None,
+            max_frames=output_frames,
+            reference_stats=color_stats)
+        # with latent motion the next chunk never looks at this chunk's pixels, so the finisher decodes
+        # them on its side stream while the next chunk is denoised
+        defer_decode = latent_motion and not latent_motion_check and chunk_finisher.overlap
+
+        def decode_latents(latent):
+            return torch.stack(self.vae.decode([latent])) # B C T H W
+
+        # start video generation iteratively. Chunks are only handed out between chunks, outside the
+        # no_grad / no_sync blocks, and a generator closed early still releases the finisher, the
+        # video and the model
+        try:
+            while True:
+                chunk_start = time.perf_counter()
+                audio_start_idx, chunk_frames = chunk_plan[chunk_idx]
+                chunk_latent_frames = (chunk_frames - 1) // self.vae_stride[0] + 1
+                max_seq_len = chunk_latent_frames * lat_h * lat_w // (
+                    self.patch_size[1] * self.patch_size[2])
+                max_seq_len = int(math.ceil(max_seq_len / self.sp_size)) * self.sp_size
+
+                # split audio with window size
+                audio_embs = audio_windows[:, audio_start_idx:audio_start_idx + chunk_frames]
+
+                noise = torch.randn(
+                    16, chunk_latent_frames,
+                    lat_h,
+                    lat_w,
+                    dtype=torch.float32,
+                    device=self.device) 
+
+                with torch.no_grad():
+                    clip_context, y = chunk_conditions.get(chunk_idx, chunk_latent_frames)
+                    cur_motion_frames_latent_num = int(1 + (cur_motion_frames_num-1) // 4)
+
+                    if is_first_clip:
+                        latent_motion_frames = self.vae.encode(cond_image)[0]
+                    elif latent_motion:
+                        # with frame_num and motion_frame both 4n+1 the 4-frame groups of the motion frames line
+                        # up with the last latent frames of the previous x0; only the leading latent differs, it
+                        # spans four frames in x0 but the single first motion frame when re-encoded
+                        latent_motion_frames = prev_x0[:, -cur_motion_frames_latent_num:]
+                        if latent_motion_check:
+                            encoded = self.vae.encode(cond_frame)[0]
+                            drift = (latent_motion_frames - encoded).float()
+                            logging.info(f"latent motion drift (chunk {chunk_idx}): "
+                                         f"mean abs {drift.abs().mean().item():.4f}, "
+                                         f"rel l2 {(drift.norm() / encoded.float().norm()).item():.4f}")
+                    else:
+                        latent_motion_frames = self.vae.encode(cond_frame)[0]
+                    torch_gc()
             
 
-            # construct human mask
-            human_masks = []
-            if HUMAN_NUMBER==1:
-                background_mask = torch.ones([src_h, src_w])
-                human_mask1 = torch.ones([src_h, src_w])
-                human_mask2 = torch.ones([src_h, src_w])
-                human_masks = [human_mask1, human_mask2, background_mask]
-            elif HUMAN_NUMBER==2:
-                if 'bbox' in input_data:
-                    assert len(input_data['bbox']) == len(input_data['cond_audio']), f"The number of target bbox should be the same with cond_audio"
-                    background_mask = torch.zeros([src_h, src_w])
-                    for _, person_bbox in input_data['bbox'].items():
-                        x_min, y_min, x_max, y_max = person_bbox
-                        human_mask = torch.zeros([src_h, src_w])
-                        human_mask[int(x_min):int(x_max), int(y_min):int(y_max)] = 1
-                        background_mask += human_mask
-                        human_masks.append(human_mask)
-                else:
-                    x_min, x_max = int(src_h * face_scale), int(src_h * (1 - face_scale))
-                    background_mask = torch.zeros([src_h, src_w])
-                    background_mask = torch.zeros([src_h, src_w])
-                    human_mask1 = torch.zeros([src_h, src_w])
-                    human_mask2 = torch.zeros([src_h, src_w])
-                    lefty_min, lefty_max = int((src_w//2) * face_scale), int((src_w//2) * (1 - face_scale))
-                    righty_min, righty_max = int((src_w//2) * face_scale + (src_w//2)), int((src_w//2) * (1 - face_scale) + (src_w//2))
-                    human_mask1[x_min:x_max, lefty_min:lefty_max] = 1
-                    human_mask2[x_min:x_max, righty_min:righty_max] = 1
-                    background_mask += human_mask1
-                    background_mask += human_mask2
-                    human_masks = [human_mask1, human_mask2]
-                background_mask = torch.where(background_mask > 0, torch.tensor(0), torch.tensor(1))
-                human_masks.append(background_mask)
-
-            ref_target_masks = torch.stack(human_masks, dim=0).to(self.device)
-            # resize and centercrop for ref_target_masks 
-            ref_target_masks = resize_and_centercrop(ref_target_masks, (target_h, target_w))
-
-            _, _, _,lat_h, lat_w = y.shape
-            ref_target_masks = F.interpolate(ref_target_masks.unsqueeze(0), size=(lat_h, lat_w), mode='nearest').squeeze() 
-            ref_target_masks = (ref_target_masks > 0) 
-            ref_target_masks = ref_target_masks.float().to(self.device)
-
-            torch_gc()
+                torch_gc()
 
-            @contextmanager
-            def noop_no_sync():
-                yield
+                @contextmanager
+                def noop_no_sync():
+                    yield
 
-            no_sync = getattr(self.model, 'no_sync', noop_no_sync)
+                no_sync = getattr(self.model, 'no_sync', noop_no_sync)
 
-            # evaluation mode
-            with torch.no_grad(), no_sync():
+                # evaluation mode
+                with torch.no_grad(), no_sync():
                 
-                # prepare timesteps
-                timesteps = list(np.linspace(self.num_timesteps, 1, sampling_steps, dtype=np.float32))
-                timesteps.append(0.)
-                timesteps = [torch.tensor([t], device=self.device) for t in timesteps]
-                if self.use_timestep_transform:
-                    timesteps = [timestep_transform(t, shift=shift, num_timesteps=self.num_timesteps) for t in timesteps]
+                    # prepare timesteps
+                    timesteps = list(np.linspace(self.num_timesteps, 1, sampling_steps, dtype=np.float32))
+                    timesteps.append(0.)
+                    timesteps = [torch.tensor([t], device=self.device) for t in timesteps]
+                    if self.use_timestep_transform:
+                        timesteps = [timestep_transform(t, shift=shift, num_timesteps=self.num_timesteps) for t in timesteps]
                 
-                # sample videos
-                latent = noise
-
-                # prepare condition and uncondition configs
-                arg_c = {
-                    'context': [context],
-                    'clip_fea': clip_context,
-                    'seq_len': max_seq_len,
-                    'y': y,
-                    'audio': audio_embs,
-                    'ref_target_masks': ref_target_masks
-                }
-
-
-                arg_null_text = {
-                    'context': [context_null],
-                    'clip_fea': clip_context,
-                    'seq_len': max_seq_len,
-                    'y': y,
-                    'audio': audio_embs,
-                    'ref_target_masks': ref_target_masks
-                }
-
-                arg_null_audio = {
-                    'context': [context],
-                    'clip_fea': clip_context,
-                    'seq_len': max_seq_len,
-                    'y': y,
-                    'audio': torch.zeros_like(audio_embs)[-1:],
-                    'ref_target_masks': ref_target_masks
-                }
-
-
-                arg_null = {
-                    'context': [context_null],
-                    'clip_fea': clip_context,
-                    'seq_len': max_seq_len,
-                    'y': y,
-                    'audio': torch.zeros_like(audio_embs)[-1:],
-                    'ref_target_masks': ref_target_masks
-                }
+                    # sample videos
+                    latent = noise
+
+                    # prepare condition and uncondition configs
+                    arg_c = {
+                        'context': [context],
+                        'clip_fea': clip_context,
+                        'seq_len': max_seq_len,
+                        'y': y,
+                        'audio': audio_embs,
+                        'ref_target_masks': ref_target_masks
+                    }
+
+
+                    arg_null_text = {
+                        'context': [context_null],
+                        'clip_fea': clip_context,
+                        'seq_len': max_seq_len,
+                        'y': y,
+                        'audio': audio_embs,
+                        'ref_target_masks': ref_target_masks
+                    }
+
+                    arg_null_audio = {
+                        'context': [context],
+                        'clip_fea': clip_context,
+                        'seq_len': max_seq_len,
+                        'y': y,
+                        'audio': torch.zeros_like(audio_embs)[-1:],
+                        'ref_target_masks': ref_target_masks
+                    }
+
+
+                    arg_null = {
+                        'context': [context_null],
+                        'clip_fea': clip_context,
+                        'seq_len': max_seq_len,
+                        'y': y,
+                        'audio': torch.zeros_like(audio_embs)[-1:],
+                        'ref_target_masks': ref_target_masks
+                    }
 
-                torch_gc()
-                if not self.vram_management:
-                    self.model.to(self.device)
-                else:
-                    self.load_models_to_device(["model"])
-                
-                # injecting motion frames
-                if not is_first_clip:
-                    latent_motion_frames = latent_motion_frames.to(latent.dtype).to(self.device)
-                    motion_add_noise = torch.randn_like(latent_motion_frames).contiguous()
-                    add_latent = self.add_noise(latent_motion_frames, motion_add_noise, timesteps[0])
-                    _, T_m, _, _ = add_latent.shape
-                    latent[:, :T_m] = add_latent
-
-                # infer with APG
-                # refer https://arxiv.org/abs/2410.02416   
-                if extra_args.use_apg:  
-                    text_momentumbuffer  = MomentumBuffer(extra_args.apg_momentum) 
-                    audio_momentumbuffer = MomentumBuffer(extra_args.apg_momentum) 
-
-
-                progress_wrap = partial(tqdm, total=len(timesteps)-1) if progress else (lambda x: x)
-                for i in progress_wrap(range(len(timesteps)-1)):
-                    timestep = timesteps[i]
-                    latent[:, :cur_motion_frames_latent_num] = latent_motion_frames
-                    latent_model_input = [latent.to(self.device)]
-
-                    # inference with CFG strategy
-                    noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0] 
                     torch_gc()
-
-                    if math.isclose(text_guide_scale, 1.0):
-                        noise_pred_drop_audio = self.model(
-                            latent_model_input, t=timestep, **arg_null_audio)[0]  
-                        torch_gc()
-                    else:
-                        noise_pred_drop_text = self.model(
-                            latent_model_input, t=timestep, **arg_null_text)[0] 
-                        torch_gc()
-                        noise_pred_uncond = self.model(
-                            latent_model_input, t=timestep, **arg_null)[0]  
-                        torch_gc()
-
-                    if extra_args.use_apg:
-                        # correct update direction
-                        if math.isclose(text_guide_scale, 1.0):
-                            diff_uncond_audio  = noise_pred_cond - noise_pred_drop_audio
-                            noise_pred = noise_pred_cond + (audio_guide_scale - 1)* adaptive_projected_guidance(diff_uncond_audio, 
-                                                                                            noise_pred_cond, 
-                                                                                            momentum_buffer=audio_momentumbuffer, 
-                                                                                            norm_threshold=extra_args.apg_norm_threshold)
-                        else:
-                            diff_uncond_text  = noise_pred_cond - noise_pred_drop_text
-                            diff_uncond_audio = noise_pred_drop_text - noise_pred_uncond
-                            noise_pred = noise_pred_cond + (text_guide_scale - 1) * adaptive_projected_guidance(diff_uncond_text, 
-                                                                                                                noise_pred_cond, 
-                                                                                                                momentum_buffer=text_momentumbuffer, 
-                                                                                                                norm_threshold=extra_args.apg_norm_threshold) \
-                                + (audio_guide_scale - 1) * adaptive_projected_guidance(diff_uncond_audio, 
-                                                                                            noise_pred_cond, 
-                                                                                            momentum_buffer=audio_momentumbuffer, 
-                                                                                            norm_threshold=extra_args.apg_norm_threshold)
+                    if not self.vram_management:
+                        self.model.to(self.device)
                     else:
-                        # vanilla CFG strategy
-                        if math.isclose(text_guide_scale, 1.0):
-                            noise_pred = noise_pred_drop_audio + audio_guide_scale* (noise_pred_cond - noise_pred_drop_audio)  
-                        else:
-                            noise_pred = noise_pred_uncond + text_guide_scale * (
-                                noise_pred_cond - noise_pred_drop_text) + \
-                                audio_guide_scale * (noise_pred_drop_text - noise_pred_uncond)  
-                    noise_pred = -noise_pred  
-
-                    # update latent
-                    dt = timesteps[i] - timesteps[i + 1]
-                    dt = dt / self.num_timesteps
-                    latent = latent + noise_pred * dt[:, None, None, None]
-
+                        self.load_models_to_device(["model"])
+                
                     # injecting motion frames
                     if not is_first_clip:
                         latent_motion_frames = latent_motion_frames.to(latent.dtype).to(self.device)
                         motion_add_noise = torch.randn_like(latent_motion_frames).contiguous()
-                        add_latent = self.add_noise(latent_motion_frames, motion_add_noise, timesteps[i+1])
+                        add_latent = self.add_noise(latent_motion_frames, motion_add_noise, timesteps[0])
                         _, T_m, _, _ = add_latent.shape
                         latent[:, :T_m] = add_latent
 
-                    latent[:, :cur_motion_frames_latent_num] = latent_motion_frames
-                    x0 = [latent.to(self.device)] 
-                    del latent_model_input, timestep
-                
-                if offload_model: 
-                    if not self.vram_management:
-                        self.model.cpu()
-                torch_gc()
+                    # infer with APG
+                    # refer https://arxiv.org/abs/2410.02416   
+                    if extra_args.use_apg:  
+                        text_momentumbuffer  = MomentumBuffer(extra_args.apg_momentum) 
+                        audio_momentumbuffer = MomentumBuffer(extra_args.apg_momentum) 
 
-                videos = self.vae.decode(x0)
-            
-            # cache generated samples
-            videos = torch.stack(videos).cpu() # B C T H W
-            # >>> START OF COLOR CORRECTION STEP <<<
-            if color_correction_strength > 0.0 and original_color_reference is not None:
-                videos = match_and_blend_colors(videos, original_color_reference, color_correction_strength)
-            # >>> END OF COLOR CORRECTION STEP <<<
-
-            if is_first_clip:
-                gen_video_list.append(videos)
-            else:
-                gen_video_list.append(videos[:, :, cur_motion_frames_num:])
-
-            # decide whether is done
-            if arrive_last_frame: break
-
-            # update next condition frames
-            is_first_clip = False
-            cur_motion_frames_num = motion_frame
-
-            cond_frame = videos[:, :, -cur_motion_frames_num:].to(torch.float32).to(self.device)
-            audio_start_idx += (frame_num - cur_motion_frames_num)
-            audio_end_idx = audio_start_idx + clip_length
-
-            cond_image = extract_specific_frames(cond_file_path, audio_start_idx)
-            # cond_image = Image.fromarray(cond_image)
-            cond_image = resize_and_centercrop(cond_image, (target_h, target_w))
-            cond_image = cond_image / 255
-            cond_image = (cond_image - 0.5) * 2 # normalization
-            cond_image = cond_image.to(self.device)  # 1 C 1 H W
-
-            # Repeat audio emb
-            if audio_end_idx >= min(max_frames_num, len(full_audio_embs[0])):
-                arrive_last_frame = True
-                miss_lengths = []
-                source_frames = []
-                for human_inx in range(HUMAN_NUMBER):
-                    source_frame = len(full_audio_embs[human_inx])
-                    source_frames.append(source_frame)
-                    if audio_end_idx >= len(full_audio_embs[human_inx]):
-                        miss_length   = audio_end_idx - len(full_audio_embs[human_inx]) + 3 
-                        add_audio_emb = torch.flip(full_audio_embs[human_inx][-1*miss_length:], dims=[0])
-                        full_audio_embs[human_inx] = torch.cat([full_audio_embs[human_inx], add_audio_emb], dim=0)
-                        miss_lengths.append(miss_length)
-                    else:
-                        miss_lengths.append(0)
 
-            
-            if max_frames_num <= frame_num: break
-            
-            torch_gc()
-            if offload_model:    
-                torch.cuda.synchronize()
-            if dist.is_initialized():
-                dist.barrier()
+                    progress_wrap = partial(tqdm, total=len(timesteps)-1) if progress else (lambda x: x)
+                    for i in progress_wrap(range(len(timesteps)-1)):
+                        timestep = timesteps[i]
+                        if token_merge_ratios is not None:
+                            self.model.set_token_merge_ratio(token_merge_ratios[i])
+                        latent[:, :cur_motion_frames_latent_num] = latent_motion_frames
+                        latent_model_input = [latent.to(self.device)]
+
+                        # inference with CFG strategy
+                        noise_pred_cond = self.model(
+                        latent_model_input, t=timestep, **arg_c)[0] 
+                        torch_gc()
+
+                        if math.isclose(text_guide_scale, 1.0):
+                            noise_pred_drop_audio = self.model(
+                                latent_model_input, t=timestep, **arg_null_audio)[0]  
+                            torch_gc()
+                        else:
+                            noise_pred_drop_text = self.model(
+                                latent_model_input, t=timestep, **arg_null_text)[0] 
+                            torch_gc()
+                            noise_pred_uncond = self.model(
+                                latent_model_input, t=timestep, **arg_null)[0]  
+                            torch_gc()
+
+                        if extra_args.use_apg:
+                            # correct update direction
+                            if math.isclose(text_guide_scale, 1.0):
+                                diff_uncond_audio  = noise_pred_cond - noise_pred_drop_audio
+                                noise_pred = noise_pred_cond + (audio_guide_scale - 1)* adaptive_projected_guidance(diff_uncond_audio, 
+                                                                                                noise_pred_cond, 
+                                                                                                momentum_buffer=audio_momentumbuffer, 
+                                                                                                norm_threshold=extra_args.apg_norm_threshold)
+                            else:
+                                diff_uncond_text  = noise_pred_cond - noise_pred_drop_text
+                                diff_uncond_audio = noise_pred_drop_text - noise_pred_uncond
+                                noise_pred = noise_pred_cond + (text_guide_scale - 1) * adaptive_projected_guidance(diff_uncond_text, 
+                                                                                                                    noise_pred_cond, 
+                                                                                                                    momentum_buffer=text_momentumbuffer, 
+                                                                                                                    norm_threshold=extra_args.apg_norm_threshold) \
+                                    + (audio_guide_scale - 1) * adaptive_projected_guidance(diff_uncond_audio, 
+                                                                                                noise_pred_cond, 
+                                                                                                momentum_buffer=audio_momentumbuffer, 
+                                                                                                norm_threshold=extra_args.apg_norm_threshold)
+                        else:
+                            # vanilla CFG strategy
+                            if math.isclose(text_guide_scale, 1.0):
+                                noise_pred = noise_pred_drop_audio + audio_guide_scale* (noise_pred_cond - noise_pred_drop_audio)  
+                            else:
+                                noise_pred = noise_pred_uncond + text_guide_scale * (
+                                    noise_pred_cond - noise_pred_drop_text) + \
+                                    audio_guide_scale * (noise_pred_drop_text - noise_pred_uncond)  
+                        noise_pred = -noise_pred  
+
+                        # update latent
+                        dt = timesteps[i] - timesteps[i + 1]
+                        dt = dt / self.num_timesteps
+                        latent = latent + noise_pred * dt[:, None, None, None]
+
+                        # injecting motion frames
+                        if not is_first_clip:
+                            latent_motion_frames = latent_motion_frames.to(latent.dtype).to(self.device)
+                            motion_add_noise = torch.randn_like(latent_motion_frames).contiguous()
+                            add_latent = self.add_noise(latent_motion_frames, motion_add_noise, timesteps[i+1])
+                            _, T_m, _, _ = add_latent.shape
+                            latent[:, :T_m] = add_latent
+
+                        latent[:, :cur_motion_frames_latent_num] = latent_motion_frames
+                        x0 = [latent.to(self.device)] 
+                        del latent_model_input, timestep
+
+                        if progress_callback is not None:
+                            progress_callback(dict(chunk_idx=chunk_idx,
+                                                   num_chunks=len(chunk_plan),
+                                                   step=i + 1,
+                                                   num_steps=len(timesteps) - 1,
+                                                   elapsed=time.perf_counter() - job_start))
+                    denoise_end = time.perf_counter()
+                
+                    if token_merge_ratios is not None:
+                        self.model.set_token_merge_ratio(0.0)
+                        seq_total, merged_total = self.model.pop_token_merge_stats()
+                        if seq_total > 0:
+                            logging.info(f"token merge: self-attn/FFN sequence {seq_total} -> {merged_total} tokens "
+                                         f"({100 * (1 - merged_total / seq_total):.1f}% reduction)")
+
+                    if offload_model: 
+                        if not self.vram_management:
+                            self.model.cpu()
+                    torch_gc(force=offload_model and not self.vram_management)
+
+                    videos = None if defer_decode else decode_latents(x0[0])
+                    if latent_motion:
+                        prev_x0 = x0[0]
+                    decode_end = time.perf_counter()
+
+                chunk_info = dict(chunk_idx=chunk_idx, num_chunks=len(chunk_plan),
+                                  timings=dict(denoise=denoise_end - chunk_start))
+                skip = 0 if is_first_clip else cur_motion_frames_num
+                if videos is None:
+                    # decoded, color-corrected, copied and trimmed by the finisher as a whole
+                    chunk_finisher.submit(x0[0], skip=skip, info=chunk_info, decode=decode_latents)
+                    motion_frames = None
+                else:
+                    # the next chunk only needs the motion frames: color-correct those now and let the
+                    # finisher copy, correct and trim the rest while the next chunk is denoised
+                    chunk_info['timings']['decode'] = decode_end - denoise_end
+                    motion_frames = videos[:, :, -motion_frame:]
+                    corrected_tail = None
+                    # >>> START OF COLOR CORRECTION STEP <<<
+                    if color_correction_strength > 0.0 and original_color_reference is not None:
+                        corrected_tail = match_and_blend_colors(motion_frames, original_color_reference, color_correction_strength,
+                                                                reference_stats=color_stats)
+                        motion_frames = corrected_tail
+                    # >>> END OF COLOR CORRECTION STEP <<<
+                    chunk_finisher.submit(videos, corrected_tail, skip=skip, info=chunk_info)
+                del videos
+                for chunk in chunk_finisher.pop_finished():
+                    yield chunk
+
+                # decide whether is done
+                if chunk_idx == len(chunk_plan) - 1: break
+
+                # update next condition frames
+                is_first_clip = False
+                chunk_idx += 1
+                cur_motion_frames_num = motion_frame
+
+                if motion_frames is not None:
+                    cond_frame = motion_frames.to(torch.float32).to(self.device)
+
+                torch_gc()
+                if offload_model:    
+                    torch.cuda.synchronize()
+                if dist.is_initialized():
+                    dist.barrier()
         
-        gen_video_samples = torch.cat(gen_video_list, dim=2)[:, :, :int(max_frames_num)] 
-        gen_video_samples = gen_video_samples.to(torch.float32)
-        if max_frames_num > frame_num and sum(miss_lengths) > 0:
-            # split video frames
-            # gen_video_samples = gen_video_samples[:, :, :-1*miss_lengths[0]]
-            gen_video_samples = gen_video_samples[:, :, :full_audio_emb.shape[0]]
+            for chunk in chunk_finisher.collect():
+                yield chunk
+        finally:
+            chunk_finisher.close()
+            if frame_reader is not None:
+                frame_reader.close()
+            if offload_model and not self.vram_management:
+                self.model.cpu()
+            torch_gc()
         
         if dist.is_initialized():
             dist.barrier()
@@ -849,7 +1143,105 @@ class InfiniteTalkPipeline:
         del noise, latent
         torch_gc()
 
-        return gen_video_samples[0] if self.rank == 0 else None
-    
+        logging.info(memory_policy.summary())
 
-   
+        if self.compile_cache_dir is not None and self.rank == 0:
+            save_compile_cache(self.compile_cache_dir)
+
+    def generate_infinitetalk_roi(self,
+                                  input_data,
+                                  size_buckget='infinitetalk-480',
+                                  roi_margin=0.6,
+                                  roi_bucket_scale=1.0,
+                                  roi_feather=16,
+                                  **kwargs):
+        r"""
+        Generates only the head-and-shoulders region of an image input and composites it onto the static reference.
+
+        The region is the union of `input_data['bbox']` (source image pixels, [x_min, y_min, x_max, y_max] with x
+        along the height as in the human masks) or, without bbox, the largest detected face. It is grown by
+        `roi_margin`, snapped to an `ASPECT_RATIO_627` bucket and rendered by `generate_infinitetalk`. Video inputs
+        and regions that cover most of the frame fall back to full-frame generation.
+
+        Args:
+            roi_margin (`float`, *optional*, defaults to 0.6):
+                Padding around the box as a fraction of its larger side.
+            roi_bucket_scale (`float`, *optional*, defaults to 1.0):
+                Scales the crop bucket down to render fewer tokens.
+            roi_feather (`int`, *optional*, defaults to 16):
+                Width in output pixels of the blend ramp at the crop border.
+            kwargs:
+                Forwarded to `generate_infinitetalk`.
+
+        Returns:
+            Tensor: Video (C, T, H, W) at the full-frame bucket size (the `frame_sink` when one is given),
+            None on non-zero ranks.
+        """
+        cond_file_path = input_data['cond_video']
+        if is_video(cond_file_path):
+            logging.info("ROI mode only supports image inputs, generating the full frame.")
+            return self.generate_infinitetalk(input_data, size_buckget=size_buckget, **kwargs)
+
+        # static plate at the full-frame bucket size
+        image = Image.open(cond_file_path).convert("RGB")
+        bucket_config = ASPECT_RATIO_627 if size_buckget == 'infinitetalk-480' else ASPECT_RATIO_960
+        ratio = image.height / image.width
+        closest_bucket = sorted(list(bucket_config.keys()), key=lambda x: abs(float(x)-ratio))[0]
+        plate_h, plate_w = bucket_config[closest_bucket][0]
+        plate = resize_and_centercrop(image, (plate_h, plate_w))[0] # C 1 H W
+        plate_np = plate[:, 0].permute(1, 2, 0).numpy().astype(np.uint8)
+
+        # map source pixels onto the plate (same geometry as resize_and_centercrop)
+        scale = max(plate_h / image.height, plate_w / image.width)
+        off_y = int(round((math.ceil(scale * image.height) - plate_h) / 2.0))
+        off_x = int(round((math.ceil(scale * image.width) - plate_w) / 2.0))
+        plate_bboxes = {}
+        if 'bbox' in input_data:
+            for name, (x_min, y_min, x_max, y_max) in input_data['bbox'].items():
+                plate_bboxes[name] = [x_min * scale - off_y, y_min * scale - off_x,
+                                      x_max * scale - off_y, y_max * scale - off_x]
+            box = (min(b[0] for b in plate_bboxes.values()), min(b[1] for b in plate_bboxes.values()),
+                   max(b[2] for b in plate_bboxes.values()), max(b[3] for b in plate_bboxes.values()))
+        else:
+            box = detect_face_box(plate_np)
+
+        if box is None:
+            logging.info("ROI mode found no face, generating the full frame.")
+            return self.generate_infinitetalk(input_data, size_buckget=size_buckget, **kwargs)
+
+        (top, left, box_h, box_w), (target_h, target_w) = expand_box_to_bucket(
+            box, (plate_h, plate_w), margin=roi_margin, bucket_config=ASPECT_RATIO_627, bucket_scale=roi_bucket_scale)
+        if box_h * box_w > 0.6 * plate_h * plate_w:
+            logging.info("ROI covers most of the frame, generating the full frame.")
+            return self.generate_infinitetalk(input_data, size_buckget=size_buckget, **kwargs)
+        logging.info(f"ROI {box_h}x{box_w} at ({top}, {left}) rendered at {target_h}x{target_w}, "
+                     f"{plate_h * plate_w / (target_h * target_w):.2f}x fewer latent tokens than {plate_h}x{plate_w}")
+
+        # the crop image is the condition, bboxes move into crop pixels, clamped to the crop so a box
+        # cut by the margin or the bucket snap still slices the right mask region
+        roi_input = dict(input_data)
+        if plate_bboxes:
+            roi_input['bbox'] = {name: [min(max(b[0] - top, 0), box_h), min(max(b[1] - left, 0), box_w),
+                                        min(max(b[2] - top, 0), box_h), min(max(b[3] - left, 0), box_w)]
+                                 for name, b in plate_bboxes.items()}
+        plate = (plate.float() / 255 - 0.5) * 2 # normalization
+        frame_sink = kwargs.pop('frame_sink', None)
+        if frame_sink is not None:
+            # composite every chunk before it reaches the sink
+            kwargs['frame_sink'] = TransformSink(
+                frame_sink, partial(feather_composite, plate=plate, box=(top, left, box_h, box_w), feather=roi_feather))
+        fd, crop_path = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        try:
+            Image.fromarray(plate_np[top:top + box_h, left:left + box_w]).save(crop_path)
+            roi_input['cond_video'] = crop_path
+            video = self.generate_infinitetalk(roi_input, size_buckget=size_buckget,
+                                               target_size=(target_h, target_w), **kwargs)
+        finally:
+            os.remove(crop_path)
+
+        if video is None:
+            return None
+        if frame_sink is not None:
+            return frame_sink
+        return feather_composite(video, plate, (top, left, box_h, box_w), feather=roi_feather)
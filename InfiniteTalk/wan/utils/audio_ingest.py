@@ -0,0 +1,139 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import os
+import subprocess
+
+import librosa
+import numpy as np
+import pyloudnorm as pyln
+import soundfile as sf
+
+__all__ = ['AudioIngest', 'decode_audio', 'loudness_norm']
+
+VIDEO_EXTS = ('.mp4', '.mov', '.avi', '.mkv')
+
+
+def loudness_norm(audio_array, sr=16000, lufs=-23):
+    meter = pyln.Meter(sr)
+    loudness = meter.integrated_loudness(audio_array)
+    if abs(loudness) > 100:
+        return audio_array
+    normalized_audio = pyln.normalize.loudness(audio_array, loudness, lufs)
+    return normalized_audio
+
+
+def decode_audio(path, sample_rate=16000):
+    """
+    Decodes `path` once into a mono float32 array at `sample_rate`, in memory.
+
+    Audio files libsndfile reads go through soundfile and, at another rate, the soxr resampler
+    (what `librosa.load` uses); videos and other containers are decoded by ffmpeg into a pipe.
+    """
+    if os.path.splitext(path)[1].lower() not in VIDEO_EXTS:
+        try:
+            audio, sr = sf.read(path, dtype='float32', always_2d=True)
+        except RuntimeError:
+            audio = None
+        if audio is not None:
+            audio = audio.mean(axis=1)
+            if sr != sample_rate:
+                audio = librosa.resample(audio, orig_sr=sr, target_sr=sample_rate, res_type='soxr_hq')
+            return audio
+    result = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", path, "-vn",
+         "-f", "f32le", "-ac", "1", "-ar", f"{sample_rate}", "-"],
+        stdout=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.float32).copy()
+
+
+class AudioIngest:
+    """
+    Speech inputs of one job, each decoded and loudness-normalized once.
+
+    The returned arrays are shared by the summed track, the per-speaker embeddings and the final
+    mux, so the same file is never decoded twice and no temporary wav is written. Sources are paths
+    or already prepared arrays (e.g. from `split`), 'None' stands for a silent speaker.
+    """
+
+    def __init__(self, sample_rate=16000, lufs=-23, fps=25):
+        self.sample_rate = sample_rate
+        self.lufs = lufs
+        self.fps = fps
+        self.decoded = {}
+        self.prepared = {}
+
+    def decode(self, path):
+        if path not in self.decoded:
+            self.decoded[path] = decode_audio(path, self.sample_rate)
+        return self.decoded[path]
+
+    def single(self, source):
+        """Loudness-normalized speech of `source`."""
+        if isinstance(source, np.ndarray):
+            return source
+        if source not in self.prepared:
+            self.prepared[source] = loudness_norm(self.decode(source), self.sample_rate, self.lufs)
+        return self.prepared[source]
+
+    def multi(self, left, right, audio_type):
+        """
+        Two speakers, played in parallel ('para') or one after the other ('add').
+
+        Returns:
+            (speech1, speech2, sum): The per-speaker tracks and their mix.
+        """
+        if not (self._is_none(left) or self._is_none(right)):
+            speech1 = self.single(left)
+            speech2 = self.single(right)
+        elif self._is_none(left):
+            speech2 = self.single(right)
+            speech1 = np.zeros(speech2.shape[0])
+        else:
+            speech1 = self.single(left)
+            speech2 = np.zeros(speech1.shape[0])
+
+        if audio_type == 'para':
+            new_speech1, new_speech2 = speech1, speech2
+        elif audio_type == 'add':
+            new_speech1 = np.concatenate([speech1, np.zeros(speech2.shape[0])])
+            new_speech2 = np.concatenate([np.zeros(speech1.shape[0]), speech2])
+        return new_speech1, new_speech2, new_speech1 + new_speech2
+
+    def split(self, path, segments):
+        """
+        Loudness-normalized speech of every (start, end) segment in seconds of `path`, sliced from
+        one decode.
+        """
+        audio = self.decode(path)
+        return [
+            loudness_norm(audio[int(start * self.sample_rate):int(end * self.sample_rate)], self.sample_rate, self.lufs)
+            for start, end in segments
+        ]
+
+    def voice_bounds(self, audio, max_silence=0.0, threshold_db=-40):
+        """
+        Energy-based voice activity on video-frame windows: frames within `threshold_db` of the
+        loudest one are voiced. Silence before the first and after the last voiced frame is capped
+        at `max_silence` seconds.
+
+        Returns:
+            (start, end): Sample range to keep, on the video frame grid so the trimmed lengths are
+                whole frames (`end` is the track end when nothing is trimmed at the tail).
+        """
+        samples_per_frame = self.sample_rate // self.fps
+        num = len(audio) // samples_per_frame
+        if num == 0:
+            return 0, len(audio)
+        frames = np.asarray(audio[:num * samples_per_frame], dtype=np.float64).reshape(num, samples_per_frame)
+        level = 10 * np.log10((frames ** 2).mean(axis=1) + 1e-20)
+        voiced = np.flatnonzero(level > level.max() + threshold_db)
+        if len(voiced) == 0:
+            return 0, len(audio)
+        keep = int(round(max_silence * self.fps))
+        start_frame = max(voiced[0] - keep, 0)
+        end_frame = min(voiced[-1] + 1 + keep, num)
+        end = len(audio) if end_frame == num else end_frame * samples_per_frame
+        return start_frame * samples_per_frame, end
+
+    @staticmethod
+    def _is_none(source):
+        return isinstance(source, str) and source == 'None'
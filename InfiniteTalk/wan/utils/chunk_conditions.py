@@ -0,0 +1,44 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+
+__all__ = ['ChunkConditions']
+
+
+class ChunkConditions:
+    """
+    CLIP context and padded VAE latents of every chunk's condition frame, encoded a bounded window
+    ahead of the DiT loop.
+
+    An image input has a single condition frame, encoded once by `encode(cond_images)` and shared
+    by every chunk. For a video input `load_frames(chunk_ids)` returns the normalized condition
+    frames [N, C, 1, H, W] of those chunks; they are read and encoded `batch_size` chunks at a time
+    when the loop reaches the end of the previous window. Chunk starts only increase, so the video
+    is still decoded in one forward pass, while the device holds the conditioning of at most
+    `batch_size` chunks however long the job is.
+    """
+
+    def __init__(self, encode, num_chunks, cond_image=None, load_frames=None, batch_size=1):
+        self.encode = encode
+        self.num_chunks = num_chunks
+        self.load_frames = load_frames
+        self.batch_size = batch_size
+        self.first = 0
+        self.clip_context, self.y = None, None
+        if load_frames is None:
+            self.clip_context, self.y = encode(cond_image)
+
+    def get(self, chunk_idx, latent_frames):
+        """
+        Returns:
+            (clip_context, y): Shapes [1, 257, 1280] and [1, 4 + C, latent_frames, lat_h, lat_w] of chunk `chunk_idx`.
+        """
+        if self.load_frames is None:
+            index = 0
+        else:
+            if self.y is None or not self.first <= chunk_idx < self.first + len(self.y):
+                # release the previous window before encoding the next one
+                self.clip_context, self.y = None, None
+                chunk_ids = list(range(chunk_idx, min(chunk_idx + self.batch_size, self.num_chunks)))
+                self.clip_context, self.y = self.encode(self.load_frames(chunk_ids))
+                self.first = chunk_idx
+            index = chunk_idx - self.first
+        return self.clip_context[index:index + 1], self.y[index:index + 1, :, :latent_frames]
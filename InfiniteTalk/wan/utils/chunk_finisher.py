@@ -0,0 +1,142 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from .multitalk_utils import match_and_blend_colors
+
+__all__ = ['ChunkFinisher']
+
+
+class ChunkFinisher:
+    """
+    Finishes decoded chunks off the critical path of the streaming loop.
+
+    The next chunk only needs the motion frames of the current one, so the color correction of the
+    remaining frames and the device-to-host copy of the full chunk (both on a side CUDA stream, the
+    copy into pinned memory) and the motion-frame trim run on a worker thread while the next chunk is
+    denoised. At most one chunk is in flight, which bounds the extra device memory to one decoded
+    chunk. Color correction is per frame, so correcting the motion frames on the main thread and
+    the rest on the worker gives the same result as correcting the whole chunk at once. When the
+    next chunk does not need this chunk's pixels at all (latent motion conditioning), the VAE decode
+    is handed over as well and overlaps the first steps of the next chunk.
+
+    Finished chunks are cut at `max_frames` in total. With a `sink` their frames are written to it in
+    order and not kept. `pop_finished` / `collect` return one dict per chunk: the `info` given to
+    `submit` plus `frames` (C, T, H, W, None with a sink), `frame_range` and `timings['finish']`
+    (`timings['decode']` too for a chunk decoded here).
+    """
+
+    def __init__(self, reference=None, strength=0.0, overlap=True, sink=None, max_frames=None,
+                 reference_stats=None):
+        self.reference = reference
+        self.strength = strength
+        self.reference_stats = reference_stats
+        self.overlap = overlap
+        self.sink = sink
+        self.max_frames = max_frames
+        self.num_frames = 0
+        self.executor = ThreadPoolExecutor(max_workers=1) if overlap else None
+        self.stream = torch.cuda.Stream() if overlap and torch.cuda.is_available() else None
+        self.results = []
+
+    def submit(self, videos, corrected_tail=None, skip=0, info=None, decode=None):
+        """
+        Args:
+            videos (Tensor): Shape [B, C, T, H, W], decoded chunk, on any device. The latents of the
+                chunk with `decode`.
+            corrected_tail (Tensor): Already color-corrected last frames of `videos`, None when
+                color correction is disabled or the whole chunk is to be corrected here.
+            skip (int): Leading frames dropped from the finished chunk (overlap with the previous one).
+            info (dict): Passed through to the finished chunk.
+            decode (callable): Decodes the latents `videos` into the chunk, on the side stream.
+        """
+        info = {} if info is None else info
+        if not self.overlap:
+            self.results.append(self._finish(videos, corrected_tail, skip, info, None, decode))
+            return
+        if self.results:
+            # keep one chunk in flight
+            self.results[-1].result()
+        event = None
+        if self.stream is not None and videos.is_cuda:
+            event = torch.cuda.Event()
+            event.record()
+            videos.record_stream(self.stream)
+            if corrected_tail is not None and corrected_tail.is_cuda:
+                corrected_tail.record_stream(self.stream)
+        self.results.append(self.executor.submit(self._finish, videos, corrected_tail, skip, info, event, decode))
+
+    def _finish(self, videos, corrected_tail, skip, info, event, decode=None):
+        start = time.perf_counter()
+        decode_time = None
+        if event is not None:
+            with torch.cuda.stream(self.stream):
+                self.stream.wait_event(event)
+                videos, decode_time = self._decode(videos, decode)
+                videos = self._correct(videos, corrected_tail)
+                host = torch.empty(videos.shape, dtype=videos.dtype, pin_memory=True)
+                host.copy_(videos, non_blocking=True)
+            self.stream.synchronize()
+        else:
+            videos, decode_time = self._decode(videos, decode)
+            host = self._correct(videos, corrected_tail).cpu()
+        host = host[0, :, skip:]
+        if self.max_frames is not None:
+            host = host[:, :max(self.max_frames - self.num_frames, 0)]
+        frame_range = (self.num_frames, self.num_frames + host.shape[1])
+        self.num_frames = frame_range[1]
+        if self.sink is not None:
+            if host.shape[1] > 0:
+                self.sink.write(host)
+            host = None
+        timings = dict(info.get('timings', {}), finish=time.perf_counter() - start)
+        if decode_time is not None:
+            timings.update(decode=decode_time, finish=timings['finish'] - decode_time)
+        return dict(info, frames=host, frame_range=frame_range, timings=timings)
+
+    @staticmethod
+    def _decode(videos, decode):
+        if decode is None:
+            return videos, None
+        start = time.perf_counter()
+        # grad mode is per thread
+        with torch.no_grad():
+            videos = decode(videos)
+        if videos.is_cuda:
+            torch.cuda.current_stream().synchronize()
+        return videos, time.perf_counter() - start
+
+    def _correct(self, videos, corrected_tail):
+        # on the device of `videos`, the tail was corrected on the main thread unless the whole
+        # chunk is corrected here
+        if corrected_tail is None:
+            if self.reference is None or self.strength <= 0.0:
+                return videos
+            return match_and_blend_colors(videos, self.reference, self.strength, reference_stats=self.reference_stats)
+        num_tail = corrected_tail.shape[2]
+        head = match_and_blend_colors(videos[:, :, :-num_tail], self.reference, self.strength,
+                                      reference_stats=self.reference_stats)
+        return torch.cat([head, corrected_tail.to(head)], dim=2)
+
+    def pop_finished(self, wait=False):
+        """Returns the chunks finished so far in submission order, all of them with `wait`."""
+        finished = []
+        while self.results and (wait or not self.overlap or self.results[0].done()):
+            result = self.results.pop(0)
+            finished.append(result.result() if self.overlap else result)
+        return finished
+
+    def collect(self):
+        """Waits for every chunk and returns the remaining finished chunks."""
+        finished = self.pop_finished(wait=True)
+        self.close()
+        return finished
+
+    def close(self):
+        """Drops the chunks not collected yet and shuts the worker down, the chunk in flight is waited for."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.results = []
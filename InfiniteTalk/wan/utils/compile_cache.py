@@ -0,0 +1,110 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import os
+
+import torch
+
+from .multitalk_utils import ASPECT_RATIO_627, ASPECT_RATIO_960
+
+__all__ = ['bucket_shapes', 'setup_compile_cache', 'compile_module', 'save_compile_cache']
+
+ARTIFACTS_NAME = 'compile_artifacts.bin'
+
+
+def bucket_shapes(frame_num, vae_stride=(4, 8, 8), patch_size=(1, 2, 2), bucket_configs=(ASPECT_RATIO_627, ASPECT_RATIO_960)):
+    """
+    Static DiT shapes implied by the size buckets.
+
+    Returns:
+        dict: {(H, W): (latent frames, lat_h, lat_w, seq_len)} over `bucket_configs`.
+    """
+    shapes = {}
+    for bucket_config in bucket_configs:
+        for (h, w), _ in bucket_config.values():
+            lat_t = (frame_num - 1) // vae_stride[0] + 1
+            lat_h, lat_w = h // vae_stride[1], w // vae_stride[2]
+            seq_len = lat_t * lat_h * lat_w // (patch_size[1] * patch_size[2])
+            shapes[(h, w)] = (lat_t, lat_h, lat_w, seq_len)
+    return shapes
+
+
+def setup_compile_cache(cache_dir, cache_size_limit=64, suppress_errors=False):
+    """
+    Points the inductor caches at `cache_dir` and loads previously saved compile artifacts.
+
+    The inductor FX graph cache (and the AOTAutograd cache where torch has one) live under
+    `cache_dir`, so a worker sharing the directory skips inductor codegen for graphs compiled
+    before; dynamo still traces once per process. Portable artifacts (`save_compile_cache`) need
+    torch 2.7, older versions only log that they rely on the on-disk caches.
+
+    Unseen shapes recompile (and are cached); once `cache_size_limit` is hit dynamo runs the frame
+    eagerly. `suppress_errors` also falls back to eager when compilation fails; it is a process-wide
+    dynamo setting, so it is only changed when asked for.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # read by inductor when a cache path is first needed, i.e. before the first compile
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(cache_dir, 'inductor'))
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    os.environ.setdefault('TORCHINDUCTOR_AUTOGRAD_CACHE', '1')
+    # the env switches are only read when the configs are first imported, which may have happened
+    import torch._functorch.config as functorch_config
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+    if hasattr(functorch_config, 'enable_autograd_cache'):
+        functorch_config.enable_autograd_cache = True
+
+    import torch._dynamo
+    dynamo_config = torch._dynamo.config
+    dynamo_config.cache_size_limit = max(dynamo_config.cache_size_limit, cache_size_limit)
+    if hasattr(dynamo_config, 'accumulated_cache_size_limit'):
+        dynamo_config.accumulated_cache_size_limit = max(dynamo_config.accumulated_cache_size_limit, cache_size_limit * 8)
+    if hasattr(dynamo_config, 'inline_inbuilt_nn_modules'):
+        # identical blocks share one graph instead of one per module instance
+        dynamo_config.inline_inbuilt_nn_modules = True
+    if suppress_errors:
+        dynamo_config.suppress_errors = True
+
+    if not hasattr(torch.compiler, 'load_cache_artifacts'):
+        logging.warning(f"torch {torch.__version__} has no portable compile artifacts, "
+                        f"compiled graphs persist only through the inductor cache in {cache_dir}")
+        return
+    artifacts_path = os.path.join(cache_dir, ARTIFACTS_NAME)
+    if os.path.exists(artifacts_path):
+        with open(artifacts_path, 'rb') as f:
+            torch.compiler.load_cache_artifacts(f.read())
+        logging.info(f"Loaded compile artifacts from {artifacts_path}")
+
+
+def compile_module(module, **kwargs):
+    """
+    Compiles `module` in place, for static shapes unless `dynamic` is given, keeping its state dict
+    keys unchanged.
+    """
+    kwargs.setdefault('dynamic', False)
+    if hasattr(module, 'compile'):
+        module.compile(**kwargs)
+    else:
+        module.forward = torch.compile(module.forward, **kwargs)
+    return module
+
+
+def save_compile_cache(cache_dir):
+    """
+    Writes the compile artifacts of this process to `cache_dir` so cold workers can skip compilation.
+    The inductor FX graph cache under `cache_dir` is persisted by inductor itself, which is all
+    there is before torch 2.7.
+    """
+    if not hasattr(torch.compiler, 'save_cache_artifacts'):
+        logging.warning(f"torch {torch.__version__} cannot save portable compile artifacts, "
+                        f"relying on the inductor cache in {cache_dir}")
+        return
+    artifacts = torch.compiler.save_cache_artifacts()
+    if artifacts is None:
+        return
+    artifact_bytes, _ = artifacts
+    artifacts_path = os.path.join(cache_dir, ARTIFACTS_NAME)
+    tmp_path = f"{artifacts_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(artifact_bytes)
+    os.replace(tmp_path, artifacts_path)
+    logging.info(f"Saved compile artifacts to {artifacts_path}")
@@ -0,0 +1,129 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import warnings
+
+import numpy as np
+import torch
+from safetensors.torch import save_file
+
+__all__ = ['EmbeddingCache', 'load_mmap']
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'infinitetalk', 'audio_emb')
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+FP16_MAX = 65504
+
+_SAFETENSORS_DTYPES = {'F16': np.float16, 'F32': np.float32}
+
+
+def load_mmap(path, name='audio_emb'):
+    """
+    Memory-mapped, read-only tensor `name` of a safetensors file: only the rows that are indexed
+    are read from disk.
+    """
+    with open(path, 'rb') as f:
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len))
+    info = header[name]
+    begin, _ = info['data_offsets']
+    array = np.memmap(path, dtype=_SAFETENSORS_DTYPES[info['dtype']], mode='r',
+                      offset=8 + header_len + begin, shape=tuple(info['shape']))
+    # torch warns on read-only numpy arrays, the tensor is never written to
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        return torch.from_numpy(array)
+
+
+class EmbeddingCache:
+    """
+    Audio embeddings keyed by the hash of the normalized waveform and the encoder id.
+
+    Entries are fp16 safetensors (fp32 when a value does not fit fp16) read back memory-mapped, so
+    a voice track reused across jobs is neither encoded nor loaded into memory again. Embeddings
+    are checked for NaN once when stored. Hits refresh the file time; past `max_bytes` the least
+    recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(speech_array, model_id):
+        speech_array = np.ascontiguousarray(speech_array)
+        sha = hashlib.sha256()
+        sha.update(f"{model_id}:{speech_array.dtype.str}:{speech_array.shape}:".encode())
+        sha.update(memoryview(speech_array).cast('B'))
+        return sha.hexdigest()
+
+    def get(self, speech_array, model_id, encode):
+        """
+        Embedding of `speech_array` from the cache, computed with `encode()` and stored on a miss.
+
+        Returns:
+            Tensor: Memory-mapped embedding [T, blocks, C].
+        """
+        return self.get_many([speech_array], model_id, lambda missing: [encode()])[0]
+
+    def get_many(self, speech_arrays, model_id, encode_many):
+        """
+        Like `get` for several tracks; the misses are encoded together by `encode_many(arrays)`,
+        which returns one embedding per array.
+        """
+        paths = [os.path.join(self.cache_dir, self.key(speech_array, model_id) + '.safetensors')
+                 for speech_array in speech_arrays]
+        # an entry evicted by another process between listing and loading counts as a miss
+        embeddings = [self._load(path) for path in paths]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, encode_many([speech_arrays[i] for i in missing])):
+                stored = self._store(paths[i], embedding, model_id)
+                loaded = self._load(paths[i])
+                embeddings[i] = stored if loaded is None else loaded
+            self.evict(keep=set(paths))
+        return embeddings
+
+    @staticmethod
+    def _load(path):
+        """Memory-mapped entry at `path`, marked as just used; None when it does not exist."""
+        try:
+            os.utime(path)
+            return load_mmap(path)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _store(path, embedding, model_id):
+        """Writes `embedding` to `path`, validated once here so hits need no check; returns the stored tensor."""
+        if torch.isnan(embedding).any():
+            raise ValueError(f"Audio embedding for {os.path.basename(path)} contains NaN.")
+        dtype = torch.float16 if embedding.abs().max() < FP16_MAX else torch.float32
+        embedding = embedding.to(dtype).contiguous()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        save_file({'audio_emb': embedding}, tmp_path, metadata={'model_id': str(model_id)})
+        os.replace(tmp_path, path)
+        return embedding
+
+    def evict(self, keep=()):
+        """Removes least recently used entries, except those in `keep`, until the cache fits in `max_bytes`."""
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.safetensors'):
+                    path = os.path.join(self.cache_dir, name)
+                    entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path in keep:
+                    continue
+                os.remove(path)
+                total -= size
+                logging.info(f"Evicted {path} from the audio embedding cache.")
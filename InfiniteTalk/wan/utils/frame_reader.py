@@ -0,0 +1,110 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import queue
+import threading
+
+import torch
+from decord import VideoReader, cpu
+
+__all__ = ['FrameReader']
+
+
+class FrameReader:
+    """
+    Keeps a video open for a whole job and hands out frames as uint8 tensors (H, W, C), RGB.
+
+    Frames are decoded forward by a prefetch thread into a bounded queue, so reading increasing frame
+    ids (the chunk starts of a dubbing job) never reopens the container or seeks back to a keyframe.
+    A frame id behind the decode position, or more than `max_skip` frames ahead of it, stops the
+    thread and seeks instead; prefetching then resumes after that frame. Ids past the end read the
+    last frame.
+    """
+
+    def __init__(self, path, prefetch=8, max_skip=256):
+        self.path = path
+        self.reader = VideoReader(path, ctx=cpu(0))
+        self.num_frames = len(self.reader)
+        self.fps = self.reader.get_avg_fps()
+        self.prefetch = prefetch
+        self.max_skip = max_skip
+        # id of the next frame the prefetch thread will put in the queue
+        self.position = 0
+        self.queue = None
+        self.thread = None
+        self.stop_event = None
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, frame_id):
+        frame_id = min(frame_id, self.num_frames - 1)
+        if frame_id < 0:
+            frame_id += self.num_frames
+        if self.thread is None or not self.position <= frame_id <= self.position + self.max_skip:
+            return self._seek(frame_id)
+        while True:
+            item = self.queue.get()
+            if isinstance(item, Exception):
+                self._stop()
+                raise item
+            index, frame = item
+            self.position = index + 1
+            if index == frame_id:
+                return frame
+
+    def get_batch(self, frame_ids):
+        """Frames (N, H, W, C) for `frame_ids`, read in the given order."""
+        return torch.stack([self[frame_id] for frame_id in frame_ids])
+
+    def _seek(self, frame_id):
+        self._stop()
+        frame = torch.from_numpy(self.reader[frame_id].asnumpy())
+        self._start(frame_id + 1)
+        return frame
+
+    def _start(self, start):
+        self.position = start
+        if start >= self.num_frames:
+            return
+        self.queue = queue.Queue(maxsize=self.prefetch)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._decode, args=(start, self.queue, self.stop_event), daemon=True)
+        self.thread.start()
+
+    def _decode(self, start, frames, stop_event):
+        try:
+            self.reader.seek_accurate(start)
+            for index in range(start, self.num_frames):
+                frame = torch.from_numpy(self.reader.next().asnumpy())
+                if not self._put(frames, (index, frame), stop_event):
+                    return
+        except Exception as e:
+            self._put(frames, e, stop_event)
+
+    @staticmethod
+    def _put(frames, item, stop_event):
+        # a full queue must not keep the thread from seeing a stop request
+        while not stop_event.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.queue = None
+
+    def close(self):
+        self._stop()
+        self.reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
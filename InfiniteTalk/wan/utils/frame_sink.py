@@ -0,0 +1,240 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import os
+import subprocess
+
+import numpy as np
+import torch
+
+from .multitalk_utils import AudioPipe, VideoPipeWriter
+
+__all__ = ['FrameSink', 'EncoderSink', 'MemmapSink', 'HLSSink', 'TransformSink', 'HoldPadSink', 'frames_to_uint8']
+
+
+def frames_to_uint8(frames):
+    """
+    Quantizes frames (C, T, H, W) in [-1, 1] to uint8 (T, H, W, C), as `save_video_ffmpeg` does.
+    """
+    frames = (frames.float() + 1) / 2
+    frames = (frames * 255).clamp(0, 255).to(torch.uint8)
+    return frames.permute(1, 2, 3, 0).cpu().numpy()
+
+
+class FrameSink:
+    """
+    Receives the finished frames of a generation chunk by chunk, so the whole video never has to
+    be held in host memory. Every chunk is quantized to uint8 and handed on right away.
+    """
+
+    def __init__(self):
+        self.num_frames = 0
+
+    def write(self, frames):
+        """
+        Args:
+            frames (Tensor): Shape [C, T, H, W], in range [-1, 1].
+        """
+        self.write_uint8(frames_to_uint8(frames))
+
+    def write_uint8(self, frames):
+        """
+        Args:
+            frames (ndarray): Shape [T, H, W, C], uint8.
+        """
+        self._write(frames)
+        self.num_frames += len(frames)
+
+    def _write(self, frames):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EncoderSink(FrameSink):
+    """
+    Encodes frames as they arrive, muxing `audio_path` or the in-memory `audio` (cut to the video
+    length) in the same pass, together with any `renditions`.
+    """
+
+    def __init__(self, path, fps=25, audio_path=None, high_quality_save=False, renditions=None, audio=None,
+                 audio_rate=16000):
+        super().__init__()
+        self.path = path
+        self.writer = VideoPipeWriter(path, fps=fps, audio_path=audio_path, high_quality_save=high_quality_save,
+                                      renditions=renditions, audio=audio, audio_rate=audio_rate)
+
+    def _write(self, frames):
+        self.writer.write(frames)
+
+    def close(self):
+        self.writer.close()
+
+
+class MemmapSink(FrameSink):
+    """
+    Spills raw uint8 frames to a file, read back without loading via `frames()`.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.shape = None
+        self.file = open(path, 'wb')
+
+    def _write(self, frames):
+        if self.shape is None:
+            self.shape = frames.shape[1:]
+        assert frames.shape[1:] == self.shape, f"Frame size changed from {self.shape} to {frames.shape[1:]}"
+        self.file.write(np.ascontiguousarray(frames).tobytes())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def frames(self):
+        """Memory-mapped (T, H, W, C) uint8 view of everything written so far."""
+        if self.file is not None:
+            self.file.flush()
+        return np.memmap(self.path, dtype=np.uint8, mode='r', shape=(self.num_frames, *self.shape))
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class HLSSink(FrameSink):
+    """
+    Streams frames into one ffmpeg process with the HLS muxer: `index.m3u8` in `out_dir` gains a
+    MPEG-TS segment about every `segment_time` seconds as frames arrive, so playback can start after
+    the first chunk. The audio of `audio_path` (or the in-memory `audio`) is encoded once as a single
+    continuous stream, cut to the video length, so segment boundaries carry no AAC priming gaps.
+    `close` ends the playlist and, with `final_path`, remuxes it into one mp4 by stream copy.
+    """
+
+    def __init__(self, out_dir, audio_path=None, fps=25, final_path=None, crf=18, audio=None, audio_rate=16000,
+                 segment_time=2.0):
+        super().__init__()
+        self.out_dir = out_dir
+        self.audio_path = audio_path
+        self.audio = audio
+        self.audio_rate = audio_rate
+        self.audio_pipe = None
+        self.fps = fps
+        self.final_path = final_path
+        self.crf = crf
+        self.segment_time = segment_time
+        self.process = None
+        self.command = None
+        self.closed = False
+        os.makedirs(out_dir, exist_ok=True)
+        self.playlist = os.path.join(out_dir, 'index.m3u8')
+
+    def _start(self, height, width):
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", f"{self.fps}", "-i", "-",
+        ]
+        has_audio = self.audio_path is not None or self.audio is not None
+        if self.audio is not None:
+            self.audio_pipe = AudioPipe(self.audio, self.audio_rate)
+            command += self.audio_pipe.input_args()
+        elif self.audio_path is not None:
+            command += ["-i", self.audio_path]
+        command += ["-map", "0:v"]
+        if has_audio:
+            command += ["-map", "1:a", "-c:a", "aac", "-shortest"]
+        command += [
+            "-c:v", "libx264", "-crf", f"{self.crf}", "-pix_fmt", "yuv420p",
+            # a keyframe at every segment boundary, so segments are cut on time
+            "-force_key_frames", f"expr:gte(t,n_forced*{self.segment_time})",
+            "-f", "hls", "-hls_time", f"{self.segment_time}", "-hls_list_size", "0",
+            "-hls_playlist_type", "event", "-hls_flags", "temp_file",
+            "-hls_segment_filename", os.path.join(self.out_dir, "segment_%05d.ts"),
+            self.playlist,
+        ]
+        self.command = command
+        pass_fds = (self.audio_pipe.fd,) if self.audio_pipe is not None else ()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, pass_fds=pass_fds)
+        if self.audio_pipe is not None:
+            self.audio_pipe.start()
+
+    def _write(self, frames):
+        if self.process is None:
+            self._start(frames.shape[1], frames.shape[2])
+        self.process.stdin.write(memoryview(np.ascontiguousarray(frames)).cast('B'))
+        self.process.stdin.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        self.process = None
+        if self.audio_pipe is not None:
+            self.audio_pipe.join()
+            self.audio_pipe = None
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command)
+        if self.final_path is not None:
+            subprocess.run([
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-i", self.playlist,
+                "-c", "copy", "-bsf:a", "aac_adtstoasc",
+                self.final_path,
+            ], check=True)
+
+
+class TransformSink(FrameSink):
+    """
+    Applies `fn` to every float chunk (C, T, H, W) before passing it on to `sink`.
+    """
+
+    def __init__(self, sink, fn):
+        super().__init__()
+        self.sink = sink
+        self.fn = fn
+
+    def write(self, frames):
+        frames = self.fn(frames)
+        self.sink.write(frames)
+        self.num_frames += frames.shape[1]
+
+    def close(self):
+        self.sink.close()
+
+
+class HoldPadSink(FrameSink):
+    """
+    Holds the first frame for `lead` and the last frame for `trail` extra frames around what is
+    written to `sink`, e.g. to restore the silence trimmed off the audio before generation.
+    """
+
+    def __init__(self, sink, lead=0, trail=0):
+        super().__init__()
+        self.sink = sink
+        self.lead = lead
+        self.trail = trail
+        self.last = None
+
+    def _write(self, frames):
+        if self.last is None and self.lead > 0:
+            frames = np.concatenate([np.repeat(frames[:1], self.lead, axis=0), frames])
+        self.last = frames[-1:]
+        self.sink.write_uint8(frames)
+
+    def close(self):
+        if self.last is not None and self.trail > 0:
+            self.sink.write_uint8(np.repeat(self.last, self.trail, axis=0))
+            self.last = None
+        self.sink.close()
@@ -0,0 +1,267 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # not on POSIX hosts, the cache is then only shared between the threads of one process
+    fcntl = None
+
+__all__ = ['MediaCache', 'configure_media_cache', 'get_media_cache', 'probe_media', 'ingest_video', 'extract_audio']
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'infinitetalk', 'media')
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+# entries used this recently are never evicted, another job may still be reading them
+DEFAULT_MIN_AGE = 3600
+# codecs decord cannot decode reliably, transcoded to H.264 on ingest
+TRANSCODE_CODECS = ('av1',)
+
+
+def probe_media(path):
+    """
+    One ffprobe call for `path`.
+
+    Returns:
+        dict: `codec`, `fps`, `width`, `height`, `duration` (s), `num_frames` of the first video
+            stream (None without one) and `audio_codec` (None without an audio stream).
+    """
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    probe = json.loads(result.stdout.decode())
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+
+    fps = None
+    if video.get('avg_frame_rate', '0/0') != '0/0':
+        num, den = video['avg_frame_rate'].split('/')
+        fps = float(num) / float(den)
+    duration = video.get('duration', probe.get('format', {}).get('duration'))
+    return dict(
+        codec=video.get('codec_name'),
+        fps=fps,
+        width=video.get('width'),
+        height=video.get('height'),
+        duration=float(duration) if duration is not None else None,
+        num_frames=int(video['nb_frames']) if 'nb_frames' in video else None,
+        audio_codec=audio.get('codec_name'),
+    )
+
+
+class MediaCache:
+    """
+    Content-addressed store for the probe result and the derived files (transcodes, extracted
+    audio) of input media.
+
+    Every source gets a directory named by the SHA-256 of its content, so concurrent jobs never
+    write to the same scratch path and repeat jobs on the same file reuse everything. Hashes are
+    remembered per (path, size, mtime), so an unchanged file is not even read again. Files are
+    written under a temporary name and renamed into place. When the cache grows past `max_bytes`
+    the least recently used entries are removed, those used in the last `min_age` seconds only if
+    the older ones do not bring it back under quota.
+
+    The hash index and eviction are shared by all processes on the cache directory: both run under
+    an exclusive lock on `.lock` there, and the index is rewritten atomically. Without `fcntl`
+    (non-POSIX hosts) the lock only covers the threads of one process, so processes must not share
+    a cache directory there.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, min_age=DEFAULT_MIN_AGE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, 'hash_index.json')
+        self.lock_path = os.path.join(cache_dir, '.lock')
+
+    @contextmanager
+    def _locked(self):
+        # the thread lock orders threads of this process, flock orders processes
+        if fcntl is None:
+            with self.lock:
+                yield
+            return
+        with self.lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        index_key = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        with self._locked():
+            index = self._read_index()
+            if index_key in index:
+                return index[index_key]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with self._locked():
+            index = self._read_index()
+            index[index_key] = digest
+            self._write_atomic(self.index_path, json.dumps(index).encode())
+        return digest
+
+    def entry(self, path):
+        """Cache directory of `path`, marked as just used."""
+        entry_dir = os.path.join(self.cache_dir, self.file_hash(path))
+        # under the lock, so eviction sees the entry as just used
+        with self._locked():
+            os.makedirs(entry_dir, exist_ok=True)
+            os.utime(entry_dir)
+        return entry_dir
+
+    def probe(self, path):
+        """`probe_media(path)`, stored in the entry."""
+        probe_path = os.path.join(self.entry(path), 'probe.json')
+        if os.path.exists(probe_path):
+            with open(probe_path) as f:
+                return json.load(f)
+        info = probe_media(path)
+        self._write_atomic(probe_path, json.dumps(info).encode())
+        return info
+
+    def derived(self, path, name, make):
+        """
+        Path of the derived file `name` of `path`, created with `make(out_path)` on a miss.
+        """
+        entry_dir = self.entry(path)
+        out_path = os.path.join(entry_dir, name)
+        if not os.path.exists(out_path):
+            stem, ext = os.path.splitext(name)
+            tmp_path = os.path.join(entry_dir, f"{stem}.{os.getpid()}.{threading.get_ident()}.tmp{ext}")
+            try:
+                make(tmp_path)
+                os.replace(tmp_path, out_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.evict(keep=entry_dir)
+        return out_path
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits in `max_bytes` and drops their
+        hashes from the index. Entries younger than `min_age` go last, only when the cache is still
+        over quota without them; `keep` is never removed.
+        """
+        with self._locked():
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                entry_dir = os.path.join(self.cache_dir, name)
+                if not os.path.isdir(entry_dir):
+                    continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+                    entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+                except FileNotFoundError:
+                    # a temporary file was renamed or removed while listing
+                    continue
+            total = sum(size for _, size, _ in entries)
+            evicted = set()
+            entries = [entry for entry in sorted(entries) if entry[2] != keep]
+            # old entries first, then recent ones (oldest first) if a burst still overflows the quota
+            old = [entry for entry in entries if now - entry[0] >= self.min_age]
+            recent = [entry for entry in entries if now - entry[0] < self.min_age]
+            for mtime, size, entry_dir in old + recent:
+                if total <= self.max_bytes:
+                    break
+                if now - mtime < self.min_age:
+                    logging.warning(f"Media cache still over quota, evicting {entry_dir} used {now - mtime:.0f}s ago.")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+                evicted.add(os.path.basename(entry_dir))
+                logging.info(f"Evicted {entry_dir} from the media cache.")
+            if evicted:
+                index = self._read_index()
+                index = {key: digest for key, digest in index.items() if digest not in evicted}
+                self._write_atomic(self.index_path, json.dumps(index).encode())
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+_caches = {}
+_default_cache_dir = DEFAULT_CACHE_DIR
+
+
+def configure_media_cache(cache_dir=None, max_bytes=None):
+    """Sets the cache used when no `cache_dir` is given, e.g. from the command line."""
+    global _default_cache_dir
+    if cache_dir is not None:
+        _default_cache_dir = cache_dir
+    return get_media_cache(max_bytes=max_bytes)
+
+
+def get_media_cache(cache_dir=None, max_bytes=None):
+    """Process-wide `MediaCache` for `cache_dir`, so the script and the pipeline share one index."""
+    cache_dir = _default_cache_dir if cache_dir is None else cache_dir
+    if cache_dir not in _caches:
+        _caches[cache_dir] = MediaCache(cache_dir, DEFAULT_MAX_BYTES if max_bytes is None else max_bytes)
+    elif max_bytes is not None:
+        _caches[cache_dir].max_bytes = max_bytes
+    return _caches[cache_dir]
+
+
+def ingest_video(path, cache=None):
+    """
+    Probes a video input once and transcodes it to H.264 only when its codec needs it.
+
+    Returns:
+        (path, info): The path to decode from (the source or its cached transcode) and the probe dict.
+    """
+    cache = get_media_cache() if cache is None else cache
+    info = cache.probe(path)
+    if info['codec'] not in TRANSCODE_CODECS:
+        return path, info
+
+    def transcode(out_path):
+        logging.info(f"Converting {path} from {info['codec']} to H.264...")
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', path, '-c:v', 'libx264', '-c:a', 'copy', out_path],
+            check=True)
+
+    return cache.derived(path, 'video_h264.mp4', transcode), dict(info, codec='h264')
+
+
+def extract_audio(path, sample_rate=16000, cache=None):
+    """
+    Path of the audio track of `path` as 16-bit stereo wav at `sample_rate`, kept in the cache.
+    """
+    cache = get_media_cache() if cache is None else cache
+
+    def extract(out_path):
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', path, '-vn', '-acodec', 'pcm_s16le',
+             '-ar', f"{sample_rate}", '-ac', '2', out_path],
+            check=True)
+
+    return cache.derived(path, f'audio_{sample_rate}.wav', extract)
@@ -0,0 +1,62 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import time
+
+import torch
+
+__all__ = ['MemoryPolicy', 'memory_policy', 'torch_gc']
+
+
+class MemoryPolicy:
+    """
+    Decides when to hand the CUDA caching allocator's pool back to the driver.
+
+    `empty_cache` + `ipc_collect` synchronize the device and force fresh cudaMallocs afterwards,
+    so the pool is only released when reserved memory is above `threshold` of the device memory,
+    or when forced at component swaps (e.g. offloading T5/CLIP/DiT to CPU). Every release is
+    counted and timed per reason.
+    """
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {}
+        self.skipped = 0
+
+    def under_pressure(self, device=None):
+        device = torch.cuda.current_device() if device is None else device
+        total = torch.cuda.get_device_properties(device).total_memory
+        return torch.cuda.memory_reserved(device) > self.threshold * total
+
+    def release(self, force=False, device=None):
+        if not torch.cuda.is_available() or not torch.cuda.is_initialized():
+            return False
+        if force:
+            reason = 'swap'
+        elif self.under_pressure(device):
+            reason = 'pressure'
+        else:
+            self.skipped += 1
+            return False
+
+        start = time.perf_counter()
+        torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
+        elapsed = time.perf_counter() - start
+
+        count, total = self.stats.get(reason, (0, 0.0))
+        self.stats[reason] = (count + 1, total + elapsed)
+        return True
+
+    def summary(self):
+        parts = [f"{reason}: {count} releases, {total * 1000:.1f} ms" for reason, (count, total) in self.stats.items()]
+        parts.append(f"skipped: {self.skipped}")
+        return "cache release " + ", ".join(parts)
+
+
+memory_policy = MemoryPolicy()
+
+
+def torch_gc(force=False):
+    return memory_policy.release(force=force)
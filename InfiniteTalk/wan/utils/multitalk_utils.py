@@ -16,12 +16,14 @@ import uuid
 from tqdm import tqdm
 import numpy as np
 import subprocess
+import threading
 import soundfile as sf
 import torchvision
 import binascii
 import os.path as osp
 from skimage import color
 
+
 VID_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
 ASPECT_RATIO_627 = {
      '0.26': ([320, 1216], 1), '0.38': ([384, 1024], 1), '0.50': ([448, 896], 1), '0.67': ([512, 768], 1), 
@@ -40,9 +42,6 @@ ASPECT_RATIO_960 = {
 
 
 
-def torch_gc():
-    torch.cuda.empty_cache()
-    torch.cuda.ipc_collect()
 
 
 
@@ -66,6 +65,104 @@ def split_token_counts_and_frame_ids(T, token_frame, world_size, rank):
     return counts_filtered, frame_ids
 
 
+def plan_chunk_starts(num_audio_frames, frame_num, motion_frame, max_frames_num):
+    """
+    Start frame of every chunk of the streaming loop, in generation order.
+
+    Mirrors the loop: chunks advance by `frame_num - motion_frame` and the chunk whose
+    window reaches `min(max_frames_num, num_audio_frames)` is the last one.
+    """
+    starts = [0]
+    if max_frames_num <= frame_num:
+        return starts
+    start = 0
+    while True:
+        start += frame_num - motion_frame
+        starts.append(start)
+        if start + frame_num >= min(max_frames_num, num_audio_frames):
+            return starts
+
+
+def plan_chunks(num_audio_frames, frame_num, motion_frame, max_frames_num, shrink_tail=True):
+    """
+    Chunk schedule of the streaming loop as (start, length) pairs, plus the number of generated
+    frames that fall past the end of the output and are trimmed.
+
+    Every chunk is `frame_num` frames long, except that with `shrink_tail` the last one is cut to
+    the shortest 4n+1 length that still reaches `min(max_frames_num, num_audio_frames)` (and, after
+    the first chunk, still adds frames beyond the `motion_frame` overlap).
+    """
+    starts = plan_chunk_starts(num_audio_frames, frame_num, motion_frame, max_frames_num)
+    total = min(max_frames_num, num_audio_frames)
+    lengths = [frame_num] * len(starts)
+    if shrink_tail:
+        needed = total - starts[-1]
+        if len(starts) > 1:
+            needed = max(needed, motion_frame + 1)
+        lengths[-1] = min(frame_num, (max(needed, 1) + 2) // 4 * 4 + 1)
+    wasted = max(0, starts[-1] + lengths[-1] - total)
+    return list(zip(starts, lengths)), wasted
+
+
+def build_audio_windows(full_audio_embs, window=5, device='cpu', dtype=torch.float32):
+    """
+    Sliding audio windows of every speaker as one strided view.
+
+    The embeddings ([T_i, blocks, C] each) are moved to `device` in `dtype` once and edge-padded so
+    out-of-range frames read the first / last frame, like the clamped per-chunk gather did, then
+    unfolded along time. Frames [s, s + n) of the result are the windows of a chunk, without a copy.
+
+    Returns:
+        Tensor: Shape [num_speakers, max(T_i), window, blocks, C].
+    """
+    half = window // 2
+    length = max(len(emb) for emb in full_audio_embs)
+    padded = []
+    for emb in full_audio_embs:
+        emb = emb.to(device=device, dtype=dtype)
+        head = emb[:1].expand(half, *emb.shape[1:])
+        tail = emb[-1:].expand(length - len(emb) + half, *emb.shape[1:])
+        padded.append(torch.cat([head, emb, tail]))
+    return torch.stack(padded).unfold(1, window, 1).permute(0, 1, 4, 2, 3)
+
+
+class LazyAudioWindows:
+    """
+    The windows of `build_audio_windows`, gathered chunk by chunk from host embeddings (e.g. the
+    memory-mapped entries of the embedding cache), so only the rows a chunk reads are loaded and
+    moved to `device`.
+
+    `mirror_lengths[i]` frames of speaker i are appended as the mirrored tail of its embedding,
+    by index instead of by copying the embedding. Index as `windows[:, start:end]`.
+    """
+
+    def __init__(self, full_audio_embs, window=5, device='cpu', dtype=torch.float32, mirror_lengths=None):
+        self.embs = full_audio_embs
+        self.half = window // 2
+        self.window = window
+        self.device = device
+        self.dtype = dtype
+        self.mirror_lengths = mirror_lengths or [0] * len(full_audio_embs)
+        self.length = max(len(emb) + miss for emb, miss in zip(full_audio_embs, self.mirror_lengths))
+
+    def __len__(self):
+        return len(self.embs)
+
+    def __getitem__(self, key):
+        speakers, frames = key
+        assert speakers == slice(None) and frames.step is None, "Only windows[:, start:end] is supported"
+        start, end = frames.start or 0, min(frames.stop, self.length)
+        windows = []
+        for emb, miss in zip(self.embs, self.mirror_lengths):
+            num = len(emb)
+            # edge-padded frame ids, then the mirrored tail T + j -> T - 1 - j
+            index = torch.arange(start - self.half, end + self.half).clamp(0, num + miss - 1)
+            index = torch.where(index >= num, 2 * num - 1 - index, index)
+            rows = emb[index].to(device=self.device, dtype=self.dtype)
+            windows.append(rows.unfold(0, self.window, 1).permute(0, 3, 1, 2))
+        return torch.stack(windows)
+
+
 def normalize_and_scale(column, source_range, target_range, epsilon=1e-8):
 
     source_min, source_max = source_range
@@ -97,7 +194,6 @@ def calculate_x_ref_attn_map(visual_q, ref_k, ref_target_masks, mode='mean', att
     x_ref_attn_map_source = x_ref_attn_map_source.to(visual_q.dtype)
 
     for class_idx, ref_target_mask in enumerate(ref_target_masks):
-        torch_gc()
         ref_target_mask = ref_target_mask[None, None, None, ...]
         x_ref_attnmap = x_ref_attn_map_source * ref_target_mask
         x_ref_attnmap = x_ref_attnmap.sum(-1) / ref_target_mask.sum() # B, H, x_seqlens, ref_seqlens --> B, H, x_seqlens
@@ -112,7 +208,6 @@ def calculate_x_ref_attn_map(visual_q, ref_k, ref_target_masks, mode='mean', att
     
     del attn
     del x_ref_attn_map_source
-    torch_gc()
 
     return torch.concat(x_ref_attn_maps, dim=0)
 
@@ -234,83 +329,169 @@ def cache_video(tensor,
         writer.close()
         return cache_file
 
-def save_video_ffmpeg(gen_video_samples, save_path, vocal_audio_list, fps=25, quality=5, high_quality_save=False):
-    
-    def save_video(frames, save_path, fps, quality=9, ffmpeg_params=None):
-        writer = imageio.get_writer(
-            save_path, fps=fps, quality=quality, ffmpeg_params=ffmpeg_params
-        )
-        for frame in tqdm(frames, desc="Saving video"):
-            frame = np.array(frame)
-            writer.append_data(frame)
-        writer.close()
-    save_path_tmp = save_path + "-temp.mp4"
-
-    if high_quality_save:
-        cache_video(
-                    tensor=gen_video_samples.unsqueeze(0),
-                    save_file=save_path_tmp,
-                    fps=fps,
-                    nrow=1,
-                    normalize=True,
-                    value_range=(-1, 1)
-                    )
-    else:
-        video_audio = (gen_video_samples+1)/2 # C T H W
-        video_audio = video_audio.permute(1, 2, 3, 0).cpu().numpy()
-        video_audio = np.clip(video_audio * 255, 0, 255).astype(np.uint8)  # to [0, 255]
-        save_video(video_audio, save_path_tmp, fps=fps, quality=quality)
-
-
-    # crop audio according to video length
-    _, T, _, _ = gen_video_samples.shape
-    duration = T / fps
-    save_path_crop_audio = save_path + "-cropaudio.wav"
-    final_command = [
-        "ffmpeg",
-        "-i",
-        vocal_audio_list[0],
-        "-t",
-        f'{duration}',
-        save_path_crop_audio,
-    ]
-    subprocess.run(final_command, check=True)
-
-    save_path = save_path + ".mp4"
-    if high_quality_save:
-        final_command = [
-            "ffmpeg",
-            "-y",
-            "-i", save_path_tmp,
-            "-i", save_path_crop_audio,
-            "-c:v", "libx264",
-            "-crf", "0",
-            "-preset", "veryslow",
-            "-c:a", "aac", 
-            "-shortest",
-            save_path,
-        ]
-        subprocess.run(final_command, check=True)
-        os.remove(save_path_tmp)
-        os.remove(save_path_crop_audio)
-    else:
-        final_command = [
-            "ffmpeg",
-            "-y",
-            "-i",
-            save_path_tmp,
-            "-i",
-            save_path_crop_audio,
-            "-c:v",
-            "libx264",
-            "-c:a",
-            "aac",
-            "-shortest",
-            save_path,
+def rendition_path(save_path, height):
+    """Output path of the `height`p rendition of `save_path`."""
+    root, ext = os.path.splitext(save_path)
+    return f"{root}_{height}p{ext}"
+
+
+class AudioPipe:
+    """
+    Feeds an in-memory mono waveform to an ffmpeg input through an inherited pipe, so audio that
+    only exists as an array is muxed without writing a wav. Pass `fd` in `pass_fds`, add
+    `input_args` to the command and call `start` once the process is running.
+    """
+
+    def __init__(self, audio, sample_rate=16000):
+        self.data = np.ascontiguousarray(audio, dtype=np.float32)
+        self.sample_rate = sample_rate
+        self.fd, self.write_fd = os.pipe()
+        self.thread = None
+
+    def input_args(self):
+        return ["-f", "f32le", "-ar", f"{self.sample_rate}", "-ac", "1", "-i", f"pipe:{self.fd}"]
+
+    def start(self):
+        os.close(self.fd)
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+
+    def _feed(self):
+        try:
+            with os.fdopen(self.write_fd, 'wb') as f:
+                f.write(memoryview(self.data).cast('B'))
+        except BrokenPipeError:
+            # ffmpeg stops reading once the output is cut to the video length
+            pass
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+
+
+class VideoPipeWriter:
+    """
+    One ffmpeg process that takes raw rgb24 frames on stdin and muxes the first audio track in the
+    same pass: no temp files and a single encode. The audio is cut to `duration` seconds when known,
+    otherwise to the video length with `-shortest`. The encoder starts on the first `write`.
+
+    The audio comes from `audio_path` or, as a mono float array at `audio_rate`, from `audio`.
+
+    `renditions` is a list of (height, bitrate) pairs. Every rendition is scaled from the same input
+    frames inside ffmpeg's filter graph and encoded next to the main output by the same process, to
+    `rendition_path(save_path, height)`. `crf` sets the x264 CRF of the main output (libx264's default
+    when None), `high_quality_save` overrides it with lossless.
+    """
+
+    def __init__(self, save_path, fps=25, audio_path=None, duration=None, high_quality_save=False, renditions=None,
+                 audio=None, audio_rate=16000, crf=None):
+        self.save_path = save_path
+        self.fps = fps
+        self.audio_path = audio_path
+        self.audio = audio
+        self.audio_rate = audio_rate
+        self.audio_pipe = None
+        self.duration = duration
+        self.high_quality_save = high_quality_save
+        self.crf = crf
+        self.renditions = renditions or []
+        self.process = None
+        self.command = None
+
+    def _start(self, height, width):
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", f"{self.fps}", "-i", "-",
         ]
-        subprocess.run(final_command, check=True)
-        os.remove(save_path_tmp)
-        os.remove(save_path_crop_audio)
+        has_audio = self.audio_path is not None or self.audio is not None
+        if has_audio and self.duration is not None:
+            command += ["-t", f"{self.duration}"]
+        if self.audio is not None:
+            self.audio_pipe = AudioPipe(self.audio, self.audio_rate)
+            command += self.audio_pipe.input_args()
+        elif self.audio_path is not None:
+            command += ["-i", self.audio_path]
+
+        video_maps = ["0:v"]
+        if self.renditions:
+            num = len(self.renditions) + 1
+            graph = f"[0:v]split={num}" + "".join(f"[v{i}]" for i in range(num))
+            for i, (rendition_height, _) in enumerate(self.renditions, start=1):
+                graph += f";[v{i}]scale=-2:{rendition_height}[s{i}]"
+            command += ["-filter_complex", graph]
+            video_maps = ["[v0]"] + [f"[s{i}]" for i in range(1, num)]
+
+        outputs = [(self.save_path, None)] + [
+            (rendition_path(self.save_path, rendition_height), bitrate) for rendition_height, bitrate in self.renditions]
+        for video_map, (path, bitrate) in zip(video_maps, outputs):
+            command += ["-map", video_map]
+            if has_audio:
+                command += ["-map", "1:a", "-c:a", "aac", "-shortest"]
+            command += ["-c:v", "libx264", "-pix_fmt", "yuv420p"]
+            if bitrate is not None:
+                command += ["-b:v", f"{bitrate}"]
+            elif self.high_quality_save:
+                command += ["-crf", "0", "-preset", "veryslow"]
+            elif self.crf is not None:
+                command += ["-crf", f"{self.crf}"]
+            command.append(path)
+        self.command = command
+        pass_fds = (self.audio_pipe.fd,) if self.audio_pipe is not None else ()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, pass_fds=pass_fds)
+        if self.audio_pipe is not None:
+            self.audio_pipe.start()
+
+    def write(self, frames):
+        """
+        Args:
+            frames (ndarray): Shape [T, H, W, 3], uint8.
+        """
+        if self.process is None:
+            self._start(frames.shape[1], frames.shape[2])
+        self.process.stdin.write(memoryview(np.ascontiguousarray(frames)).cast('B'))
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        self.process = None
+        if self.audio_pipe is not None:
+            self.audio_pipe.join()
+            self.audio_pipe = None
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command)
+
+
+def save_video_ffmpeg(gen_video_samples, save_path, vocal_audio_list, fps=25, quality=5, high_quality_save=False, chunk_size=32, renditions=None, hold_pad=None):
+    """
+    Encodes `gen_video_samples` (C, T, H, W) in [-1, 1] with the first audio track (a path or a
+    16 kHz mono array), cut to the video length, into `save_path`.mp4 in one ffmpeg pass. Frames are
+    quantized `chunk_size` at a time into a reused uint8 buffer, so no full-video uint8 copy is made.
+    `renditions` ((height, bitrate) pairs) are encoded from the same frames in the same pass, see
+    `VideoPipeWriter`. `hold_pad` (lead, trail) holds the first and last frame for that many extra
+    frames. `quality` (0-10) maps to the x264 CRF the way imageio did, 5 is CRF 25.
+    """
+    C, T, H, W = gen_video_samples.shape
+    assert T > 0, "no frames to save"
+    lead, trail = hold_pad or (0, 0)
+    audio = vocal_audio_list[0]
+    audio_kwargs = dict(audio=audio) if isinstance(audio, np.ndarray) else dict(audio_path=audio)
+    writer = VideoPipeWriter(save_path + ".mp4", fps=fps, duration=(lead + T + trail) / fps, high_quality_save=high_quality_save,
+                             renditions=renditions, crf=int((1 - quality / 10) * 51), **audio_kwargs)
+    buffer = torch.empty(chunk_size, H, W, C, dtype=torch.uint8)
+    try:
+        for start in tqdm(range(0, T, chunk_size), desc="Saving video"):
+            frames = gen_video_samples[:, start:start + chunk_size].float().add(1).div_(2).mul_(255).clamp_(0, 255)
+            num = frames.shape[1]
+            buffer[:num].copy_(frames.permute(1, 2, 3, 0))
+            if start == 0 and lead > 0:
+                writer.write(np.repeat(buffer[:1].numpy(), lead, axis=0))
+            writer.write(buffer[:num].numpy())
+        if trail > 0:
+            writer.write(np.repeat(buffer[num - 1:num].numpy(), trail, axis=0))
+    finally:
+        writer.close()
 
 
 class MomentumBuffer:
@@ -358,8 +539,193 @@ def adaptive_projected_guidance(
 
 
 
-def match_and_blend_colors(source_chunk: torch.Tensor, reference_image: torch.Tensor, strength: float) -> torch.Tensor:
+def detect_face_box(image):
+    """
+    Finds the largest frontal face with the OpenCV Haar cascade.
+
+    Args:
+        image (np.ndarray): RGB image (H, W, C) in uint8.
+
+    Returns:
+        tuple or None: (top, left, bottom, right) in pixels, None if no face is found.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    detector = cv2.CascadeClassifier(osp.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+    faces = detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(32, 32))
+    if len(faces) == 0:
+        return None
+    x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+    return int(y), int(x), int(y + h), int(x + w)
+
+
+def expand_box_to_bucket(box, image_size, margin=0.6, bucket_config=ASPECT_RATIO_627, bucket_scale=1.0):
     """
+    Grows a face / person box to head-and-shoulders and snaps it to the aspect ratio of a bucket.
+
+    Args:
+        box (tuple): (top, left, bottom, right) in pixels.
+        image_size (tuple): (H, W) of the image the box lives in.
+        margin (float): Padding around the box as a fraction of its larger side, doubled below for the shoulders.
+        bucket_config (dict): Bucket table, e.g. `ASPECT_RATIO_627`.
+        bucket_scale (float): Scales the bucket size down (rounded to multiples of 16) to render fewer tokens.
+
+    Returns:
+        tuple: (top, left, box_h, box_w) of the crop and (target_h, target_w) of the render size.
+    """
+    H, W = image_size
+    top, left, bottom, right = box
+    pad = margin * max(bottom - top, right - left)
+    top, left, bottom, right = top - pad, left - pad, bottom + 2 * pad, right + pad
+    center_y, center_x = (top + bottom) / 2, (left + right) / 2
+    box_h, box_w = bottom - top, right - left
+
+    ratio = box_h / box_w
+    closest_bucket = sorted(list(bucket_config.keys()), key=lambda x: abs(float(x) - ratio))[0]
+    target_h, target_w = bucket_config[closest_bucket][0]
+    target_h = max(16, int(round(target_h * bucket_scale / 16)) * 16)
+    target_w = max(16, int(round(target_w * bucket_scale / 16)) * 16)
+
+    # grow the short side to the bucket ratio, then shrink to fit the image
+    if box_h / box_w < target_h / target_w:
+        box_h = box_w * target_h / target_w
+    else:
+        box_w = box_h * target_w / target_h
+    box_w = min(box_w, W, H * target_w / target_h)
+    box_h = box_w * target_h / target_w
+    box_h, box_w = int(round(box_h)), int(round(box_w))
+
+    top = int(round(min(max(center_y - box_h / 2, 0), H - box_h)))
+    left = int(round(min(max(center_x - box_w / 2, 0), W - box_w)))
+    return (top, left, box_h, box_w), (target_h, target_w)
+
+
+def feather_composite(video, plate, box, feather=16):
+    """
+    Pastes generated crop frames back onto a static plate with a linear feather.
+
+    Args:
+        video (torch.Tensor): Generated crop (C, T, h, w) in range [-1, 1].
+        plate (torch.Tensor): Static background (C, 1, H, W) in range [-1, 1].
+        box (tuple): (top, left, box_h, box_w) of the crop inside the plate.
+        feather (int): Width of the blend ramp in plate pixels. Edges on the plate border are not feathered.
+
+    Returns:
+        torch.Tensor: Composited video (C, T, H, W).
+    """
+    C, T, _, _ = video.shape
+    _, _, H, W = plate.shape
+    top, left, box_h, box_w = box
+
+    frames = torch.nn.functional.interpolate(
+        video.permute(1, 0, 2, 3), size=(box_h, box_w), mode='bilinear', align_corners=False).permute(1, 0, 2, 3)
+
+    def ramp(length, start, total):
+        pos = torch.arange(length, dtype=torch.float32)
+        dist_start = pos + 1 if start > 0 else torch.full_like(pos, float('inf'))
+        dist_end = length - pos if start + length < total else torch.full_like(pos, float('inf'))
+        return (torch.minimum(dist_start, dist_end) / max(feather, 1)).clamp(max=1.0)
+
+    mask = (ramp(box_h, top, H)[:, None] * ramp(box_w, left, W)[None, :]).to(video.dtype)
+
+    out = plate.to(video.dtype).expand(C, T, H, W).clone()
+    region = out[:, :, top:top + box_h, left:left + box_w]
+    out[:, :, top:top + box_h, left:left + box_w] = mask * frames + (1 - mask) * region
+    return out
+
+
+# sRGB <-> CIE XYZ (D65) and the 2 degree D65 white point, as in skimage.color
+XYZ_FROM_RGB = torch.tensor([[0.412453, 0.357580, 0.180423],
+                             [0.212671, 0.715160, 0.072169],
+                             [0.019334, 0.119193, 0.950227]], dtype=torch.float64)
+RGB_FROM_XYZ = torch.linalg.inv(XYZ_FROM_RGB)
+D65_WHITE = torch.tensor([0.95047, 1.0, 1.08883], dtype=torch.float64)
+
+
+def rgb_to_lab(rgb):
+    """
+    sRGB in [0, 1] (channels last) to CIE Lab, matching `skimage.color.rgb2lab`.
+    """
+    linear = torch.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = linear @ XYZ_FROM_RGB.to(rgb).T / D65_WHITE.to(rgb)
+    f = torch.where(xyz > 0.008856, xyz.clamp(min=0) ** (1 / 3), 7.787 * xyz + 16 / 116)
+    fx, fy, fz = f.unbind(-1)
+    return torch.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)], dim=-1)
+
+
+def lab_to_rgb(lab):
+    """
+    CIE Lab (channels last) to sRGB clipped to [0, 1], matching `skimage.color.lab2rgb`.
+    """
+    L, a, b = lab.unbind(-1)
+    fy = (L + 16) / 116
+    f = torch.stack([a / 500 + fy, fy, (fy - b / 200).clamp(min=0)], dim=-1)
+    xyz = torch.where(f > 0.2068966, f ** 3, (f - 16 / 116) / 7.787) * D65_WHITE.to(lab)
+    linear = xyz @ RGB_FROM_XYZ.to(lab).T
+    rgb = torch.where(linear > 0.0031308, 1.055 * linear.clamp(min=0) ** (1 / 2.4) - 0.055, linear * 12.92)
+    return rgb.clamp(0, 1)
+
+
+def color_reference_stats(reference_image):
+    """
+    Per-channel Lab mean and std of the reference image (B, C, 1, H, W) in [-1, 1], computed once per job.
+    """
+    ref = ((reference_image[0, :, 0].float() + 1) / 2).clamp(0, 1).permute(1, 2, 0)
+    ref_lab = rgb_to_lab(ref)
+    return ref_lab.mean(dim=(0, 1)), ref_lab.std(dim=(0, 1), unbiased=False)
+
+
+def match_and_blend_colors(source_chunk: torch.Tensor, reference_image: torch.Tensor, strength: float,
+                           reference_stats=None, frames_per_batch=16) -> torch.Tensor:
+    """
+    Matches the color of a source video chunk to a reference image and blends with the original.
+
+    Same transfer as `match_and_blend_colors_skimage`, vectorized over frames in torch on the chunk's
+    device: every frame's Lab statistics are moved onto the reference's, `frames_per_batch` frames at
+    a time to bound the temporaries.
+
+    Args:
+        source_chunk (torch.Tensor): The video chunk to be color-corrected (B, C, T, H, W) in range [-1, 1].
+                                     Assumes B=1 (batch size of 1).
+        reference_image (torch.Tensor): The reference image (B, C, 1, H, W) in range [-1, 1].
+        strength (float): The strength of the color correction (0.0 to 1.0).
+        reference_stats (tuple): Lab (mean, std) of the reference from `color_reference_stats`,
+                                 computed from `reference_image` when not given.
+
+    Returns:
+        torch.Tensor: The color-corrected and blended video chunk.
+    """
+    if strength == 0.0:
+        return source_chunk
+
+    if not 0.0 <= strength <= 1.0:
+        raise ValueError(f"Strength must be between 0.0 and 1.0, got {strength}")
+
+    if reference_stats is None:
+        reference_stats = color_reference_stats(reference_image)
+    mean_ref, std_ref = (stat.to(source_chunk.device, torch.float32) for stat in reference_stats)
+
+    output = torch.empty_like(source_chunk)
+    for start in range(0, source_chunk.shape[2], frames_per_batch):
+        # (1, C, t, H, W) -> (t, H, W, C) in [0, 1]
+        source = ((source_chunk[0, :, start:start + frames_per_batch].float() + 1) / 2).clamp(0, 1)
+        source = source.permute(1, 2, 3, 0)
+        source_lab = rgb_to_lab(source)
+        mean_src = source_lab.mean(dim=(1, 2), keepdim=True)
+        std_src = source_lab.std(dim=(1, 2), keepdim=True, unbiased=False)
+        # a flat source channel takes the reference mean (float32 leaves rounding noise in its std)
+        corrected_lab = torch.where(std_src <= 1e-5, mean_ref.expand_as(source_lab),
+                                    (source_lab - mean_src) * (std_ref / std_src) + mean_ref)
+        blended = (1 - strength) * source + strength * lab_to_rgb(corrected_lab)
+        output[0, :, start:start + frames_per_batch] = (blended * 2 - 1).permute(3, 0, 1, 2).to(output.dtype)
+    return output
+
+
+def match_and_blend_colors_skimage(source_chunk: torch.Tensor, reference_image: torch.Tensor, strength: float) -> torch.Tensor:
+    """
+    Per-frame skimage reference implementation of `match_and_blend_colors`.
+
     Matches the color of a source video chunk to a reference image and blends with the original.
 
     Args: